@@ -0,0 +1,305 @@
+/* retention.vala
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation, either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ */
+
+namespace Zeitgeist
+{
+    /**
+     * Retention policies limit how long events are kept in the log.
+     *
+     * Each policy consists of an event template and a maximal age, in
+     * milliseconds. Events are deleted once they're older than the
+     * maximal age of any policy with a template they match; so to keep
+     * the events of some actors for 90 days and all others for a year,
+     * add a policy for each of them, and one with an empty template.
+     */
+    [DBus (name = "org.gnome.zeitgeist.Retention")]
+    public interface RemoteRetention: Object
+    {
+        public abstract void add_policy (string policy_id,
+            [DBus (signature = "(asaasay)")] Variant event_template,
+            int64 max_age) throws Error;
+        [DBus (signature = "a{s((asaasay)x)}")]
+        public abstract Variant get_policies () throws Error;
+        public abstract void remove_policy (string policy_id)
+            throws Error;
+
+        public signal void policy_added (string policy_id,
+            [DBus (signature = "(asaasay)")] Variant event_template,
+            int64 max_age);
+        public signal void policy_removed (string policy_id);
+    }
+
+    namespace RetentionPolicies
+    {
+        private const string SIG_POLICY = "(("+Utils.SIG_EVENT+")x)";
+        private const string SIG_POLICIES = "a{s"+SIG_POLICY+"}";
+
+        private class Policy
+        {
+            public Event event_template;
+            public int64 max_age;
+
+            public Policy (Event event_template, int64 max_age)
+            {
+                this.event_template = event_template;
+                this.max_age = max_age;
+            }
+        }
+
+        private static HashTable<string, Policy> from_variant (
+            Variant policies_variant) throws DataModelError
+        {
+            var policies = new HashTable<string, Policy> (str_hash, str_equal);
+
+            warn_if_fail (
+                policies_variant.get_type_string () == SIG_POLICIES);
+            foreach (Variant policy_variant in policies_variant)
+            {
+                VariantIter iter = policy_variant.iterator ();
+                string policy_id = iter.next_value ().get_string ();
+                Variant policy = iter.next_value ();
+                Event template = new Event.from_variant (
+                    policy.get_child_value (0));
+                int64 max_age = policy.get_child_value (1).get_int64 ();
+                policies.insert (policy_id, new Policy (template, max_age));
+            }
+
+            return policies;
+        }
+
+        private static Variant to_variant (HashTable<string, Policy> policies)
+        {
+            var vb = new VariantBuilder (new VariantType (SIG_POLICIES));
+            {
+                var iter = HashTableIter<string, Policy> (policies);
+                string policy_id;
+                Policy policy;
+                while (iter.next (out policy_id, out policy))
+                {
+                    vb.open (new VariantType ("{s"+SIG_POLICY+"}"));
+                    vb.add ("s", policy_id);
+                    vb.open (new VariantType (SIG_POLICY));
+                    vb.add_value (policy.event_template.to_variant ());
+                    vb.add ("x", policy.max_age);
+                    vb.close ();
+                    vb.close ();
+                }
+            }
+            return vb.end ();
+        }
+    }
+
+    public class Retention: Extension, RemoteRetention
+    {
+        // Maximal number of events deleted at once
+        private const uint EXPIRY_BATCH_SIZE = 500;
+        // Time between two batches while there are expired events left,
+        // in milliseconds
+        private const uint EXPIRY_BATCH_INTERVAL = 200;
+        // Time between two checks for expired events, in seconds
+        private const uint EXPIRY_CHECK_INTERVAL = 3600;
+        // Time from startup until the first check, in seconds
+        private const uint EXPIRY_STARTUP_DELAY = 60;
+
+        private HashTable<string, RetentionPolicies.Policy> policies;
+        private uint registration_id;
+        private uint expiry_source_id = 0;
+
+        Retention ()
+        {
+            Object ();
+        }
+
+        construct
+        {
+            // Restore previous policies from database, or start without any
+            Variant? stored_policies = retrieve_config ("policies",
+                RetentionPolicies.SIG_POLICIES);
+            if (stored_policies != null)
+            {
+                try
+                {
+                    policies = RetentionPolicies.from_variant (
+                        stored_policies);
+                }
+                catch (DataModelError e)
+                {
+                    warning ("Could not load retention policies from " +
+                        "variant: %s", e.message);
+                    policies = new HashTable<string, RetentionPolicies.Policy> (
+                        str_hash, str_equal);
+                }
+            }
+            else
+            {
+                policies = new HashTable<string, RetentionPolicies.Policy> (
+                    str_hash, str_equal);
+            }
+
+            // This will be called after bus is acquired, so it shouldn't block
+            try
+            {
+                var connection = Bus.get_sync (BusType.SESSION, null);
+                registration_id = connection.register_object<RemoteRetention> (
+                    "/org/gnome/zeitgeist/retention", this);
+            }
+            catch (Error err)
+            {
+                warning ("%s", err.message);
+            }
+
+            // Don't slow down the startup
+            schedule_expiry (EXPIRY_STARTUP_DELAY * 1000);
+        }
+
+        public override void unload ()
+        {
+            if (expiry_source_id != 0)
+            {
+                Source.remove (expiry_source_id);
+                expiry_source_id = 0;
+            }
+
+            try
+            {
+                var connection = Bus.get_sync (BusType.SESSION, null);
+                if (registration_id != 0)
+                {
+                    connection.unregister_object (registration_id);
+                    registration_id = 0;
+                }
+            }
+            catch (Error err)
+            {
+                warning ("%s", err.message);
+            }
+
+            debug ("%s, this.ref_count = %u", GLib.Log.METHOD, this.ref_count);
+        }
+
+        private void flush ()
+        {
+            Variant v = RetentionPolicies.to_variant (policies);
+            store_config ("policies", v);
+        }
+
+        public void add_policy (string policy_id, Variant event_template,
+            int64 max_age) throws DataModelError, EngineError
+        {
+            if (max_age <= 0)
+            {
+                throw new EngineError.INVALID_ARGUMENT (
+                    "The maximal age of events must be positive");
+            }
+            Event template = new Event.from_variant (event_template);
+            policies.insert (policy_id,
+                new RetentionPolicies.Policy (template, max_age));
+            debug ("Added retention policy: [#%u]", policy_id.hash ());
+            policy_added (policy_id, event_template, max_age);
+            flush ();
+
+            // Events may have expired already
+            schedule_expiry (EXPIRY_BATCH_INTERVAL);
+        }
+
+        public void remove_policy (string policy_id)
+        {
+            if (policies.remove (policy_id))
+            {
+                debug ("Removed retention policy: [#%u]", policy_id.hash ());
+                policy_removed (policy_id);
+                flush ();
+            }
+            else
+            {
+                debug ("Retention policy [#%u] not found.", policy_id.hash ());
+            }
+        }
+
+        public Variant get_policies ()
+        {
+            return RetentionPolicies.to_variant (policies);
+        }
+
+        private void schedule_expiry (uint delay)
+        {
+            if (expiry_source_id != 0)
+                Source.remove (expiry_source_id);
+            // Low priority, so that this only runs while the daemon is idle
+            expiry_source_id = Timeout.add (delay, () =>
+                {
+                    expiry_source_id = 0;
+                    if (expire_events ())
+                        schedule_expiry (EXPIRY_BATCH_INTERVAL);
+                    else
+                        schedule_expiry (EXPIRY_CHECK_INTERVAL * 1000);
+                    return false;
+                }, Priority.LOW);
+        }
+
+        /**
+         * Deletes up to EXPIRY_BATCH_SIZE of the oldest events which have
+         * expired according to one of the policies. Returns whether any
+         * events were deleted.
+         *
+         * Monitors are notified by the daemon through the engine's
+         * events_deleted signal, about the events which were actually
+         * deleted.
+         */
+        private bool expire_events ()
+        {
+            int64 now = Timestamp.from_now ();
+            foreach (unowned RetentionPolicies.Policy policy in
+                policies.get_values ())
+            {
+                var templates = new GenericArray<Event> ();
+                templates.add (policy.event_template);
+                try
+                {
+                    uint32[] event_ids = engine.find_event_ids (
+                        new TimeRange (0, now - policy.max_age), templates,
+                        StorageState.ANY, EXPIRY_BATCH_SIZE,
+                        ResultType.LEAST_RECENT_EVENTS);
+                    if (event_ids.length == 0)
+                        continue;
+
+                    if (engine.delete_events (event_ids, null) != null)
+                        return true;
+                }
+                catch (EngineError err)
+                {
+                    warning ("Could not expire events: %s", err.message);
+                }
+            }
+            return false;
+        }
+
+    }
+
+    [ModuleInit]
+#if BUILTIN_EXTENSIONS
+    public static Type retention_init (TypeModule module)
+    {
+#else
+    public static Type extension_register (TypeModule module)
+    {
+#endif
+        return typeof (Retention);
+    }
+}
+
+// vim:expandtab:ts=4:sw=4
@@ -932,7 +932,7 @@ public class DbReader : Object
         return subwhere;
     }
 
-    private void delete_from_cache (string table, int64 rowid)
+    protected virtual void delete_from_cache (string table, int64 rowid)
     {
         TableLookup table_lookup;
 
@@ -57,6 +57,11 @@ private bool check_field_match (string? property,
     {
         matches = true;
     }
+    else if (is_symbol && Utils.parse_noexpand (ref parsed))
+    {
+        // Only the symbol itself, not its children (as in FindEventIds)
+        matches = (parsed == property);
+    }
     else if (is_symbol && property != null &&
         Symbol.get_all_parents (property).find_custom (parsed, strcmp) != null)
     {
@@ -37,7 +37,7 @@ namespace Zeitgeist.SQLite
     {
 
         public const string CORE_SCHEMA = "core";
-        public const int CORE_SCHEMA_VERSION = 10;
+        public const int CORE_SCHEMA_VERSION = 11;
 
         private const string DATABASE_CREATION = "database_creation";
 
@@ -71,6 +71,9 @@ namespace Zeitgeist.SQLite
                 // messed up schema if something goes wrong.
                 exec_query (database, "BEGIN");
 
+                // New in version 11: payload.hash
+                add_payload_hashes (database);
+
                 if (schema_version == 3)
                 {
                     // Add missing columns to storage table
@@ -176,6 +179,19 @@ namespace Zeitgeist.SQLite
                 message ("Upgraded database to schema version %d.",
                     CORE_SCHEMA_VERSION);
             }
+            else if (schema_version == 10)
+            {
+                backup_database ();
+                setup_database (database);
+
+                exec_query (database, "BEGIN");
+                add_payload_hashes (database);
+                set_schema_version (database, CORE_SCHEMA_VERSION);
+                exec_query (database, "COMMIT");
+                create_event_indices (database);
+                message ("Upgraded database to schema version %d.",
+                    CORE_SCHEMA_VERSION);
+            }
             else if (schema_version < CORE_SCHEMA_VERSION)
             {
                 throw new EngineError.DATABASE_ERROR (
@@ -184,6 +200,90 @@ namespace Zeitgeist.SQLite
             }
         }
 
+        /**
+         * Returns the hash identifying payloads with the given content.
+         */
+        public static string get_payload_hash (uint8[]? data)
+        {
+            return Checksum.compute_for_bytes (ChecksumType.SHA256,
+                new Bytes (data));
+        }
+
+        /*
+         * Adds the hash column to the payload table of a database older
+         * than version 11, merging payloads with the same content and
+         * dropping those which aren't used by any event.
+         */
+        private static void add_payload_hashes (Sqlite.Database database)
+            throws EngineError
+        {
+            int rc;
+            Sqlite.Statement stmt;
+
+            exec_query (database,
+                "ALTER TABLE payload ADD COLUMN hash VARCHAR");
+
+            // Hash all payloads before updating any, so that we never
+            // modify the table while reading it
+            var ids = new Array<int64> ();
+            var hashes = new GenericArray<string> ();
+            rc = database.prepare_v2 ("SELECT id, value FROM payload", -1,
+                out stmt);
+            assert_upgrade_query_success (database, rc);
+            while ((rc = stmt.step ()) == Sqlite.ROW)
+            {
+                unowned uint8[] data = (uint8[]) stmt.column_blob (1);
+                data.length = stmt.column_bytes (1);
+                ids.append_val (stmt.column_int64 (0));
+                hashes.add (get_payload_hash (data));
+            }
+            assert_upgrade_query_success (database, rc, Sqlite.DONE);
+
+            rc = database.prepare_v2 ("UPDATE payload SET hash=? WHERE id=?",
+                -1, out stmt);
+            assert_upgrade_query_success (database, rc);
+            for (int i = 0; i < hashes.length; ++i)
+            {
+                stmt.reset ();
+                stmt.bind_text (1, hashes[i]);
+                stmt.bind_int64 (2, ids.index (i));
+                rc = stmt.step ();
+                assert_upgrade_query_success (database, rc, Sqlite.DONE);
+            }
+
+            // Point all events to the oldest payload with their content
+            exec_query (database, """
+                UPDATE event SET payload=(
+                    SELECT MIN(original.id) FROM payload AS original
+                    WHERE original.hash=(
+                        SELECT hash FROM payload
+                        WHERE payload.id=event.payload))
+                WHERE payload IN (
+                    SELECT id FROM payload WHERE id NOT IN (
+                        SELECT MIN(id) FROM payload GROUP BY hash))
+                """);
+            exec_query (database, """
+                DELETE FROM payload WHERE id NOT IN (
+                    SELECT payload FROM event WHERE payload IS NOT NULL)
+                """);
+            exec_query (database, """
+                CREATE UNIQUE INDEX IF NOT EXISTS payload_hash
+                    ON payload(hash)
+                """);
+        }
+
+        private static void assert_upgrade_query_success (
+            Sqlite.Database database, int rc, int expected_rc = Sqlite.OK)
+            throws EngineError
+        {
+            if (rc != expected_rc)
+            {
+                string error_message = "Can't upgrade the payload table: %d, %s"
+                    .printf (rc, database.errmsg ());
+                throw new EngineError.DATABASE_ERROR (error_message);
+            }
+        }
+
         private static void backup_database () throws EngineError
         {
             try
@@ -269,6 +369,8 @@ namespace Zeitgeist.SQLite
             if (Utils.get_data_path () == Utils.get_default_data_path ())
                 FileUtils.chmod (Utils.get_data_path (), 0700);
 
+            // Only takes effect for new databases, or on the next VACUUM
+            exec_query (database, "PRAGMA auto_vacuum = INCREMENTAL");
             exec_query (database, "PRAGMA journal_mode = WAL");
             exec_query (database, "PRAGMA synchronous = NORMAL");
             exec_query (database, "PRAGMA locking_mode = NORMAL");
@@ -329,10 +431,15 @@ namespace Zeitgeist.SQLite
 
             // Payload
             // (There's no value index for payloads, they can only be fetched
-            // by ID).
+            // by ID, or by the hash of their content when storing them, so
+            // that events with the same payload share a single row).
             exec_query (database, """
                 CREATE TABLE IF NOT EXISTS payload
-                    (id INTEGER PRIMARY KEY, value BLOB)
+                    (id INTEGER PRIMARY KEY, value BLOB, hash VARCHAR)
+                """);
+            exec_query (database, """
+                CREATE UNIQUE INDEX IF NOT EXISTS payload_hash
+                    ON payload(hash)
                 """);
 
             // Storage
@@ -607,6 +714,10 @@ namespace Zeitgeist.SQLite
                 CREATE INDEX IF NOT EXISTS event_subj_storage
                     ON event(subj_storage, timestamp, id)
                 """);
+            exec_query (database, """
+                CREATE INDEX IF NOT EXISTS event_payload
+                    ON event(payload)
+                """);
         }
 
         /*
@@ -643,6 +754,7 @@ namespace Zeitgeist.SQLite
             exec_query (database, "DROP INDEX IF EXISTS event_subj_mimetype");
             exec_query (database, "DROP INDEX IF EXISTS event_subj_text");
             exec_query (database, "DROP INDEX IF EXISTS event_subj_storage");
+            exec_query (database, "DROP INDEX IF EXISTS event_payload");
         }
 
         /**
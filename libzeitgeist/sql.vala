@@ -67,6 +67,19 @@ namespace Zeitgeist.SQLite
         public Sqlite.Statement id_retrieval_stmt;
         public Sqlite.Statement move_handling_stmt;
         public Sqlite.Statement payload_insertion_stmt;
+        public Sqlite.Statement payload_retrieval_stmt;
+        private Sqlite.Statement event_id_insertion_stmt;
+
+        // Number of parameters of each row of the statements returned by
+        // get_event_batch_insertion_stmt ()
+        public const int EVENT_ROW_PARAMETERS = 16;
+
+        // Maximal number of rows inserted by a single statement
+        public int event_batch_max_rows { get; private set; }
+
+        private Sqlite.Statement event_batch_insertion_stmt;
+        private Sqlite.Statement? partial_event_batch_insertion_stmt = null;
+        private int partial_event_batch_rows = 0;
 
         // The DB should be accessible from engine for statement preperations
         //  as well as allowing extensions to add tables to it.
@@ -226,17 +239,53 @@ namespace Zeitgeist.SQLite
             return sql_condition.str;
         }
 
+        /**
+         * Puts the given event IDs (from start to end, exclusive) into the
+         * temporary event_ids table, replacing those it had before, so
+         * that queries can use them with "WHERE id IN event_ids" instead
+         * of having them inlined with get_sql_string_from_event_ids ().
+         */
+        public void set_event_id_table (uint32[] event_ids, int start = 0,
+            int end = -1) throws EngineError
+        {
+            if (end < 0)
+                end = event_ids.length;
+
+            int rc = database.exec ("DELETE FROM temp.event_ids");
+            assert_query_success (rc, "Can't clear event ID table");
+
+            for (int i = start; i < end; ++i)
+            {
+                event_id_insertion_stmt.reset ();
+                event_id_insertion_stmt.bind_int64 (1, event_ids[i]);
+                rc = event_id_insertion_stmt.step ();
+                assert_query_success (rc, "Can't fill event ID table",
+                    Sqlite.DONE);
+            }
+        }
+
         public TimeRange? get_time_range_for_event_ids (uint32[] event_ids)
             throws EngineError
         {
             if (event_ids.length == 0)
                 return null;
 
+            set_event_id_table (event_ids);
+            return get_time_range_for_event_id_table ();
+        }
+
+        /**
+         * Like get_time_range_for_event_ids (), for the events in the
+         * table filled by set_event_id_table ().
+         */
+        public TimeRange? get_time_range_for_event_id_table ()
+            throws EngineError
+        {
             string sql = """
                 SELECT MIN(timestamp), MAX(timestamp)
                 FROM event
-                WHERE id IN (%s)
-                """.printf (get_sql_string_from_event_ids (event_ids));
+                WHERE id IN temp.event_ids
+                """;
 
             TimeRange? time_range = null;
             int rc = database.exec (sql,
@@ -255,6 +304,150 @@ namespace Zeitgeist.SQLite
             return time_range;
         }
 
+        /**
+         * Returns the IDs in the table filled by set_event_id_table ()
+         * which belong to existing events.
+         */
+        public uint32[] get_existing_ids_in_event_id_table ()
+            throws EngineError
+        {
+            string sql = """
+                SELECT id FROM temp.event_ids
+                WHERE EXISTS (SELECT 1 FROM event WHERE event.id = event_ids.id)
+                """;
+
+            uint32[] event_ids = {};
+            int rc = database.exec (sql,
+                (n_columns, values, column_names) =>
+                {
+                    event_ids += (uint32) uint64.parse (values[0]);
+                    return 0;
+                }, null);
+            assert_query_success (rc, "SQL Error");
+
+            return event_ids;
+        }
+
+        /**
+         * Deletes the rows of the given table (one of "uri", "text",
+         * "payload" and "storage") which aren't used by any event, among
+         * up to `limit' of those with an ID greater than `start'.
+         *
+         * Returns the greatest ID that was checked, or 0 if there were no
+         * rows left to check.
+         */
+        public int64 delete_unreferenced_rows (string table, int64 start,
+            int limit) throws EngineError
+        {
+            string condition;
+            switch (table)
+            {
+                case "uri":
+                    condition = """
+                        NOT EXISTS (SELECT 1 FROM event WHERE origin=uri.id)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM event WHERE subj_id=uri.id)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM event WHERE subj_id_current=uri.id)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM event WHERE subj_origin=uri.id)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM event
+                            WHERE subj_origin_current=uri.id)
+                        """;
+                    break;
+                case "text":
+                    condition = """
+                        NOT EXISTS (SELECT 1 FROM event WHERE subj_text=text.id)
+                        """;
+                    break;
+                case "payload":
+                    condition = """
+                        NOT EXISTS (SELECT 1 FROM event WHERE payload=payload.id)
+                        """;
+                    break;
+                case "storage":
+                    // Storage mediums known to the storage monitor keep
+                    // their state, even if no event is using them
+                    condition = """
+                        state IS NULL AND NOT EXISTS (
+                            SELECT 1 FROM event WHERE subj_storage=storage.id)
+                        """;
+                    break;
+                default:
+                    assert_not_reached ();
+            }
+
+            int rc;
+            Sqlite.Statement stmt;
+            int64 end = 0;
+
+            string sql = """
+                SELECT MAX(id) FROM (
+                    SELECT id FROM %s WHERE id > ? ORDER BY id LIMIT ?)
+                """.printf (table);
+            rc = database.prepare_v2 (sql, -1, out stmt);
+            assert_query_success (rc, "SQL error");
+            stmt.bind_int64 (1, start);
+            stmt.bind_int (2, limit);
+            if ((rc = stmt.step ()) == Sqlite.ROW)
+            {
+                end = stmt.column_int64 (0);
+                rc = stmt.step ();
+            }
+            assert_query_success (rc, "SQL error", Sqlite.DONE);
+            if (end == 0)
+                return 0;
+
+            sql = "DELETE FROM %s WHERE id > ? AND id <= ? AND %s".printf (
+                table, condition);
+            rc = database.prepare_v2 (sql, -1, out stmt);
+            assert_query_success (rc, "SQL error");
+            stmt.bind_int64 (1, start);
+            stmt.bind_int64 (2, end);
+            rc = stmt.step ();
+            assert_query_success (rc, "SQL error", Sqlite.DONE);
+
+            return end;
+        }
+
+        /**
+         * Returns up to `pages' free pages to the file system. Does
+         * nothing unless the database has auto_vacuum = INCREMENTAL.
+         *
+         * Returns whether there may be more free pages left.
+         */
+        public bool incremental_vacuum (int pages) throws EngineError
+        {
+            int64 auto_vacuum = 0;
+            int64 free_pages = 0;
+            int rc = database.exec ("PRAGMA auto_vacuum",
+                (n_columns, values, column_names) =>
+                {
+                    auto_vacuum = int64.parse (values[0]);
+                    return 0;
+                }, null);
+            assert_query_success (rc, "SQL error");
+            // 2 is INCREMENTAL
+            if (auto_vacuum != 2)
+                return false;
+
+            rc = database.exec ("PRAGMA freelist_count",
+                (n_columns, values, column_names) =>
+                {
+                    free_pages = int64.parse (values[0]);
+                    return 0;
+                }, null);
+            assert_query_success (rc, "SQL error");
+            if (free_pages == 0)
+                return false;
+
+            rc = database.exec ("PRAGMA incremental_vacuum(%d)".printf (
+                pages));
+            assert_query_success (rc, "SQL error");
+            return free_pages > pages;
+        }
+
         public void insert_or_ignore_into_table (string table_name,
             GenericArray<string> values) throws EngineError
         {
@@ -281,6 +474,83 @@ namespace Zeitgeist.SQLite
             assert_query_success (rc, "SQL error", Sqlite.DONE);
         }
 
+        /**
+         * Looks up the IDs of the given values in table_name, adding
+         * them to ids. Values which aren't in the table are left out.
+         */
+        public void get_ids_for_values (string table_name,
+            GenericArray<string> values, HashTable<string, int> ids)
+            throws EngineError
+        {
+            if (values.length == 0)
+                return;
+
+            int rc;
+
+            var sql = new StringBuilder ();
+            sql.append ("SELECT value, id FROM ");
+            sql.append (table_name);
+            sql.append (" WHERE value IN (?");
+            for (int i = 1; i < values.length; ++i)
+                sql.append (", ?");
+            sql.append (")");
+
+            Sqlite.Statement stmt;
+            rc = database.prepare_v2 (sql.str, -1, out stmt);
+            assert_query_success (rc, "SQL error");
+
+            for (int i = 0; i < values.length; ++i)
+                stmt.bind_text (i+1, values[i]);
+
+            while ((rc = stmt.step ()) == Sqlite.ROW)
+                ids.insert (stmt.column_text (0), stmt.column_int (1));
+            assert_query_success (rc, "SQL error", Sqlite.DONE);
+        }
+
+        /**
+         * Returns a statement inserting the given number of event rows,
+         * taking EVENT_ROW_PARAMETERS parameters per row in the order of
+         * the columns of event_insertion_stmt. Unlike in the latter, all
+         * references (including URIs, texts and storages) are IDs.
+         */
+        public unowned Sqlite.Statement get_event_batch_insertion_stmt (
+            int rows) throws EngineError
+            requires (rows > 0 && rows <= event_batch_max_rows)
+        {
+            if (rows == event_batch_max_rows)
+                return event_batch_insertion_stmt;
+            if (rows != partial_event_batch_rows)
+            {
+                partial_event_batch_insertion_stmt =
+                    prepare_event_batch_insertion (rows);
+                partial_event_batch_rows = rows;
+            }
+            return partial_event_batch_insertion_stmt;
+        }
+
+        private Sqlite.Statement prepare_event_batch_insertion (int rows)
+            throws EngineError
+        {
+            var sql = new StringBuilder ("""
+                INSERT INTO event (
+                    id, timestamp, interpretation, manifestation, actor,
+                    origin, payload, subj_id, subj_id_current,
+                    subj_interpretation, subj_manifestation, subj_origin,
+                    subj_origin_current, subj_mimetype, subj_text, subj_storage
+                ) VALUES """);
+            for (int i = 0; i < rows; ++i)
+            {
+                if (i > 0)
+                    sql.append (", ");
+                sql.append ("(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)");
+            }
+
+            Sqlite.Statement stmt;
+            int rc = database.prepare_v2 (sql.str, -1, out stmt);
+            assert_query_success (rc, "Batch insertion query error");
+            return stmt;
+        }
+
         public void begin_transaction () throws EngineError
         {
             int rc = database.exec ("BEGIN");
@@ -299,6 +569,29 @@ namespace Zeitgeist.SQLite
             assert_query_success (rc, "Can't rollback transaction");
         }
 
+        public void set_savepoint (string name) throws EngineError
+        {
+            int rc = database.exec ("SAVEPOINT %s".printf (name));
+            assert_query_success (rc, "Can't set savepoint");
+        }
+
+        public void release_savepoint (string name) throws EngineError
+        {
+            int rc = database.exec ("RELEASE %s".printf (name));
+            assert_query_success (rc, "Can't release savepoint");
+        }
+
+        /**
+         * Undoes all changes made since the given savepoint was set,
+         * and releases it.
+         */
+        public void rollback_to_savepoint (string name) throws EngineError
+        {
+            int rc = database.exec ("ROLLBACK TO %s".printf (name));
+            assert_query_success (rc, "Can't rollback to savepoint");
+            release_savepoint (name);
+        }
+
         public void close ()
         {
             // SQLite connection is implicitly closed upon destruction
@@ -426,6 +719,15 @@ namespace Zeitgeist.SQLite
             rc = database.prepare_v2 (sql, -1, out event_insertion_stmt);
             assert_query_success (rc, "Insertion query error");
 
+            // Multi-row event insertion statement, with as many rows as
+            // SQLite accepts in a single statement
+            event_batch_max_rows = int.max (1, int.min (
+                database.limit (Sqlite.Limit.VARIABLE_NUMBER, -1)
+                    / EVENT_ROW_PARAMETERS,
+                database.limit (Sqlite.Limit.COMPOUND_SELECT, -1)));
+            event_batch_insertion_stmt = prepare_event_batch_insertion (
+                event_batch_max_rows);
+
             // Move handling statment
             sql = """
             UPDATE event
@@ -439,10 +741,29 @@ namespace Zeitgeist.SQLite
 
             // Payload insertion statment
             sql = """
-                INSERT INTO payload (value) VALUES (?)
+                INSERT INTO payload (value, hash) VALUES (?, ?)
             """;
             rc = database.prepare_v2 (sql, -1, out payload_insertion_stmt);
             assert_query_success (rc, "Payload insertion query error");
+
+            // Payload ID retrieval statement
+            sql = """
+                SELECT id FROM payload WHERE hash=?
+            """;
+            rc = database.prepare_v2 (sql, -1, out payload_retrieval_stmt);
+            assert_query_success (rc, "Payload ID retrieval query error");
+
+            // Temporary table of event IDs, see set_event_id_table ()
+            rc = database.exec ("""
+                CREATE TEMP TABLE IF NOT EXISTS event_ids
+                    (id INTEGER PRIMARY KEY)
+                """);
+            assert_query_success (rc, "Can't create event ID table");
+            sql = """
+                INSERT OR IGNORE INTO temp.event_ids (id) VALUES (?)
+            """;
+            rc = database.prepare_v2 (sql, -1, out event_id_insertion_stmt);
+            assert_query_success (rc, "Event ID table insertion query error");
         }
 
         public bool analyze() throws EngineError
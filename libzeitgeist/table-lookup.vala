@@ -34,6 +34,7 @@ namespace Zeitgeist.SQLite
         private HashTable<string, int> value_to_id;
         private Sqlite.Statement insertion_stmt;
         private Sqlite.Statement retrieval_stmt;
+        private Sqlite.Statement id_retrieval_stmt;
 
         public TableLookup (Database database, string table_name)
             throws EngineError
@@ -64,6 +65,11 @@ namespace Zeitgeist.SQLite
             sql = "SELECT value FROM " + table + " WHERE id=?";
             rc = db.prepare_v2 (sql, -1, out retrieval_stmt);
             database.assert_query_success (rc, "Error creating retrieval_stmt");
+
+            sql = "SELECT id FROM " + table + " WHERE value=?";
+            rc = db.prepare_v2 (sql, -1, out id_retrieval_stmt);
+            database.assert_query_success (rc,
+                "Error creating id_retrieval_stmt");
         }
 
         /**
@@ -74,9 +80,22 @@ namespace Zeitgeist.SQLite
         public int id_try_string (string name)
         {
             int id = value_to_id.lookup (name);
-            if (id == 0)
-                return -1;
-            return id;
+            if (id != 0)
+                return id;
+
+            // The value may have been inserted through another connection
+            // (eg. if this is a reader separate from the engine), so check
+            // the DB before giving up.
+            id_retrieval_stmt.reset ();
+            id_retrieval_stmt.bind_text (1, name);
+            if (id_retrieval_stmt.step () == Sqlite.ROW)
+            {
+                id = id_retrieval_stmt.column_int (0);
+                id_to_value.insert (id, name);
+                value_to_id.insert (name, id);
+            }
+            id_retrieval_stmt.reset ();
+            return (id != 0) ? id : -1;
         }
 
         /**
@@ -150,6 +169,129 @@ namespace Zeitgeist.SQLite
 
     }
 
+    /**
+     * Cache of the IDs of the most recently used values of a table which
+     * is too large to be kept in memory (unlike those of TableLookup).
+     * Holds up to `size' values, dropping the least recently used ones.
+     *
+     * Values are only added once they're known to be in the table, so
+     * a hit means they don't need to be inserted or looked up again.
+     */
+    public class IdCache : Object
+    {
+        private class Entry
+        {
+            public string value;
+            public int id;
+            // Neighbours in order of use, owned by the hash tables
+            public unowned Entry? newer = null;
+            public unowned Entry? older = null;
+
+            public Entry (string value, int id)
+            {
+                this.value = value;
+                this.id = id;
+            }
+        }
+
+        private uint size;
+        private HashTable<string, Entry> value_to_entry;
+        private HashTable<int, unowned Entry> id_to_entry;
+        private unowned Entry? newest = null;
+        private unowned Entry? oldest = null;
+
+        public IdCache (uint size)
+            requires (size > 0)
+        {
+            this.size = size;
+            value_to_entry = new HashTable<string, Entry> (str_hash, str_equal);
+            id_to_entry = new HashTable<int, unowned Entry> (direct_hash,
+                direct_equal);
+        }
+
+        /**
+         * Returns the ID of the given value, or 0 if it isn't cached.
+         */
+        public int lookup (string value)
+        {
+            unowned Entry? entry = value_to_entry.lookup (value);
+            if (entry == null)
+                return 0;
+            if (entry != newest)
+            {
+                unlink (entry);
+                link (entry);
+            }
+            return entry.id;
+        }
+
+        public void insert (string value, int id)
+        {
+            remove_value (value);
+            remove (id);
+            if (value_to_entry.size () >= size)
+                remove_value (oldest.value);
+
+            var entry = new Entry (value, id);
+            link (entry);
+            id_to_entry.insert (id, entry);
+            value_to_entry.insert (value, (owned) entry);
+        }
+
+        /**
+         * Forgets the value with the given ID, eg. because it was deleted.
+         */
+        public void remove (int id)
+        {
+            unowned Entry? entry = id_to_entry.lookup (id);
+            if (entry != null)
+                remove_value (entry.value);
+        }
+
+        public void clear ()
+        {
+            newest = null;
+            oldest = null;
+            id_to_entry.remove_all ();
+            value_to_entry.remove_all ();
+        }
+
+        private void remove_value (string value)
+        {
+            unowned Entry? entry = value_to_entry.lookup (value);
+            if (entry == null)
+                return;
+            unlink (entry);
+            id_to_entry.remove (entry.id);
+            value_to_entry.remove (value);
+        }
+
+        private void link (Entry entry)
+        {
+            entry.older = newest;
+            entry.newer = null;
+            if (newest != null)
+                newest.newer = entry;
+            newest = entry;
+            if (oldest == null)
+                oldest = entry;
+        }
+
+        private void unlink (Entry entry)
+        {
+            if (entry.newer != null)
+                entry.newer.older = entry.older;
+            else
+                newest = entry.older;
+            if (entry.older != null)
+                entry.older.newer = entry.newer;
+            else
+                oldest = entry.newer;
+            entry.newer = null;
+            entry.older = null;
+        }
+    }
+
 }
 
 // vim:expandtab:ts=4:sw=4
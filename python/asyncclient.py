@@ -0,0 +1,376 @@
+# -.- coding: utf-8 -.-
+
+# Zeitgeist
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Future based Zeitgeist client, for applications driven by an asyncio
+(or, with Python 2, trollius) event loop instead of a GLib or Qt main
+loop.
+
+All D-Bus traffic happens in a GLib main loop running in a helper
+thread; results are handed back to the event loop as futures, so any
+number of requests may be in flight at the same time without blocking
+it. With Python 3 the futures can be awaited directly, with trollius
+use ``yield From(future)``.
+
+This module is optional: it requires asyncio (Python 3.4 or later) or
+the trollius package, which aren't needed by the rest of Zeitgeist.
+"""
+
+import threading
+import collections
+
+import dbus
+import dbus.mainloop.glib
+import gobject
+
+try:
+	import asyncio
+except ImportError:
+	try:
+		import trollius as asyncio
+	except ImportError:
+		raise ImportError("zeitgeist.asyncclient requires asyncio "
+			"(Python 3.4 or later) or trollius")
+
+from zeitgeist.client import ZeitgeistClient, Monitor
+from zeitgeist.datamodel import TimeRange, StorageState, ResultType
+
+try:
+	StopAsyncIteration = StopAsyncIteration
+except NameError:
+	# Raising StopIteration would silently end trollius coroutines
+	class StopAsyncIteration(Exception):
+		pass
+
+__all__ = ["AsyncZeitgeistClient", "AsyncMonitor", "MonitorNotification"]
+
+MonitorNotification = collections.namedtuple("MonitorNotification",
+	["kind", "time_range", "items"])
+MonitorNotification.__doc__ = """
+Notification yielded by an :class:`AsyncMonitor`. *kind* is either
+"insert", with the inserted :class:`Events <zeitgeist.datamodel.Event>`
+as *items*, or "delete", with the ids of the deleted events as *items*.
+"""
+
+class _GLibThread(object):
+	"""
+	Thread running the default GLib main loop, which dispatches the
+	replies to D-Bus calls and monitor notifications. It is shared by
+	all clients, started by the first one and stopped when the last one
+	is closed (so that the default main context can be used by other
+	code again).
+	"""
+	
+	_lock = threading.Lock()
+	_users = 0
+	_mainloop = None
+	_thread = None
+	
+	@classmethod
+	def acquire(cls):
+		with cls._lock:
+			cls._users += 1
+			if cls._thread is None:
+				gobject.threads_init()
+				dbus.mainloop.glib.threads_init()
+				cls._mainloop = gobject.MainLoop()
+				cls._thread = threading.Thread(target=cls._mainloop.run,
+					name="zeitgeist-glib")
+				cls._thread.daemon = True
+				cls._thread.start()
+	
+	@classmethod
+	def release(cls):
+		with cls._lock:
+			cls._users -= 1
+			if cls._users == 0:
+				cls._mainloop.quit()
+				cls._thread.join()
+				cls._mainloop = None
+				cls._thread = None
+	
+	@staticmethod
+	def call(func, *args, **kwargs):
+		"""Run func(*args, **kwargs) in the GLib thread"""
+		def run():
+			func(*args, **kwargs)
+			return False
+		gobject.idle_add(run)
+
+def _set_result(future, result):
+	if not future.done():
+		future.set_result(result)
+
+def _set_exception(future, exception):
+	if not future.done():
+		future.set_exception(exception)
+
+def _chain(future, convert, loop):
+	"""Return a future for the result of *future* passed to *convert*"""
+	result = asyncio.Future(loop=loop)
+	def done(future):
+		if future.cancelled():
+			result.cancel()
+		elif future.exception() is not None:
+			_set_exception(result, future.exception())
+		else:
+			_set_result(result, convert(future.result()))
+	future.add_done_callback(done)
+	return result
+
+class AsyncMonitor(object):
+	"""
+	Monitor installed with :meth:`AsyncZeitgeistClient.install_monitor`.
+	
+	It is an asynchronous iterator of :class:`MonitorNotification`
+	instances, which ends after it has been removed with
+	:meth:`AsyncZeitgeistClient.remove_monitor`::
+	
+	    monitor = await client.install_monitor(TimeRange.from_now(), [])
+	    async for notification in monitor:
+	        ...
+	
+	Notifications received while nobody is waiting for them are
+	buffered. :meth:`get` returns a future with the next notification
+	for code which can't use ``async for``.
+	"""
+	
+	def __init__(self, loop):
+		self._loop = loop
+		self._notifications = collections.deque()
+		self._waiters = collections.deque()
+		self._closed = False
+		self.monitor = None
+	
+	def _notify(self, notification):
+		# Called in the event loop thread
+		if self._closed:
+			return
+		while self._waiters:
+			waiter = self._waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(notification)
+				return
+		self._notifications.append(notification)
+	
+	def _close(self):
+		self._closed = True
+		while self._waiters:
+			_set_exception(self._waiters.popleft(), StopAsyncIteration())
+	
+	def _notify_insert(self, time_range, events):
+		# Called in the GLib thread
+		self._loop.call_soon_threadsafe(self._notify,
+			MonitorNotification("insert", time_range, events))
+	
+	def _notify_delete(self, time_range, event_ids):
+		self._loop.call_soon_threadsafe(self._notify,
+			MonitorNotification("delete", time_range, map(int, event_ids)))
+	
+	def get(self):
+		"""
+		Return a future with the next notification. Once the monitor
+		has been removed and all buffered notifications have been
+		consumed, the future fails with StopAsyncIteration.
+		"""
+		future = asyncio.Future(loop=self._loop)
+		if self._notifications:
+			future.set_result(self._notifications.popleft())
+		elif self._closed:
+			future.set_exception(StopAsyncIteration())
+		else:
+			self._waiters.append(future)
+		return future
+	
+	def __aiter__(self):
+		return self
+	
+	def __anext__(self):
+		return self.get()
+
+class AsyncZeitgeistClient(object):
+	"""
+	Future based counterpart of :class:`ZeitgeistClient
+	<zeitgeist.client.ZeitgeistClient>`. Each method returns a future
+	(bound to *loop*) instead of taking reply and error handlers; D-Bus
+	errors are set as the exception of the future.
+	
+	Keyword arguments not taken by the constructor itself are passed on
+	to the wrapped :class:`ZeitgeistClient`, eg. to enable its caches.
+	
+	Call :meth:`close` once the client isn't needed anymore.
+	"""
+	
+	def __init__(self, loop=None, **kwargs):
+		_GLibThread.acquire()
+		self._loop = loop or asyncio.get_event_loop()
+		self._client = ZeitgeistClient(**kwargs)
+		self._closed = False
+	
+	def close(self):
+		"""
+		Stop using the client. The thread dispatching D-Bus messages is
+		stopped once all clients are closed; pending futures won't be
+		resolved after that.
+		"""
+		if not self._closed:
+			self._closed = True
+			_GLibThread.release()
+	
+	@property
+	def client(self):
+		"""The wrapped :class:`ZeitgeistClient`"""
+		return self._client
+	
+	def _call(self, method, *args, **kwargs):
+		"""
+		Call the *method* of the wrapped client from the GLib thread,
+		passing the handlers named by *reply_name* and *error_name*
+		(if any), and return a future for its result.
+		"""
+		reply_name = kwargs.pop("reply_name")
+		error_name = kwargs.pop("error_name", "error_handler")
+		future = asyncio.Future(loop=self._loop)
+		
+		def reply_handler(*result):
+			if len(result) == 1:
+				result = result[0]
+			elif not result:
+				result = None
+			self._loop.call_soon_threadsafe(_set_result, future, result)
+		
+		def error_handler(error, *args):
+			self._loop.call_soon_threadsafe(_set_exception, future, error)
+		
+		kwargs[reply_name] = reply_handler
+		if error_name is not None:
+			kwargs[error_name] = error_handler
+		
+		def call():
+			try:
+				method(*args, **kwargs)
+			except Exception, e:
+				error_handler(e)
+		_GLibThread.call(call)
+		return future
+	
+	def insert_events(self, events):
+		"""
+		Insert *events* into the log. The result is the list of their
+		ids, 0 for events which were rejected.
+		"""
+		return self._call(self._client.insert_events, events,
+			reply_name="ids_reply_handler")
+	
+	def find_event_ids(self, event_templates, timerange=None,
+		storage_state=StorageState.Any, num_events=20,
+		result_type=ResultType.MostRecentEvents):
+		"""
+		See :meth:`ZeitgeistClient.find_event_ids_for_templates
+		<zeitgeist.client.ZeitgeistClient.find_event_ids_for_templates>`
+		"""
+		return self._call(self._client.find_event_ids_for_templates,
+			event_templates, timerange=timerange, storage_state=storage_state,
+			num_events=num_events, result_type=result_type,
+			reply_name="ids_reply_handler")
+	
+	def find_events(self, event_templates, timerange=None,
+		storage_state=StorageState.Any, num_events=20,
+		result_type=ResultType.MostRecentEvents):
+		"""
+		See :meth:`ZeitgeistClient.find_events_for_templates
+		<zeitgeist.client.ZeitgeistClient.find_events_for_templates>`
+		"""
+		return self._call(self._client.find_events_for_templates,
+			event_templates, timerange=timerange, storage_state=storage_state,
+			num_events=num_events, result_type=result_type,
+			reply_name="events_reply_handler")
+	
+	def get_events(self, event_ids):
+		"""
+		Look up the events with the given ids. The result contains None
+		for ids which don't exist.
+		"""
+		return self._call(self._client.get_events, event_ids,
+			reply_name="events_reply_handler")
+	
+	def delete_events(self, event_ids):
+		"""
+		Delete the events with the given ids. The result is the
+		:class:`TimeRange <zeitgeist.datamodel.TimeRange>` covering the
+		deleted events.
+		"""
+		future = self._call(self._client.delete_events, event_ids,
+			reply_name="reply_handler")
+		return _chain(future, lambda time_range: TimeRange(*time_range),
+			self._loop)
+	
+	def find_related_uris(self, event_templates, time_range=None,
+		result_event_templates=[], storage_state=StorageState.Any,
+		num_events=10, result_type=0):
+		"""
+		See :meth:`ZeitgeistClient.find_related_uris_for_events
+		<zeitgeist.client.ZeitgeistClient.find_related_uris_for_events>`
+		"""
+		return self._call(self._client.find_related_uris_for_events,
+			event_templates, time_range=time_range,
+			result_event_templates=result_event_templates,
+			storage_state=storage_state, num_events=num_events,
+			result_type=result_type, reply_name="uris_reply_handler")
+	
+	def install_monitor(self, time_range, event_templates):
+		"""
+		Install a monitor for events matching *event_templates* in
+		*time_range*. The result is an :class:`AsyncMonitor`, available
+		once the engine has acknowledged the monitor.
+		"""
+		self._client._check_list_or_tuple(event_templates)
+		monitor = AsyncMonitor(self._loop)
+		future = asyncio.Future(loop=self._loop)
+		
+		def reply_handler():
+			self._loop.call_soon_threadsafe(_set_result, future, monitor)
+		
+		def error_handler(error):
+			self._client._installed_monitors.remove(monitor.monitor)
+			self._loop.call_soon_threadsafe(_set_exception, future, error)
+		
+		def install():
+			monitor.monitor = Monitor(time_range, event_templates,
+				monitor._notify_insert, monitor._notify_delete,
+				event_type=self._client._event_type)
+			# Reinstalled by the client if the engine is restarted
+			self._client._installed_monitors.append(monitor.monitor)
+			self._client._iface.InstallMonitor(monitor.monitor.path,
+				monitor.monitor.time_range, monitor.monitor.templates,
+				reply_handler=reply_handler, error_handler=error_handler)
+		_GLibThread.call(install)
+		return future
+	
+	def remove_monitor(self, monitor):
+		"""
+		Remove a monitor installed with :meth:`install_monitor`. Its
+		iteration ends once the notifications received before have
+		been consumed. The result is True if the engine knew about the
+		monitor.
+		"""
+		monitor._close()
+		future = self._call(self._client.remove_monitor, monitor.monitor,
+			reply_name="monitor_removed_handler", error_name=None)
+		return _chain(future, bool, self._loop)
+
+# vim:noexpandtab:ts=4:sw=4
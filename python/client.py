@@ -24,20 +24,37 @@
 import dbus
 import dbus.service
 import dbus.mainloop.glib
+import gobject
 import logging
 import os.path
 import sys
+import time
+import heapq
 import inspect
+import itertools
+import json
+import threading
+import Queue
 
+from collections import deque, OrderedDict, Sequence
 from xml.etree import ElementTree
 
 dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
-from zeitgeist.datamodel import (Event, Subject, TimeRange, StorageState,
-	ResultType)
+from zeitgeist.datamodel import (Event, Subject, Symbol, TimeRange,
+	Interpretation, StorageState, ResultType, compile_templates)
+from zeitgeist.dbreader import DbReader, DirectReadUnavailable
 
 SIG_EVENT = "asaasay"
 
+# Raised by the engine when a reply would exceed its maximal size
+TOO_MANY_RESULTS_ERROR = "org.gnome.zeitgeist.DataModelError.TooManyResults"
+
+# Priorities of asynchronous D-Bus calls waiting for a free slot, see
+# _DBusInterface.set_request_limit(). Lower values are sent first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 100
+
 log = logging.getLogger("zeitgeist.client")
 
 # This is here so testutils.py can override it with a private bus connection.
@@ -53,6 +70,401 @@ def _set_bus(bus):
 	global session_bus
 	session_bus = bus
 
+class _RequestLimiter(object):
+	"""
+	Window limiting the number of asynchronous D-Bus calls waiting for
+	a reply. Calls beyond the limit are queued and sent by priority,
+	and in the order they were made for equal priorities.
+	"""
+	
+	def __init__(self, limit):
+		self.limit = limit
+		self._in_flight = 0
+		self._queue = []
+		self._counter = itertools.count()
+		# Statistics
+		self._dispatched = 0
+		self._delayed = 0
+		self._max_queue_depth = 0
+		self._total_wait = 0.0
+		self._max_wait = 0.0
+	
+	def submit(self, call, kwargs, priority):
+		"""
+		Perform call(**kwargs) as soon as the window allows it. *kwargs*
+		must contain the reply_handler and error_handler of the call.
+		"""
+		reply_handler = kwargs["reply_handler"]
+		error_handler = kwargs["error_handler"]
+		
+		def release_and_reply(*args):
+			self._release()
+			reply_handler(*args)
+		
+		def release_and_fail(error):
+			self._release()
+			error_handler(error)
+		
+		kwargs = dict(kwargs, reply_handler=release_and_reply,
+			error_handler=release_and_fail)
+		if self._in_flight < self.limit and not self._queue:
+			self._dispatch(call, kwargs)
+		else:
+			heapq.heappush(self._queue,
+				(priority, next(self._counter), time.time(), call, kwargs,
+				error_handler))
+			self._delayed += 1
+			self._max_queue_depth = max(self._max_queue_depth,
+				len(self._queue))
+	
+	def set_limit(self, limit):
+		self.limit = limit
+		self._release(0)
+	
+	def _dispatch(self, call, kwargs):
+		self._in_flight += 1
+		self._dispatched += 1
+		try:
+			call(**kwargs)
+		except Exception:
+			self._release()
+			raise
+	
+	def _release(self, count=1):
+		self._in_flight -= count
+		while self._queue and self._in_flight < self.limit:
+			priority, n, queued, call, kwargs, error_handler = \
+				heapq.heappop(self._queue)
+			wait = time.time() - queued
+			self._total_wait += wait
+			self._max_wait = max(self._max_wait, wait)
+			try:
+				self._dispatch(call, kwargs)
+			except Exception, e:
+				# The caller is gone, so report it like a D-Bus error.
+				# _dispatch has already released the call's slot, so
+				# the wrapped error handler mustn't be used.
+				if not isinstance(e, dbus.exceptions.DBusException):
+					e = dbus.exceptions.DBusException(str(e))
+				error_handler(e)
+	
+	def get_stats(self):
+		"""
+		Return a dictionary with the current limit, the number of calls
+		waiting for a reply and in the queue, the maximal queue depth,
+		the number of calls sent and of those which had to wait, and
+		the total, mean and maximal waiting time in seconds.
+		"""
+		return {
+			"limit": self.limit,
+			"in_flight": self._in_flight,
+			"queue_depth": len(self._queue),
+			"max_queue_depth": self._max_queue_depth,
+			"dispatched": self._dispatched,
+			"delayed": self._delayed,
+			"total_wait": self._total_wait,
+			"mean_wait": self._total_wait / max(self._delayed, 1),
+			"max_wait": self._max_wait,
+		}
+
+def _estimate_size(value):
+	"""
+	Estimate the number of bytes *value* takes up in a D-Bus message,
+	ignoring padding.
+	"""
+	if isinstance(value, basestring):
+		return len(value) + 5
+	if isinstance(value, (list, tuple)):
+		return 4 + sum(_estimate_size(item) for item in value)
+	if isinstance(value, dict):
+		return 4 + sum(_estimate_size(key) + _estimate_size(item)
+			for key, item in value.iteritems())
+	if isinstance(value, (dbus.Byte, dbus.Boolean)):
+		return 1
+	if isinstance(value, (dbus.Int16, dbus.UInt16)):
+		return 2
+	if isinstance(value, (dbus.Int32, dbus.UInt32)):
+		return 4
+	return 8
+
+class _MethodStats(object):
+	"""
+	Statistics about the calls to one D-Bus method, with a histogram of
+	their latencies (in seconds, from the call to the reply or error).
+	"""
+	
+	# Upper bounds of the histogram buckets; the last one is unbounded
+	BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0,
+		2.0, 5.0, None)
+	
+	def __init__(self):
+		self.calls = 0
+		self.errors = 0
+		self.in_flight = 0
+		self.request_bytes = 0
+		self.reply_bytes = 0
+		self.total_latency = 0.0
+		self.max_latency = 0.0
+		self.histogram = [0] * len(self.BUCKETS)
+	
+	def add_latency(self, latency):
+		self.in_flight -= 1
+		self.total_latency += latency
+		self.max_latency = max(self.max_latency, latency)
+		for i, bound in enumerate(self.BUCKETS):
+			if bound is None or latency <= bound:
+				self.histogram[i] += 1
+				break
+	
+	def get_percentile(self, percentile):
+		"""
+		Return the upper bound of the bucket holding the given latency
+		percentile, or the maximal latency if it's in the last one.
+		"""
+		answered = sum(self.histogram)
+		if not answered:
+			return 0.0
+		rank = answered * percentile / 100.0
+		seen = 0
+		for bound, count in zip(self.BUCKETS, self.histogram):
+			seen += count
+			if seen >= rank:
+				return bound if bound is not None else self.max_latency
+		return self.max_latency
+	
+	def get_stats(self):
+		answered = sum(self.histogram)
+		return {
+			"calls": self.calls,
+			"errors": self.errors,
+			"in_flight": self.in_flight,
+			"request_bytes": self.request_bytes,
+			"reply_bytes": self.reply_bytes,
+			"total_latency": self.total_latency,
+			"mean_latency": self.total_latency / max(answered, 1),
+			"max_latency": self.max_latency,
+			"p50": self.get_percentile(50),
+			"p95": self.get_percentile(95),
+			"p99": self.get_percentile(99),
+			"histogram": zip(self.BUCKETS, self.histogram),
+		}
+
+class _Instrumentation(object):
+	"""
+	Records statistics about the D-Bus calls made through a
+	:class:`_DBusInterface`, and about the connection to the engine.
+	If *report_interval* is set, they are passed to *report_callback*
+	(or logged, if there is none) every *report_interval* seconds.
+	"""
+	
+	def __init__(self, report_interval=None, report_callback=None):
+		self.report_callback = report_callback
+		self.disconnects = 0
+		self.reconnects = 0
+		self._methods = {}
+		self._since = time.time()
+		self._report_source = None
+		if report_interval:
+			self._report_source = gobject.timeout_add_seconds(
+				report_interval, self._report)
+	
+	def close(self):
+		if self._report_source is not None:
+			gobject.source_remove(self._report_source)
+			self._report_source = None
+	
+	def call(self, method, args, kwargs, perform):
+		"""
+		Return perform(**kwargs), recording the call to *method*. For
+		asynchronous calls, *kwargs* must contain the reply_handler and
+		error_handler of the call.
+		"""
+		stats = self._methods.get(method)
+		if stats is None:
+			stats = self._methods[method] = _MethodStats()
+		stats.calls += 1
+		stats.in_flight += 1
+		stats.request_bytes += _estimate_size(args)
+		start = time.time()
+		
+		if "reply_handler" in kwargs:
+			reply_handler = kwargs["reply_handler"]
+			error_handler = kwargs["error_handler"]
+			
+			def instrumented_reply_handler(*reply):
+				stats.add_latency(time.time() - start)
+				stats.reply_bytes += _estimate_size(reply)
+				reply_handler(*reply)
+			
+			def instrumented_error_handler(error):
+				stats.add_latency(time.time() - start)
+				stats.errors += 1
+				error_handler(error)
+			
+			kwargs = dict(kwargs, reply_handler=instrumented_reply_handler,
+				error_handler=instrumented_error_handler)
+		
+		try:
+			result = perform(**kwargs)
+		except Exception:
+			stats.add_latency(time.time() - start)
+			stats.errors += 1
+			raise
+		if "reply_handler" not in kwargs:
+			stats.add_latency(time.time() - start)
+			stats.reply_bytes += _estimate_size(result)
+		return result
+	
+	def get_stats(self, reset=False):
+		"""
+		Return a dictionary with the statistics of each method called
+		since instrumentation was enabled or last reset (see
+		:meth:`_MethodStats.get_stats`) under "methods", the number
+		of times the connection to the engine was lost ("disconnects")
+		and reestablished ("reconnects"), and the time they were
+		recorded from ("since").
+		"""
+		stats = {
+			"since": self._since,
+			"disconnects": self.disconnects,
+			"reconnects": self.reconnects,
+			"methods": dict((method, method_stats.get_stats())
+				for method, method_stats in self._methods.iteritems()),
+		}
+		if reset:
+			self.disconnects = self.reconnects = 0
+			self._since = time.time()
+			for method_stats in self._methods.itervalues():
+				in_flight = method_stats.in_flight
+				method_stats.__init__()
+				method_stats.in_flight = in_flight
+		return stats
+	
+	def _report(self):
+		stats = self.get_stats()
+		if self.report_callback is not None:
+			self.report_callback(stats)
+			return True
+		methods = []
+		for method, method_stats in sorted(stats["methods"].iteritems()):
+			methods.append("%s: %d calls, %d errors, p50 %.1f ms, "
+				"p95 %.1f ms, %d bytes sent, %d received" % (method,
+				method_stats["calls"], method_stats["errors"],
+				method_stats["p50"] * 1000, method_stats["p95"] * 1000,
+				method_stats["request_bytes"], method_stats["reply_bytes"]))
+		log.info("D-Bus calls (%d reconnects): %s" % (stats["reconnects"],
+			"; ".join(methods) or "none"))
+		return True
+
+class _IntrospectionCache(object):
+	"""
+	Cache of the members of the engine's D-Bus interfaces, stored in
+	$XDG_CACHE_HOME/zeitgeist, so that short-lived clients don't have
+	to introspect every interface they use before their first call.
+	
+	The cached tables are only used while the running engine has the
+	same version and extensions as the one they were read from. Else
+	the interfaces are introspected again and the cache is rewritten.
+	"""
+	
+	FILENAME = "python-introspection.json"
+	
+	def __init__(self):
+		self._loaded = False
+		self._key = None
+		self._tables = {}
+	
+	@classmethod
+	def get_path(cls):
+		cache_dir = os.environ.get("XDG_CACHE_HOME") or \
+			os.path.join(os.path.expanduser("~"), ".cache")
+		return os.path.join(cache_dir, "zeitgeist", cls.FILENAME)
+	
+	def invalidate(self):
+		"""Forget the loaded tables, eg. because the engine was restarted"""
+		self._loaded = False
+		self._key = None
+		self._tables = {}
+	
+	def _load(self):
+		if self._loaded:
+			return
+		self._loaded = True
+		engine = ZeitgeistDBusInterface
+		try:
+			# One round trip, instead of one Introspect call per interface
+			properties = get_bus().call_blocking(engine.BUS_NAME,
+				engine.OBJECT_PATH, dbus.PROPERTIES_IFACE, "GetAll", "s",
+				(engine.INTERFACE_NAME,))
+		except dbus.exceptions.DBusException, e:
+			if e.get_dbus_name() == "org.freedesktop.DBus.Error.ServiceUnknown":
+				self._loaded = False
+				raise
+			log.debug("Not using the introspection cache: %s" % e)
+			return
+		self._key = [map(int, properties["version"]),
+			sorted(map(unicode, properties["extensions"]))]
+		try:
+			with open(self.get_path()) as cache_file:
+				data = json.load(cache_file)
+		except (IOError, ValueError), e:
+			log.debug("Couldn't read the introspection cache: %s" % e)
+			return
+		if isinstance(data, dict) and data.get("key") == self._key:
+			self._tables = data.get("tables") or {}
+	
+	def _save(self):
+		path = self.get_path()
+		temp_path = "%s.%d" % (path, os.getpid())
+		try:
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			with open(temp_path, "w") as cache_file:
+				json.dump({"key": self._key, "tables": self._tables},
+					cache_file)
+			# Atomic, so that concurrent clients never read half a file
+			os.rename(temp_path, path)
+		except (IOError, OSError), e:
+			log.debug("Couldn't write the introspection cache: %s" % e)
+	
+	def get(self, bus_name, object_path, interface_name):
+		"""
+		Return the cached (methods, signals, signatures) tuple for the
+		given interface, or None if it isn't known.
+		"""
+		if bus_name != ZeitgeistDBusInterface.BUS_NAME:
+			# Other services aren't covered by the engine's version
+			return None
+		self._load()
+		members = self._tables.get(" ".join((bus_name, object_path,
+			interface_name)))
+		if not isinstance(members, list) or len(members) != 3:
+			return None
+		return tuple(members)
+	
+	def set(self, bus_name, object_path, interface_name, members):
+		if bus_name != ZeitgeistDBusInterface.BUS_NAME:
+			return
+		self._load()
+		if self._key is None:
+			return
+		self._tables[" ".join((bus_name, object_path, interface_name))] = \
+			list(members)
+		self._save()
+
+_introspection_cache = _IntrospectionCache()
+
+def _get_proxy(bus_name, object_path, interface_name):
+	"""
+	Return a proxy for the given object. dbus-python only needs to
+	introspect it (for the signatures of its methods) if the interface
+	isn't in the introspection cache.
+	"""
+	cached = _introspection_cache.get(bus_name, object_path,
+		interface_name) is not None
+	return get_bus().get_object(bus_name, object_path,
+		follow_name_owner_changes=True, introspect=not cached)
+
 class _DBusInterface(object):
 	"""Wrapper around dbus.Interface adding convenience methods."""
 
@@ -60,6 +472,9 @@ class _DBusInterface(object):
 	# that here because otherwise all instances would share their state.
 	_disconnect_callbacks = None
 	_reconnect_callbacks = None
+	
+	# Whether the methods and signals were read from _introspection_cache
+	_members_cached = False
 
 	@staticmethod
 	def get_members(introspection_xml):
@@ -78,12 +493,32 @@ class _DBusInterface(object):
 			pass
 		return methods, signals
 
+	@staticmethod
+	def get_signatures(introspection_xml, interface_name):
+		"""Parses the XML context returned by Introspect() and returns
+		a dictionary mapping the names of the methods of the given
+		interface to their input signatures
+		"""
+		xml = ElementTree.fromstring(introspection_xml)
+		signatures = {}
+		for interface in xml.findall("interface"):
+			if interface.attrib.get("name") != interface_name:
+				continue
+			for node in interface.findall("method"):
+				signatures[node.attrib["name"]] = "".join(
+					arg.attrib["type"] for arg in node.findall("arg")
+					if arg.attrib.get("direction", "in") == "in")
+		return signatures
+
 	def reconnect(self):
 		if not self._reconnect_when_needed:
 			return
-		self.__proxy = get_bus().get_object(
-			self.__iface.requested_bus_name, self.__object_path,
-			follow_name_owner_changes=True)
+		if self._instrumentation is not None:
+			self._instrumentation.reconnects += 1
+		# The engine may have been upgraded or got other extensions
+		_introspection_cache.invalidate()
+		self.__proxy = _get_proxy(self.__iface.requested_bus_name,
+			self.__object_path, self.__interface_name)
 		self.__iface = dbus.Interface(self.__proxy, self.__interface_name)
 		self._load_introspection_data()
 
@@ -122,16 +557,87 @@ class _DBusInterface(object):
 			return reconnecting_error_handler(e)
 
 	def __getattr__(self, name):
+		if self.__methods is not None and name not in self.__methods \
+			and self._members_cached:
+			# The cache may be outdated, ask the engine itself
+			self._load_introspection_data(use_cache=False)
 		if self.__methods is not None and name not in self.__methods:
 			raise TypeError("Unknown method name: %s" % name)
 		def _ProxyMethod(*args, **kwargs):
 			"""
 			Method wrapping around a D-Bus call, which attempts to recover
 			the connection to Zeitgeist if it got lost.
+			
+			Asynchronous calls may be delayed by the request limit, in
+			the order given by the optional *priority* keyword argument.
 			"""
-			return self._disconnection_safe(
+			priority = kwargs.pop("priority", PRIORITY_INTERACTIVE)
+			if self.__signatures and name in self.__signatures:
+				# Needed if the proxy didn't introspect the object
+				kwargs.setdefault("signature",
+					str(self.__signatures[name]))
+			call = lambda **kwargs: self._disconnection_safe(
 				lambda: getattr(self.__iface, name), *args, **kwargs)
+			if self._limiter is not None and "reply_handler" in kwargs:
+				limited_call = call
+				call = lambda **kwargs: self._limiter.submit(limited_call,
+					kwargs, priority)
+			if self._instrumentation is not None:
+				return self._instrumentation.call(name, args, kwargs, call)
+			return call(**kwargs)
 		return _ProxyMethod
+	
+	def set_request_limit(self, limit):
+		"""
+		Limit the number of asynchronous calls waiting for a reply to
+		*limit*, or remove the limit if it is None. Further calls are
+		queued by priority (see :const:`PRIORITY_INTERACTIVE` and
+		:const:`PRIORITY_BULK`). Synchronous calls are never delayed.
+		"""
+		if limit is not None and limit < 1:
+			raise ValueError("The request limit must be positive")
+		if self._limiter is None:
+			if limit is not None:
+				self._limiter = _RequestLimiter(limit)
+		elif limit is None:
+			# Send all queued calls, but keep counting those in flight
+			self._limiter.set_limit(sys.maxint)
+		else:
+			self._limiter.set_limit(limit)
+	
+	def get_request_stats(self):
+		"""
+		Return statistics about the calls delayed by the request limit,
+		as documented in :meth:`_RequestLimiter.get_stats`, or None if
+		no limit was ever set.
+		"""
+		if self._limiter is None:
+			return None
+		return self._limiter.get_stats()
+	
+	def set_instrumentation(self, enabled, report_interval=None,
+		report_callback=None):
+		"""
+		Start recording statistics about calls made through this
+		interface (see :class:`_Instrumentation`), or stop if *enabled*
+		is False. Enabling it again starts from scratch.
+		"""
+		if self._instrumentation is not None:
+			self._instrumentation.close()
+			self._instrumentation = None
+		if enabled:
+			self._instrumentation = _Instrumentation(report_interval,
+				report_callback)
+	
+	def get_instrumentation_stats(self, reset=False):
+		"""
+		Return the statistics documented in
+		:meth:`_Instrumentation.get_stats`, or None if instrumentation
+		isn't enabled.
+		"""
+		if self._instrumentation is None:
+			return None
+		return self._instrumentation.get_stats(reset)
 
 	def get_property(self, property_name):
 		return self._disconnection_safe(
@@ -166,10 +672,22 @@ class _DBusInterface(object):
 	def proxy(self):
 		return self.__proxy
 
-	def _load_introspection_data(self):
-		self.__methods, self.__signals = self.get_members(
-			self.__proxy.Introspect(
-				dbus_interface='org.freedesktop.DBus.Introspectable'))
+	def _load_introspection_data(self, use_cache=True):
+		bus_name = self.__iface.requested_bus_name
+		members = None
+		if use_cache:
+			members = _introspection_cache.get(bus_name, self.__object_path,
+				self.__interface_name)
+		self._members_cached = members is not None
+		if members is None:
+			introspection_xml = self.__proxy.Introspect(
+				dbus_interface='org.freedesktop.DBus.Introspectable')
+			methods, signals = self.get_members(introspection_xml)
+			members = (methods, signals, self.get_signatures(
+				introspection_xml, self.__interface_name))
+			_introspection_cache.set(bus_name, self.__object_path,
+				self.__interface_name, members)
+		self.__methods, self.__signals, self.__signatures = members
 
 	def __init__(self, proxy, interface_name, object_path, reconnect=True):
 		self.__proxy = proxy
@@ -177,6 +695,8 @@ class _DBusInterface(object):
 		self.__object_path = object_path
 		self.__iface = dbus.Interface(proxy, interface_name)
 		self._reconnect_when_needed = reconnect
+		self._limiter = None
+		self._instrumentation = None
 		self._load_introspection_data()
 		
 		self._first_connection = True
@@ -187,6 +707,8 @@ class _DBusInterface(object):
 		def name_owner_changed(connection_name):
 			if connection_name == "":
 				self.__methods = self.__signals = None
+				if self._instrumentation is not None:
+					self._instrumentation.disconnects += 1
 				for callback in self._disconnect_callbacks:
 					callback()
 			elif self._first_connection:
@@ -244,8 +766,7 @@ class ZeitgeistDBusInterface(object):
 		if not name in cls.__shared_state["extension_interfaces"]:
 			interface_name = "org.gnome.zeitgeist.%s" % name
 			object_path = "/org/gnome/zeitgeist/%s" % path
-			proxy = get_bus().get_object(busname, object_path,
-				follow_name_owner_changes=True)
+			proxy = _get_proxy(busname, object_path, interface_name)
 			iface = _DBusInterface(proxy, interface_name, object_path)
 			iface.BUS_NAME = busname
 			iface.INTERFACE_NAME = interface_name
@@ -256,8 +777,8 @@ class ZeitgeistDBusInterface(object):
 	def __init__(self, reconnect=True):
 		if not "dbus_interface" in self.__shared_state:
 			try:
-				proxy = get_bus().get_object(self.BUS_NAME,
-					self.OBJECT_PATH, follow_name_owner_changes=True)
+				proxy = _get_proxy(self.BUS_NAME, self.OBJECT_PATH,
+					self.INTERFACE_NAME)
 			except dbus.exceptions.DBusException, e:
 				if e.get_dbus_name() == "org.freedesktop.DBus.Error.ServiceUnknown":
 					raise RuntimeError(
@@ -269,6 +790,42 @@ class ZeitgeistDBusInterface(object):
 			self.__shared_state["dbus_interface"] = _DBusInterface(proxy,
 				self.INTERFACE_NAME, self.OBJECT_PATH, reconnect)
 
+class _LazyEvents(Sequence):
+	"""
+	Read-only sequence of events received by a coalescing
+	:class:`Monitor`, which only turns D-Bus event structs into
+	:class:`Events <zeitgeist.datamodel.Event>` when they're accessed.
+	"""
+	
+	__slots__ = ("_structs", "_events", "_event_type")
+	
+	def __init__(self, structs, event_type):
+		self._structs = structs
+		self._events = [None] * len(structs)
+		self._event_type = event_type
+	
+	def __len__(self):
+		return len(self._structs)
+	
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in xrange(*index.indices(len(self)))]
+		event = self._events[index]
+		if event is None:
+			event = self._events[index] = self._event_type(self._structs[index])
+		return event
+	
+	def __eq__(self, other):
+		return isinstance(other, (Sequence, list)) and list(self) == list(other)
+	
+	def __ne__(self, other):
+		return not self == other
+	
+	__hash__ = None
+	
+	def __repr__(self):
+		return "%s(%r)" % (self.__class__.__name__, list(self))
+
 class Monitor(dbus.service.Object):
 	"""
 	DBus interface for monitoring the Zeitgeist log for certain types
@@ -280,6 +837,19 @@ class Monitor(dbus.service.Object):
 	It is important to understand that the Monitor instance lives on the
 	client side, and expose a DBus service there, and the Zeitgeist engine
 	calls back to the monitor when matching events are registered.
+	
+	If *coalesce_latency* is set, notifications are not passed on right
+	away but merged with those received during the following
+	*coalesce_latency* milliseconds, or until *coalesce_max_events*
+	events are waiting (if set). Events which were inserted and deleted
+	again meanwhile are dropped. Each batch results in at most one call
+	to *delete_callback* followed by one call to *insert_callback*,
+	which gets a sequence decoding the events on demand.
+	
+	Monitors which aren't exported (see *export*) don't receive
+	notifications from the engine themselves; instead, a
+	:class:`ZeitgeistClient` with *multiplex_monitors* set forwards the
+	notifications of a single monitor standing in for all of them.
 	"""
 	
 	# Used in Monitor._next_path() to generate unique path names
@@ -288,7 +858,8 @@ class Monitor(dbus.service.Object):
 	_event_type = Event
 
 	def __init__ (self, time_range, event_templates, insert_callback,
-		delete_callback, monitor_path=None, event_type=None):
+		delete_callback, monitor_path=None, event_type=None,
+		coalesce_latency=0, coalesce_max_events=0, export=True):
 		if not monitor_path:
 			monitor_path = Monitor._next_path()
 		elif isinstance(monitor_path, (str, unicode)):
@@ -304,7 +875,23 @@ class Monitor(dbus.service.Object):
 		self._path = monitor_path
 		self._insert_callback = insert_callback
 		self._delete_callback = delete_callback
-		dbus.service.Object.__init__(self, get_bus(), monitor_path)
+		
+		if coalesce_latency < 0 or coalesce_max_events < 0:
+			raise ValueError("Invalid coalesce_latency or coalesce_max_events")
+		self._coalesce_latency = coalesce_latency
+		self._coalesce_max_events = coalesce_max_events
+		# Notifications waiting to be passed on: inserted event structs
+		# and deleted event ids (as ordered sets), and the time range
+		# of the deletions
+		self._pending_inserts = OrderedDict()
+		self._pending_deletes = OrderedDict()
+		self._pending_delete_range = None
+		self._timeout = None
+		
+		if export:
+			dbus.service.Object.__init__(self, get_bus(), monitor_path)
+		else:
+			dbus.service.Object.__init__(self)
 	
 	def get_path (self): return self._path
 	path = property(get_path,
@@ -335,8 +922,16 @@ class Monitor(dbus.service.Object):
 		    with the events matching the monitor.
 		    See :meth:`ZeitgeistClient.install_monitor`
 		"""
-		self._insert_callback(TimeRange(time_range[0], time_range[1]),
-			map(self._event_type, events))
+		self._dispatch_insert(time_range, events)
+	
+	def _dispatch_insert(self, time_range, events):
+		if not self._coalesce_latency:
+			self._insert_callback(TimeRange(time_range[0], time_range[1]),
+				map(self._event_type, events))
+			return
+		for event in events:
+			self._pending_inserts[int(event[0][Event.Id])] = event
+		self._schedule_flush()
 	
 	@dbus.service.method("org.gnome.zeitgeist.Monitor",
 	                     in_signature="(xx)au")
@@ -357,7 +952,65 @@ class Monitor(dbus.service.Object):
 		:param event_ids: A list of event ids. An event id is simply
 		    and unsigned 32 bit integer. DBus signature au.
 		"""
-		self._delete_callback(TimeRange(time_range[0], time_range[1]), event_ids)
+		self._dispatch_delete(time_range, event_ids)
+	
+	def _dispatch_delete(self, time_range, event_ids):
+		if not self._coalesce_latency:
+			self._delete_callback(TimeRange(time_range[0], time_range[1]),
+				event_ids)
+			return
+		deleted = False
+		for event_id in event_ids:
+			event_id = int(event_id)
+			# Nobody has been told about events still waiting
+			if self._pending_inserts.pop(event_id, None) is None:
+				self._pending_deletes[event_id] = None
+				deleted = True
+		if deleted:
+			if self._pending_delete_range is None:
+				self._pending_delete_range = list(time_range)
+			else:
+				self._pending_delete_range[0] = min(
+					self._pending_delete_range[0], time_range[0])
+				self._pending_delete_range[1] = max(
+					self._pending_delete_range[1], time_range[1])
+		self._schedule_flush()
+	
+	def _schedule_flush(self):
+		pending = len(self._pending_inserts) + len(self._pending_deletes)
+		if self._coalesce_max_events and \
+				pending >= self._coalesce_max_events:
+			self.flush()
+		elif pending and self._timeout is None:
+			self._timeout = gobject.timeout_add(self._coalesce_latency,
+				self._latency_exceeded)
+	
+	def _latency_exceeded(self):
+		self._timeout = None
+		self.flush()
+		return False
+	
+	def flush(self):
+		"""
+		Pass on the notifications waiting to be coalesced right away.
+		"""
+		if self._timeout is not None:
+			gobject.source_remove(self._timeout)
+			self._timeout = None
+		inserts = self._pending_inserts.values()
+		deletes = self._pending_deletes.keys()
+		delete_range = self._pending_delete_range
+		self._pending_inserts = OrderedDict()
+		self._pending_deletes = OrderedDict()
+		self._pending_delete_range = None
+		
+		if deletes:
+			self._delete_callback(TimeRange(*delete_range), deletes)
+		if inserts:
+			timestamps = [int(event[0][Event.Timestamp]) for event in inserts]
+			self._insert_callback(
+				TimeRange(min(timestamps), max(timestamps)),
+				_LazyEvents(inserts, self._event_type))
 	
 	def __hash__ (self):
 		return hash(self._path)
@@ -371,6 +1024,594 @@ class Monitor(dbus.service.Object):
 		return dbus.ObjectPath("/org/gnome/zeitgeist/monitor/%s" % \
 			cls._last_path_id)
 
+# Fields monitors are indexed by in _TemplateIndex, as (part of the
+# event, field within it, whether it holds a symbol), by preference
+_INDEXED_FIELDS = (
+	(0, Event.Actor, False),
+	(0, Event.Interpretation, True),
+	(1, Subject.Interpretation, True),
+	(1, Subject.Mimetype, False),
+	(0, Event.Manifestation, True),
+	(1, Subject.Manifestation, True),
+)
+
+class _TemplateIndex(object):
+	"""
+	Index of monitors by the values their templates require for one of
+	the :data:`_INDEXED_FIELDS`, to find the monitors which may want an
+	event without trying the templates of all of them. Monitors whose
+	templates don't require an exact value for any of these fields are
+	always candidates.
+	"""
+	
+	def __init__(self):
+		self._indexes = [{} for field in _INDEXED_FIELDS]
+		self._unindexed = set()
+		# The index and values each key was added with
+		self._entries = {}
+	
+	@staticmethod
+	def _get_required_values(templates, part, field, is_symbol):
+		"""
+		Return the values (including child symbols) one of which an
+		event needs to have in *field* to match *templates*, or None if
+		they accept any value.
+		"""
+		values = set()
+		for template in templates:
+			if part == 0:
+				expressions = [template[0][field]]
+			else:
+				expressions = [subject[field] for subject in template[1]]
+			if not expressions:
+				return None
+			for expression in expressions:
+				if not expression or expression.startswith("!") or \
+						expression.endswith("*"):
+					return None
+				if not is_symbol:
+					values.add(expression)
+				elif expression.startswith("+"):
+					values.add(expression[1:])
+				else:
+					values.update(Symbol.find_child_uris_extended(expression))
+		return values or None
+	
+	def add(self, key, templates):
+		for i, (part, field, is_symbol) in enumerate(_INDEXED_FIELDS):
+			values = self._get_required_values(templates, part, field,
+				is_symbol)
+			if values is not None:
+				for value in values:
+					self._indexes[i].setdefault(value, set()).add(key)
+				self._entries[key] = (i, values)
+				return
+		self._unindexed.add(key)
+		self._entries[key] = (None, ())
+	
+	def remove(self, key):
+		i, values = self._entries.pop(key)
+		if i is None:
+			self._unindexed.discard(key)
+			return
+		index = self._indexes[i]
+		for value in values:
+			index[value].discard(key)
+			if not index[value]:
+				del index[value]
+	
+	def get_candidates(self, event):
+		"""Return the keys of the monitors *event* may match"""
+		candidates = set(self._unindexed)
+		for i, (part, field, is_symbol) in enumerate(_INDEXED_FIELDS):
+			index = self._indexes[i]
+			if not index:
+				continue
+			if part == 0:
+				candidates.update(index.get(event[0][field], ()))
+			else:
+				for subject in event[1]:
+					candidates.update(index.get(subject[field], ()))
+		return candidates
+
+class _MultiplexedMonitor(dbus.service.Object):
+	"""
+	Monitor installed in the engine by a :class:`_MonitorMultiplexer`.
+	"""
+	
+	def __init__(self, multiplexer, time_range, event_templates):
+		self._multiplexer = multiplexer
+		self.path = Monitor._next_path()
+		self.time_range = time_range
+		self.templates = event_templates
+		dbus.service.Object.__init__(self, get_bus(), self.path)
+	
+	@dbus.service.method("org.gnome.zeitgeist.Monitor",
+	                     in_signature="(xx)a("+SIG_EVENT+")")
+	def NotifyInsert(self, time_range, events):
+		self._multiplexer._notify_insert(time_range, events)
+	
+	@dbus.service.method("org.gnome.zeitgeist.Monitor",
+	                     in_signature="(xx)au")
+	def NotifyDelete(self, time_range, event_ids):
+		self._multiplexer._notify_delete(time_range, event_ids)
+
+class _MonitorMultiplexer(object):
+	"""
+	Stands in for any number of client side :class:`Monitors <Monitor>`
+	with a single monitor in the engine, using the union of their
+	templates and time ranges. Events are matched against the templates
+	of each monitor locally, so that the engine only sends each of them
+	once.
+	
+	The monitor in the engine is replaced (once the main loop is idle)
+	whenever monitors are added or removed. Until the engine confirmed
+	the removal of the previous one, notifications are received twice;
+	those about events which were already dispatched are ignored.
+	"""
+	
+	def __init__(self, iface):
+		self._iface = iface
+		self._monitors = OrderedDict()
+		self._predicates = {}
+		self._index = _TemplateIndex()
+		self._engine_monitor = None
+		self._retiring = 0
+		self._seen_inserts = set()
+		self._seen_deletes = set()
+		self._update_source = None
+		self._iface.connect_join(self._reinstall)
+	
+	def __contains__(self, path):
+		return path in self._monitors
+	
+	def add(self, monitor, predicate):
+		self._monitors[monitor.path] = monitor
+		self._predicates[monitor.path] = predicate
+		self._index.add(monitor.path, monitor.templates)
+		self._schedule_update()
+	
+	def remove(self, path):
+		monitor = self._monitors.pop(path)
+		del self._predicates[path]
+		self._index.remove(path)
+		self._schedule_update()
+		return monitor
+	
+	def _get_union(self):
+		"""
+		Return the time range and templates covering all monitors, or
+		None if there are none.
+		"""
+		if not self._monitors:
+			return None
+		begin = min(monitor.time_range[0] for monitor in
+			self._monitors.itervalues())
+		end = max(monitor.time_range[1] for monitor in
+			self._monitors.itervalues())
+		templates = []
+		for monitor in self._monitors.itervalues():
+			if not monitor.templates:
+				# Matches all events
+				templates = []
+				break
+			for template in monitor.templates:
+				if template not in templates:
+					templates.append(template)
+		return TimeRange(begin, end), templates
+	
+	def _schedule_update(self):
+		if self._update_source is None:
+			self._update_source = gobject.idle_add(self._update)
+	
+	def _update(self):
+		self._update_source = None
+		union = self._get_union()
+		previous = self._engine_monitor
+		if previous is not None and union is not None and \
+				[previous.time_range, previous.templates] == list(union):
+			return False
+		
+		self._engine_monitor = None
+		if union is not None:
+			self._engine_monitor = _MultiplexedMonitor(self, *union)
+			self._install(self._engine_monitor)
+		if previous is not None:
+			self._retiring += 1
+			def removed(*args):
+				self._retiring -= 1
+				previous.remove_from_connection()
+				if not self._retiring:
+					self._seen_inserts.clear()
+					self._seen_deletes.clear()
+			self._iface.RemoveMonitor(previous.path, reply_handler=removed,
+				error_handler=removed)
+		return False
+	
+	def _install(self, engine_monitor):
+		self._iface.InstallMonitor(engine_monitor.path,
+			engine_monitor.time_range, engine_monitor.templates,
+			reply_handler=lambda: None, error_handler=lambda err: log.warn(
+				"Error installing multiplexed monitor: %s" % err))
+	
+	def _reinstall(self):
+		# Previous monitors are gone with the engine
+		self._retiring = 0
+		self._seen_inserts.clear()
+		self._seen_deletes.clear()
+		if self._engine_monitor is not None:
+			self._install(self._engine_monitor)
+	
+	def _notify_insert(self, time_range, events):
+		time_range = TimeRange(time_range[0], time_range[1])
+		matches = {}
+		for event in events:
+			if self._retiring:
+				event_id = int(event[0][Event.Id])
+				if event_id in self._seen_inserts:
+					continue
+				self._seen_inserts.add(event_id)
+			timestamp = int(event[0][Event.Timestamp])
+			for path in self._index.get_candidates(event):
+				monitor = self._monitors[path]
+				if monitor.time_range[0] <= timestamp <= \
+						monitor.time_range[1] and self._predicates[path](event):
+					matches.setdefault(path, []).append(event)
+		
+		for path, monitor in self._monitors.items():
+			if path in matches:
+				monitor._dispatch_insert(time_range.intersect(
+					TimeRange(*monitor.time_range)), matches[path])
+	
+	def _notify_delete(self, time_range, event_ids):
+		if self._retiring:
+			event_ids = [event_id for event_id in map(int, event_ids)
+				if event_id not in self._seen_deletes]
+			self._seen_deletes.update(event_ids)
+			if not event_ids:
+				return
+		time_range = TimeRange(time_range[0], time_range[1])
+		for monitor in self._monitors.values():
+			intersection = time_range.intersect(
+				TimeRange(*monitor.time_range))
+			if intersection is not None:
+				monitor._dispatch_delete(intersection, event_ids)
+
+class _PendingRequest(object):
+	"""
+	Asynchronous D-Bus call whose reply is waited for by iterating the
+	GLib main context. See :meth:`ZeitgeistClient.iter_events`.
+	"""
+	
+	def __init__(self, method, *args, **kwargs):
+		self.args = args
+		self.result = None
+		self.error = None
+		self.done = False
+		method(*args, reply_handler=self._reply_handler,
+			error_handler=self._error_handler, **kwargs)
+	
+	def _reply_handler(self, result):
+		self.result = result
+		self.done = True
+	
+	def _error_handler(self, error):
+		self.error = error
+		self.done = True
+	
+	def wait(self):
+		context = gobject.main_context_default()
+		while not self.done:
+			context.iteration(True)
+
+def _copy_event(event):
+	return event.__class__((list(event[0]),
+		[list(subject) for subject in event[1]], event[2]))
+
+class _LRUCache(object):
+	"""
+	Bounded mapping discarding the least recently used entries, and
+	counting how many lookups were successful.
+	"""
+	
+	def __init__(self, size):
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	def __contains__(self, key):
+		return key in self._entries
+	
+	def _lookup(self, key):
+		try:
+			entry = self._entries.pop(key)
+		except KeyError:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self._entries[key] = entry
+		return entry
+	
+	def _store(self, key, entry):
+		self._entries.pop(key, None)
+		self._entries[key] = entry
+		while len(self._entries) > self.size:
+			self._entries.popitem(last=False)
+	
+	def clear(self):
+		self._entries.clear()
+	
+	def get_stats(self):
+		"""
+		Return a dictionary with the number of cache hits and misses
+		and the current and maximal number of entries
+		"""
+		return {"hits": self.hits, "misses": self.misses,
+			"entries": len(self._entries), "size": self.size}
+
+class _EventCache(_LRUCache):
+	"""
+	Cache of events, keyed by their id. Events can't be modified once
+	inserted into the log, so entries only need to be removed when
+	events are deleted.
+	
+	Copies of the events are stored and returned, so that callers may
+	modify them.
+	"""
+	
+	def get(self, event_id):
+		"""Return a copy of the cached event, or None"""
+		event = self._lookup(event_id)
+		if event is not None:
+			event = _copy_event(event)
+		return event
+	
+	def add(self, event_id, event):
+		self._store(event_id, _copy_event(event))
+	
+	def remove(self, event_ids):
+		for event_id in event_ids:
+			self._entries.pop(int(event_id), None)
+
+class _QueryCache(_LRUCache):
+	"""
+	Cache of the results of FindEventIds and FindEvents queries, keyed
+	by their normalized arguments.
+	
+	Entries are evicted when events which could change their result
+	are inserted or deleted: inserted events in the time range of the
+	query matching any of its templates, or deleted events anywhere in
+	its time range (deletions are only notified by id and time range).
+	Move events change the current URI of events already in any result,
+	so all entries are evicted when one is inserted.
+	"""
+	
+	# Key used for queries up to the current time, which are performed
+	# with a different time range each time
+	UNTIL_NOW = "until-now"
+	
+	@staticmethod
+	def get_key(method, event_templates, timerange, num_events,
+		result_type):
+		"""
+		Return the cache key for a query, or None if it can't be cached.
+		*timerange* is None for queries up to the current time.
+		"""
+		if timerange is None:
+			timerange = _QueryCache.UNTIL_NOW
+		else:
+			timerange = (int(timerange[0]), int(timerange[1]))
+		# The order of the templates doesn't matter; the payload of
+		# templates is ignored by the engine
+		templates = tuple(sorted((tuple(template[0]),
+			tuple(tuple(subject) for subject in template[1]))
+			for template in event_templates))
+		return (method, templates, timerange, int(num_events),
+			int(result_type))
+	
+	def get(self, key):
+		"""Return a copy of the cached result, or None"""
+		entry = self._lookup(key)
+		if entry is None:
+			return None
+		result = entry[0]
+		if key[0] == "FindEvents":
+			return [_copy_event(event) if event is not None else None
+				for event in result]
+		return list(result)
+	
+	def add(self, key, event_templates, result):
+		"""
+		Cache the *result* of the query identified by *key*. Queries
+		with templates which can't be evaluated locally (ie. on the
+		storage state of subjects) aren't cached.
+		"""
+		try:
+			predicate = compile_templates(event_templates)
+		except ValueError:
+			return
+		if key[2] == self.UNTIL_NOW:
+			time_range = TimeRange.always()
+		else:
+			time_range = TimeRange(*key[2])
+		if key[0] == "FindEvents":
+			result = [_copy_event(event) if event is not None else None
+				for event in result]
+		else:
+			result = list(result)
+		self._store(key, (result, time_range, predicate))
+	
+	def remove_for_insert(self, time_range, events):
+		for event in events:
+			if event.interpretation == Interpretation.MOVE_EVENT:
+				self.clear()
+				return
+		timestamps = [(int(event.timestamp), event) for event in events]
+		for key, (result, entry_range, predicate) in self._entries.items():
+			if entry_range.intersect(time_range) is None:
+				continue
+			for timestamp, event in timestamps:
+				if entry_range.begin <= timestamp <= entry_range.end and \
+						predicate(event):
+					del self._entries[key]
+					break
+	
+	def remove_for_delete(self, time_range):
+		for key, (result, entry_range, predicate) in self._entries.items():
+			if entry_range.intersect(time_range) is not None:
+				del self._entries[key]
+
+class _InsertQueue(object):
+	"""
+	Coalesces insertions into InsertEvents calls of up to *batch_size*
+	events, sent at most *latency* milliseconds after the first event
+	was queued. At most *max_pending* calls are in flight at the same
+	time; once enough events are waiting to fill that many calls again,
+	queuing more blocks (iterating the default GLib main context) until
+	the engine replied to one of them.
+	"""
+	
+	def __init__(self, iface, batch_size, latency, max_pending):
+		self._iface = iface
+		self.batch_size = batch_size
+		self.latency = latency
+		self.max_pending = max_pending
+		# Queued (events, reply_handler, error_handler, alone) requests;
+		# those with alone set are sent by themselves, right away
+		self._queue = deque()
+		self._queued = 0
+		self._pending = 0
+		self._timeout = None
+		# Set when the latency was exceeded, or a flush was requested
+		self._overdue = False
+	
+	def add(self, events, reply_handler, error_handler):
+		context = gobject.main_context_default()
+		while self._queued >= self.batch_size * self.max_pending:
+			context.iteration(True)
+		self._queue.append((events, reply_handler, error_handler, False))
+		self._queued += len(events)
+		self._send_batches()
+	
+	def flush(self):
+		"""Send all queued events, as far as *max_pending* allows"""
+		if self._queue:
+			self._overdue = True
+			self._send_batches()
+	
+	def _send_batches(self):
+		while self._queue and self._pending < self.max_pending:
+			if self._queued < self.batch_size and not self._overdue \
+					and not self._queue[0][3]:
+				break
+			batch = [self._queue.popleft()]
+			size = len(batch[0][0])
+			while self._queue and not batch[0][3] \
+					and not self._queue[0][3] and \
+					size + len(self._queue[0][0]) <= self.batch_size:
+				batch.append(self._queue.popleft())
+				size += len(batch[-1][0])
+			self._queued -= size
+			self._send(batch)
+		
+		if not self._queue:
+			self._overdue = False
+			if self._timeout is not None:
+				gobject.source_remove(self._timeout)
+				self._timeout = None
+		elif self._timeout is None and not self._overdue:
+			self._timeout = gobject.timeout_add(self.latency,
+				self._latency_exceeded)
+	
+	def _latency_exceeded(self):
+		self._timeout = None
+		self._overdue = True
+		self._send_batches()
+		return False
+	
+	def _send(self, batch):
+		def reply_handler(ids):
+			self._pending -= 1
+			offset = 0
+			for events, ids_reply_handler, error_handler, alone in batch:
+				ids_reply_handler(ids[offset:offset + len(events)])
+				offset += len(events)
+			self._send_batches()
+		
+		def error_handler(error):
+			self._pending -= 1
+			if len(batch) == 1:
+				batch[0][2](error)
+			else:
+				# The engine rejects the whole call if any of the events
+				# is invalid, so give each request its own result, by
+				# sending them again one by one
+				for events, ids_reply_handler, error_handler, alone in \
+						reversed(batch):
+					self._queue.appendleft((events, ids_reply_handler,
+						error_handler, True))
+					self._queued += len(events)
+			self._send_batches()
+		
+		self._pending += 1
+		self._iface.InsertEvents([event for request in batch
+			for event in request[0]], reply_handler=reply_handler,
+			error_handler=error_handler, priority=PRIORITY_BULK)
+
+class _DirectReadThread(object):
+	"""
+	Thread answering queries by reading the database directly, so that
+	slow queries don't block the main loop. Queries are answered in
+	the order they were made, and their replies are passed to the
+	default GLib main loop. It is shared by all clients.
+	"""
+	
+	_lock = threading.Lock()
+	_instance = None
+	
+	@classmethod
+	def get_default(cls):
+		with cls._lock:
+			if cls._instance is None:
+				# Let the thread run while the main loop is waiting
+				gobject.threads_init()
+				cls._instance = cls()
+			return cls._instance
+	
+	def __init__(self):
+		self._queue = Queue.Queue()
+		self._thread = threading.Thread(target=self._run,
+			name="zeitgeist-direct-read")
+		self._thread.daemon = True
+		self._thread.start()
+	
+	def submit(self, query, reply_handler, error_handler, fallback):
+		"""
+		Call *query* in the thread, and pass its result to
+		*reply_handler* or the exception it raised to *error_handler*.
+		If it raises :class:`DirectReadUnavailable`, *fallback* is
+		called instead, without arguments.
+		"""
+		self._queue.put((query, reply_handler, error_handler, fallback))
+	
+	def _run(self):
+		while True:
+			query, reply_handler, error_handler, fallback = self._queue.get()
+			try:
+				result = query()
+			except DirectReadUnavailable, e:
+				log.debug("Can't read directly: %s" % e)
+				gobject.idle_add(lambda: fallback() and False)
+			except Exception, e:
+				gobject.idle_add(lambda e=e: error_handler(e) and False)
+			else:
+				gobject.idle_add(
+					lambda result=result: reply_handler(result) and False)
+
 class ZeitgeistClient:
 	"""
 	Convenience APIs to have a Pythonic way to call and monitor the running
@@ -385,6 +1626,13 @@ class ZeitgeistClient:
 	_installed_monitors = []
 	_event_type = Event
 	
+	# Template for the internal cache monitor when only the event cache
+	# is enabled, which only needs to be notified about deletions (those
+	# are sent for all events in the monitored time range, whether they
+	# match the templates or not)
+	_NO_EVENTS_TEMPLATE = Event.new_for_values(
+		actor="zeitgeist-client-cache://no-events")
+	
 	@staticmethod
 	def get_event_and_extra_arguments(arguments):
 		""" some methods of :class:`ZeitgeistClient` take a variable
@@ -399,11 +1647,74 @@ class ZeitgeistClient:
 		ev = Event.new_for_values(**arguments)
 		return ev, kwargs
 	
-	def __init__ (self):
+	def __init__ (self, event_cache_size=0, query_cache_size=0,
+		insert_batch_size=0, insert_latency=100, max_pending_inserts=4,
+		direct_read=None, multiplex_monitors=False):
+		"""
+		:param event_cache_size: Maximal number of events to keep in a
+		    cache for :meth:`get_events`. See :attr:`event_cache`.
+		:param query_cache_size: Maximal number of query results to keep
+		    in a cache for :meth:`find_event_ids_for_templates` and
+		    :meth:`find_events_for_templates`. See :attr:`query_cache`.
+		:param insert_batch_size: If set, events passed to
+		    :meth:`insert_events` are queued and sent in batches of up
+		    to this many events. See :meth:`flush_inserts`.
+		:param insert_latency: Maximal number of milliseconds queued
+		    events wait before being sent
+		:param max_pending_inserts: Maximal number of batches waiting
+		    for a reply from the engine
+		:param direct_read: Whether to answer queries by reading the
+		    database directly instead of asking the engine, when
+		    possible. Defaults to False, unless the
+		    ZEITGEIST_LOG_DIRECT_READ environment variable (also used
+		    by libzeitgeist) is set to a non-zero value.
+		:param multiplex_monitors: If True, monitors installed with
+		    :meth:`install_monitor` share a single monitor in the engine
+		    and events are matched against their templates locally.
+		    Worthwhile for processes with many monitors.
+		"""
 		self._iface = ZeitgeistDBusInterface()
 		self._registry = self._iface.get_extension("DataSourceRegistry",
 			"data_source_registry")
 		
+		self._insert_queue = None
+		if insert_batch_size > 0:
+			if insert_latency < 0 or max_pending_inserts < 1:
+				raise ValueError(
+					"Invalid insert_latency or max_pending_inserts")
+			self._insert_queue = _InsertQueue(self._iface,
+				insert_batch_size, insert_latency, max_pending_inserts)
+		
+		self._event_cache = None
+		self._query_cache = None
+		self._cache_monitor = None
+		self._cache_active = False
+		# Incremented on every change notification, so that replies to
+		# queries sent before it aren't cached
+		self._cache_generation = 0
+		if event_cache_size > 0:
+			self._event_cache = _EventCache(event_cache_size)
+		if query_cache_size > 0:
+			self._query_cache = _QueryCache(query_cache_size)
+		if self._event_cache is not None or self._query_cache is not None:
+			self._install_cache_monitor()
+		
+		if direct_read is None:
+			try:
+				direct_read = int(os.environ.get(
+					"ZEITGEIST_LOG_DIRECT_READ", "0")) != 0
+			except ValueError:
+				direct_read = False
+		self._direct_read = direct_read
+		self._db_reader = None
+		self._multiplexer = None
+		if multiplex_monitors:
+			self._multiplexer = _MonitorMultiplexer(self._iface)
+		self._db_reader_failed = False
+		if direct_read:
+			# The database may have moved or changed with the engine
+			self._iface.connect_exit(self._close_db_reader)
+		
 		# Reconnect all active monitors if the connection is reset.
 		def reconnect_monitors():
 			log.info("Reconnected to Zeitgeist engine...")
@@ -416,6 +1727,198 @@ class ZeitgeistClient:
 						"Error reinstalling monitor: %s" % err))
 		self._iface.connect_join(reconnect_monitors)
 	
+	def _install_cache_monitor(self):
+		"""
+		Install the monitor keeping the client side caches up to date.
+		Caches are only used once the engine has acknowledged it, and
+		are dropped while the connection to the engine is lost.
+		"""
+		def activate_caches():
+			self._cache_active = True
+		
+		def cache_monitor_failed(error):
+			log.warn("Error installing cache monitor: %s" % error)
+		
+		def install_cache_monitor():
+			self._iface.InstallMonitor(self._cache_monitor.path,
+				self._cache_monitor.time_range,
+				self._cache_monitor.templates,
+				reply_handler=activate_caches,
+				error_handler=cache_monitor_failed)
+		
+		def deactivate_caches():
+			self._cache_active = False
+			self._clear_caches()
+		
+		# The query cache needs to know about all inserted events
+		if self._query_cache is not None:
+			templates = []
+		else:
+			templates = [self._NO_EVENTS_TEMPLATE]
+		self._cache_monitor = Monitor(TimeRange.always(),
+			templates, self._cache_notify_insert,
+			self._cache_notify_delete, event_type=self._event_type)
+		install_cache_monitor()
+		self._iface.connect_exit(deactivate_caches)
+		self._iface.connect_join(install_cache_monitor)
+	
+	def _close_db_reader(self):
+		if self._db_reader is not None:
+			self._db_reader.close()
+		self._db_reader = None
+		self._db_reader_failed = False
+	
+	def _get_db_reader(self):
+		"""
+		Return the :class:`DbReader <zeitgeist.dbreader.DbReader>` for
+		the database of the engine, or None if it can't be read directly.
+		"""
+		if self._direct_read and self._db_reader is None and \
+				not self._db_reader_failed:
+			try:
+				self._db_reader = DbReader(
+					self._iface.get_property("datapath"))
+			except (DirectReadUnavailable, dbus.exceptions.DBusException), e:
+				log.debug("Not reading the database directly: %s" % e)
+				self._db_reader_failed = True
+		return self._db_reader
+	
+	def _read(self, method, *args, **kwargs):
+		"""
+		Answer a call to the D-Bus *method* (FindEventIds, FindEvents or
+		GetEvents) of the engine by reading the database directly, or
+		make the call if that isn't possible. The reply is passed to the
+		*reply_handler* keyword argument from the main loop either way.
+		
+		The database is read in another thread, so that slow queries
+		don't block the main loop.
+		"""
+		call = lambda: getattr(self._iface, method)(*args, **kwargs)
+		reader = self._get_db_reader()
+		if reader is None:
+			call()
+			return
+		if method == "FindEventIds":
+			query = lambda: reader.find_event_ids(*args)
+		elif method == "FindEvents":
+			query = lambda: reader.find_events(*args)
+		else:
+			query = lambda: reader.get_events(*args)
+		# Let the engine answer queries which can't be read directly
+		# (or report the error)
+		_DirectReadThread.get_default().submit(query,
+			kwargs["reply_handler"], kwargs["error_handler"], call)
+	
+	def _clear_caches(self):
+		self._cache_generation += 1
+		if self._event_cache is not None:
+			self._event_cache.clear()
+		if self._query_cache is not None:
+			self._query_cache.clear()
+	
+	def _cache_notify_insert(self, time_range, events):
+		self._cache_generation += 1
+		if self._query_cache is not None:
+			self._query_cache.remove_for_insert(time_range, events)
+	
+	def _cache_notify_delete(self, time_range, event_ids):
+		self._cache_generation += 1
+		if self._event_cache is not None:
+			self._event_cache.remove(event_ids)
+		if self._query_cache is not None:
+			self._query_cache.remove_for_delete(time_range)
+	
+	@property
+	def event_cache(self):
+		"""
+		The cache used by :meth:`get_events`, or None if it is disabled.
+		Its :meth:`get_stats` method returns the number of hits and
+		misses.
+		
+		Events are only cached once the internal monitor used to track
+		deleted events has been installed, and the cache is cleared
+		whenever the connection to the engine is lost.
+		"""
+		return self._event_cache
+	
+	@property
+	def query_cache(self):
+		"""
+		The cache used by :meth:`find_event_ids_for_templates` and
+		:meth:`find_events_for_templates`, or None if it is disabled.
+		Its :meth:`get_stats` method returns the number of hits and
+		misses.
+		
+		Only queries with :const:`StorageState.Any` are cached. Results
+		are evicted when events matching the query are inserted, or
+		when any events in its time range are deleted. Queries without
+		an explicit time range are cached as queries up to the current
+		time; events with timestamps in the future won't be noticed when
+		they become part of the result.
+		"""
+		return self._query_cache
+	
+	def set_request_limit(self, limit):
+		"""
+		Limit the number of asynchronous requests to the engine waiting
+		for a reply, or remove the limit if *limit* is None. Requests
+		beyond the limit are queued, and bulk requests (made by
+		:meth:`iter_events` and the insert queue) are only sent when no
+		other request is waiting.
+		
+		The limit is shared by all clients in the process.
+		"""
+		self._iface.set_request_limit(limit)
+	
+	def get_request_stats(self):
+		"""
+		Return a dictionary with statistics about the requests delayed
+		by :meth:`set_request_limit`: "in_flight", "queue_depth" and
+		"max_queue_depth", the number of "dispatched" and "delayed"
+		requests and the "total_wait", "mean_wait" and "max_wait" in
+		seconds. Returns None if no limit was set.
+		"""
+		return self._iface.get_request_stats()
+	
+	def set_instrumentation(self, enabled, report_interval=None,
+		report_callback=None):
+		"""
+		Start (or, if *enabled* is False, stop) recording statistics
+		about the D-Bus calls made to the engine, to tell time spent in
+		D-Bus and the engine apart from time spent in the application.
+		See :meth:`get_instrumentation_stats`.
+		
+		If *report_interval* is set, the statistics are passed to
+		*report_callback* every *report_interval* seconds, or logged if
+		no callback is given.
+		
+		Like the request limit, instrumentation is shared by all clients
+		in the process.
+		"""
+		self._iface.set_instrumentation(enabled, report_interval,
+			report_callback)
+	
+	def get_instrumentation_stats(self, reset=False):
+		"""
+		Return a dictionary with the statistics recorded since
+		:meth:`set_instrumentation` was called, or since they were last
+		*reset*, or None if instrumentation isn't enabled.
+		
+		"methods" maps the name of each D-Bus method called to a
+		dictionary with the number of "calls", "errors" and calls
+		"in_flight", the estimated size of the requests and replies
+		("request_bytes" and "reply_bytes"), the "total_latency",
+		"mean_latency" and "max_latency" and the "p50", "p95" and "p99"
+		latency percentiles, all in seconds, and the latency
+		"histogram" as a list of (upper bound, count) pairs. Latencies
+		include the time spent waiting for the request limit.
+		
+		"disconnects" and "reconnects" count how often the connection
+		to the engine was lost and reestablished, and "since" is the
+		time the statistics were recorded from.
+		"""
+		return self._iface.get_instrumentation_stats(reset)
+	
 	def register_event_subclass(self, event_type):
 		"""
 		Register a subclass of Event with this ZeiteistClient instance. When
@@ -425,6 +1928,7 @@ class ZeitgeistClient:
 		if not issubclass(event_type, Event):
 			raise TypeError("Event subclass expected.")
 		self._event_type = event_type
+		self._clear_caches()
 	
 	def register_subject_subclass(self, subject_type):
 		"""
@@ -444,6 +1948,7 @@ class ZeitgeistClient:
 		class EventWithCustomSubject(self._event_type):
 			_subject_type = subject_type
 		self._event_type = EventWithCustomSubject
+		self._clear_caches()
 	
 	def _safe_error_handler(self, error_handler, *args):
 		if error_handler is not None:
@@ -545,15 +2050,36 @@ class ZeitgeistClient:
 		
 		In order to use this method there needs to be a mainloop
 		runnning. Both Qt and GLib mainloops are supported.
+		
+		If the client was created with an *insert_batch_size*, the
+		events are queued and sent together with those of other calls.
+		*ids_reply_handler* still receives the ids of the events passed
+		to this call only. This method may block while too many batches
+		are waiting for a reply from the engine.
 		"""
 		
 		self._check_list_or_tuple(events)
 		self._check_members(events, Event)
+		if self._insert_queue is not None and events:
+			self._insert_queue.add(events,
+				self._safe_reply_handler(ids_reply_handler),
+				self._safe_error_handler(error_handler,
+					self._safe_reply_handler(ids_reply_handler), []))
+			return
 		self._iface.InsertEvents(events,
 					reply_handler=self._safe_reply_handler(ids_reply_handler),
 					error_handler=self._safe_error_handler(error_handler,
 						self._safe_reply_handler(ids_reply_handler), []))
 	
+	def flush_inserts(self):
+		"""
+		Send the events queued by :meth:`insert_events` without waiting
+		for more events or for the latency to expire. Does nothing if
+		the client wasn't created with an *insert_batch_size*.
+		"""
+		if self._insert_queue is not None:
+			self._insert_queue.flush()
+	
 	def find_event_ids_for_templates (self,
 					event_templates,
 					ids_reply_handler,
@@ -622,10 +2148,18 @@ class ZeitgeistClient:
 			raise TypeError(
 				"Reply handler not callable, found %s" % ids_reply_handler)
 		
+		if self._query_cache is not None and self._cache_active and \
+				storage_state == StorageState.Any:
+			self._find_cached("FindEventIds", event_templates, timerange,
+				num_events, result_type, list,
+				self._safe_reply_handler(ids_reply_handler),
+				self._safe_error_handler(error_handler, ids_reply_handler, []))
+			return
+		
 		if timerange is None:
 			timerange = TimeRange.until_now()
 		
-		self._iface.FindEventIds(timerange,
+		self._read("FindEventIds", timerange,
 					event_templates,
 					storage_state,
 					num_events,
@@ -718,10 +2252,20 @@ class ZeitgeistClient:
 			raise TypeError(
 				"Reply handler not callable, found %s" % events_reply_handler)
 		
+		if self._query_cache is not None and self._cache_active and \
+				storage_state == StorageState.Any:
+			self._find_cached("FindEvents", event_templates, timerange,
+				num_events, result_type,
+				lambda raw: map(self._event_type.new_for_struct, raw),
+				events_reply_handler,
+				self._safe_error_handler(error_handler,
+					events_reply_handler, []))
+			return
+		
 		if timerange is None:
 			timerange = TimeRange.until_now()
 		
-		self._iface.FindEvents(timerange,
+		self._read("FindEvents", timerange,
 					event_templates,
 					storage_state,
 					num_events,
@@ -731,6 +2275,37 @@ class ZeitgeistClient:
 					error_handler=self._safe_error_handler(error_handler,
 						events_reply_handler, []))
 	
+	def _find_cached(self, method, event_templates, timerange, num_events,
+		result_type, convert, reply_handler, error_handler):
+		"""
+		Implementation of :meth:`find_event_ids_for_templates` and
+		:meth:`find_events_for_templates` looking up the results in the
+		query cache first. *method* is the name of the D-Bus method to
+		call and *convert* turns its raw reply into the result.
+		"""
+		cache = self._query_cache
+		key = cache.get_key(method, event_templates, timerange, num_events,
+			result_type)
+		result = cache.get(key)
+		if result is not None:
+			# Keep the reply asynchronous, as callers expect
+			gobject.idle_add(lambda: reply_handler(result) and False)
+			return
+		
+		generation = self._cache_generation
+		def cache_reply_handler(raw):
+			result = convert(raw)
+			# Only cache results if the log didn't change meanwhile
+			if self._cache_active and generation == self._cache_generation:
+				cache.add(key, event_templates, result)
+			reply_handler(result)
+		
+		if timerange is None:
+			timerange = TimeRange.until_now()
+		self._read(method, timerange, event_templates,
+			StorageState.Any, num_events, result_type,
+			reply_handler=cache_reply_handler, error_handler=error_handler)
+	
 	def find_events_for_template (self, event_template, events_reply_handler,
 		**kwargs):
 		"""
@@ -755,6 +2330,79 @@ class ZeitgeistClient:
 						events_reply_handler,
 						**arguments)
 	
+	def iter_events (self, event_templates, timerange=None,
+		storage_state=StorageState.Any, num_events=0,
+		result_type=ResultType.MostRecentEvents, chunk_size=100,
+		max_chunk_size=5000, prefetch=2):
+		"""
+		Return a generator yielding all :class:`Events <Event>` matching
+		*event_templates*, for walking through result sets too big to
+		be returned by a single :meth:`find_events_for_templates` call.
+		
+		The ids of the matching events are looked up with a single
+		(synchronous) FindEventIds call. The events are then requested
+		in chunks with GetEvents, keeping up to *prefetch* requests in
+		flight, and yielded as soon as they arrive. Chunks start with
+		*chunk_size* events and grow up to *max_chunk_size* events,
+		shrinking again whenever the engine refuses to send a reply
+		because of its size.
+		
+		Events deleted while iterating are skipped.
+		
+		Unlike the other methods in this class, this one blocks. While
+		waiting for replies the default GLib main context is iterated,
+		so a running main loop is not needed (but other callbacks may be
+		dispatched meanwhile).
+		
+		:param num_events: The maximal number of events to return; the
+		    default, 0, returns all matching events
+		
+		See :meth:`find_events_for_templates` for the other parameters.
+		D-Bus errors are raised as exceptions.
+		"""
+		self._check_list_or_tuple(event_templates)
+		self._check_members(event_templates, Event)
+		if chunk_size < 1 or max_chunk_size < chunk_size or prefetch < 1:
+			raise ValueError("Invalid chunk_size, max_chunk_size or prefetch")
+		
+		if timerange is None:
+			timerange = TimeRange.until_now()
+		
+		event_ids = self._iface.FindEventIds(timerange, event_templates,
+			storage_state, num_events, result_type)
+		
+		position = 0
+		pending = deque()
+		while position < len(event_ids) or pending:
+			while len(pending) < prefetch and position < len(event_ids):
+				chunk = event_ids[position:position + chunk_size]
+				position += len(chunk)
+				pending.append(_PendingRequest(self._iface.GetEvents, chunk,
+					priority=PRIORITY_BULK))
+			
+			request = pending.popleft()
+			request.wait()
+			
+			if request.error is not None:
+				chunk = request.args[0]
+				if request.error.get_dbus_name() != TOO_MANY_RESULTS_ERROR \
+						or len(chunk) == 1:
+					raise request.error
+				# Split the chunk and request both halves again, before
+				# any of the requests which are already in flight
+				chunk_size = max(1, len(chunk) / 2)
+				pending.appendleft(_PendingRequest(self._iface.GetEvents,
+					chunk[chunk_size:], priority=PRIORITY_BULK))
+				pending.appendleft(_PendingRequest(self._iface.GetEvents,
+					chunk[:chunk_size], priority=PRIORITY_BULK))
+				continue
+			
+			chunk_size = min(chunk_size * 2, max_chunk_size)
+			for struct in request.result:
+				event = self._event_type.new_for_struct(struct)
+				if event is not None:
+					yield event
+	
 	def get_events (self, event_ids, events_reply_handler, error_handler=None):
 		"""
 		Look up a collection of :class:`Events <zeitgeist.datamodel.Event>`
@@ -784,14 +2432,61 @@ class ZeitgeistClient:
 			raise TypeError(
 				"Reply handler not callable, found %s" % events_reply_handler)
 		
+		if self._event_cache is not None and self._cache_active:
+			self._get_events_cached(event_ids, events_reply_handler,
+				error_handler)
+			return
+		
 		# Generate a wrapper callback that does automagic conversion of
 		# the raw DBus reply into a list of Event instances
-		self._iface.GetEvents(event_ids,
+		self._read("GetEvents", event_ids,
 				reply_handler=lambda raw: events_reply_handler(
 					map(self._event_type.new_for_struct, raw)),
 				error_handler=self._safe_error_handler(error_handler,
 						events_reply_handler, []))
 	
+	def _get_events_cached(self, event_ids, events_reply_handler,
+		error_handler):
+		"""
+		Implementation of :meth:`get_events` requesting only the events
+		which aren't in the event cache.
+		"""
+		cache = self._event_cache
+		events = {}
+		missing_ids = []
+		for event_id in event_ids:
+			event_id = int(event_id)
+			if event_id in events:
+				continue
+			event = cache.get(event_id)
+			if event is None:
+				missing_ids.append(event_id)
+			events[event_id] = event
+		
+		generation = self._cache_generation
+		def reply_handler(raw):
+			# Events deleted after the request was sent may still be
+			# part of the reply, so only cache them if nothing changed
+			cacheable = self._cache_active and \
+				generation == self._cache_generation
+			for event_id, struct in zip(missing_ids, raw):
+				event = self._event_type.new_for_struct(struct)
+				if event is not None:
+					if cacheable:
+						cache.add(event_id, event)
+					events[event_id] = event
+			events_reply_handler([events[int(event_id)]
+				for event_id in event_ids])
+		
+		if missing_ids:
+			self._read("GetEvents", missing_ids,
+				reply_handler=reply_handler,
+				error_handler=self._safe_error_handler(error_handler,
+					events_reply_handler, []))
+		else:
+			# Keep the reply asynchronous, as callers expect
+			gobject.idle_add(lambda: reply_handler([]) and False)
+	
 	def delete_events(self, event_ids, reply_handler=None, error_handler=None):
 		"""
 		Warning: This API is EXPERIMENTAL and is not fully supported yet.
@@ -815,6 +2510,8 @@ class ZeitgeistClient:
 		# of int, this might change in the future, see docstring of dbus.UInt32
 		self._check_members(event_ids, (int, dbus.UInt32))
 		
+		if self._event_cache is not None:
+			self._event_cache.remove(event_ids)
 		self._iface.DeleteEvents(event_ids,
 					reply_handler=self._safe_reply_handler(reply_handler),
 					error_handler=self._safe_error_handler(error_handler))
@@ -888,7 +2585,8 @@ class ZeitgeistClient:
 		                                  error_handler=error_handler)
 	
 	def install_monitor (self, time_range, event_templates,
-		notify_insert_handler, notify_delete_handler, monitor_path=None):
+		notify_insert_handler, notify_delete_handler, monitor_path=None,
+		coalesce_latency=0, coalesce_max_events=0):
 		"""
 		Install a monitor in the Zeitgeist engine that calls back
 		when events matching *event_templates* are logged. The matching
@@ -925,6 +2623,13 @@ class ZeitgeistClient:
 		    to install the client side monitor object on. If none is provided
 		    the client will provide one for you namespaced under
 		    /org/gnome/zeitgeist/monitor/*
+		:param coalesce_latency: If set, notifications received within
+		    this many milliseconds are merged into a single call of each
+		    handler, see :class:`Monitor`. Useful for monitors which
+		    would otherwise be flooded during bulk imports.
+		:param coalesce_max_events: Maximal number of events to wait
+		    for before passing on coalesced notifications; the default,
+		    0, only waits for *coalesce_latency* to pass
 		:returns: a :class:`Monitor`
 		"""
 		self._check_list_or_tuple(event_templates)
@@ -938,9 +2643,26 @@ class ZeitgeistClient:
 				notify_reply_handler)
 		
 		
+		if self._multiplexer is not None:
+			try:
+				predicate = compile_templates(event_templates)
+			except ValueError:
+				# Templates with storage can only be matched by the
+				# engine, so they need a monitor of their own
+				pass
+			else:
+				mon = Monitor(time_range, event_templates,
+					notify_insert_handler, notify_delete_handler,
+					monitor_path=monitor_path, event_type=self._event_type,
+					coalesce_latency=coalesce_latency,
+					coalesce_max_events=coalesce_max_events, export=False)
+				self._multiplexer.add(mon, predicate)
+				return mon
+		
 		mon = Monitor(time_range, event_templates, notify_insert_handler,
 			notify_delete_handler, monitor_path=monitor_path,
-			event_type=self._event_type)
+			event_type=self._event_type, coalesce_latency=coalesce_latency,
+			coalesce_max_events=coalesce_max_events)
 		self._iface.InstallMonitor(mon.path,
 		                           mon.time_range,
 		                           mon.templates,
@@ -964,10 +2686,19 @@ class ZeitgeistClient:
 			path = dbus.ObjectPath(monitor)
 		elif isinstance(monitor, Monitor):
 			path = monitor.path
+			# Don't lose notifications which are still being coalesced
+			monitor.flush()
 		else:
 			raise TypeError(
 				"Monitor, str, or unicode expected. Found %s" % type(monitor))
 		
+		if self._multiplexer is not None and path in self._multiplexer:
+			self._multiplexer.remove(path).flush()
+			if callable(monitor_removed_handler):
+				gobject.idle_add(
+					lambda: monitor_removed_handler(1) and False)
+			return
+		
 		if callable(monitor_removed_handler):
 			
 			def dispatch_handler (error=None):
@@ -38,11 +38,19 @@ __all__ = [
 	'DataSource',
 	'Event',
 	'Subject',
+	'CompactEvent',
+	'CompactSubject',
+	'EventBatch',
 	'NULL_EVENT',
+	'compile_template',
+	'compile_templates',
+	'filter_events',
 	'NEGATION_OPERATOR',
+	'NOEXPAND_OPERATOR',
 ]
 
 NEGATION_OPERATOR = "!"
+NOEXPAND_OPERATOR = "+"
 WILDCARD = "*"
 
 def EQUAL(x, y):
@@ -78,8 +86,33 @@ def get_name_or_str(obj):
 	except AttributeError:
 		return str(obj)
 
+# NumPy is optional (see EventBatch) and slow to import, so it is only
+# loaded on first use
+numpy = None
+
+def _import_numpy():
+	global numpy
+	if numpy is None:
+		try:
+			import numpy
+		except ImportError:
+			raise ImportError("EventBatch requires NumPy")
+
 _SYMBOLS_BY_URI = {}
 
+# Precomputed closure of the symbol hierarchy, mapping each known URI to
+# a frozenset with the URIs of all its ancestors (or descendants), the
+# URI itself included. Filled in once the symbol relations are resolved.
+_ANCESTOR_URIS = {}
+_DESCENDANT_URIS = {}
+
+# Index of all symbols with a given name, used for attribute lookups
+_SYMBOLS_BY_NAME = {}
+
+# Whether the relations between the symbols have been resolved, see
+# _resolve_symbols()
+_symbols_resolved = False
+
 class Symbol(str):
 
 	def __new__(cls, name, parent=None, uri=None, display_name=None, doc=None, auto_resolve=True):
@@ -89,46 +122,79 @@ class Symbol(str):
 		
 	def __init__(self, name, parent=None, uri=None, display_name=None, doc=None, auto_resolve=True):
 		self._children = dict()
-		self._all_children = None
-		self._parents = parent or set() # will be bootstrapped to a dict at module load time
+		self._children_by_name = dict() # cache for __getattr__
+		self._parents = parent or set() # will be bootstrapped to a dict on first use
 		assert isinstance(self._parents, set), name
 		self._name = name
 		self._uri = uri
 		self._display_name = display_name
 		self._doc = doc
 		_SYMBOLS_BY_URI[uri] = self
+		_SYMBOLS_BY_NAME.setdefault(name, []).append(self)
+		if _symbols_resolved:
+			self._resolve_late()
+	
+	def _resolve_late(self):
+		"""
+		Resolve the relations of a symbol created after those of all
+		others were resolved (see :func:`_resolve_symbols`), ignoring
+		unknown parents.
+		"""
+		parents = {}
+		for parent_uri in self._parents:
+			parent = _SYMBOLS_BY_URI.get(parent_uri)
+			if parent is not None:
+				parents[parent_uri] = parent
+				parent._children[self.uri] = self
+		self._parents = parents
+		_ANCESTOR_URIS.pop(self.uri, None)
+		for ancestor_uri in self._get_ancestor_uris():
+			_DESCENDANT_URIS[ancestor_uri] = \
+				_DESCENDANT_URIS.get(ancestor_uri, frozenset()) | \
+				frozenset([self.uri])
 
 	def __repr__(self):
 		return "<%s '%s'>" %(get_name_or_str(self), self.uri)
 		
 	def __getattr__(self, name):
-		self._ensure_all_children()
+		"""
+		Return the child symbol (at any depth) with the given name. If
+		several children share the name, the closest one is returned;
+		children at the same distance make the name ambiguous.
+		"""
 		try:
-			return self._all_children[name]
+			return self._children_by_name[name]
 		except KeyError:
-			for child in self.iter_all_children():
-				if child == self:
-					continue
-				try:
-					return getattr(child, name)
-				except AttributeError:
-					pass
+			pass
+		_resolve_symbols()
+		descendants = _DESCENDANT_URIS.get(self.uri, ())
+		candidates = [symbol for symbol in _SYMBOLS_BY_NAME.get(name, ())
+			if symbol.uri in descendants and symbol is not self]
+		if not candidates:
 			raise AttributeError("'%s' object has no attribute '%s'" %(self.__class__.__name__, name))
+		if len(candidates) == 1:
+			child = candidates[0]
+		else:
+			child = self._get_closest_child(name, candidates)
+		self._children_by_name[name] = child
+		return child
+	
+	def _get_closest_child(self, name, candidates):
+		level = [self]
+		while level:
+			level = set(child for symbol in level
+				for child in symbol._children.itervalues())
+			found = [symbol for symbol in candidates if symbol in level]
+			if len(found) == 1:
+				return found[0]
+			if found:
+				raise AttributeError("'%s' is ambiguous in %r, it may refer to: %s" \
+					%(name, self, ", ".join(sorted(symbol.uri for symbol in found))))
+		raise AttributeError("'%s' object has no attribute '%s'" %(self.__class__.__name__, name))
 	
 	def __getitem__ (self, uri):
 		return _SYMBOLS_BY_URI[uri]
 
-	def _ensure_all_children (self):
-		if self._all_children is not None : return
-		self._all_children = dict()
-		for child in self._children.itervalues():
-			child._visit(self._all_children)
-	
-	def _visit (self, dikt):
-		dikt[self.name] = self
-		for child in self._children.itervalues():
-			child._visit(dikt) 
-	
 	@staticmethod
 	def find_child_uris_extended (uri):
 		"""
@@ -137,13 +203,29 @@ class Symbol(str):
 		is unknown a list containing only `uri` is returned.
 		"""
 		try:
-			symbol = _SYMBOLS_BY_URI[uri]
-			children = list(symbol.get_all_children())
-			children.append(uri)
-			return children
+			return list(_DESCENDANT_URIS[uri])
 		except KeyError, e:
+			if not _symbols_resolved:
+				_resolve_symbols()
+				return Symbol.find_child_uris_extended(uri)
 			return [uri]
-		
+	
+	def _get_ancestor_uris(self):
+		"""
+		Return a frozenset with the URIs of all ancestors of this
+		symbol, including its own URI.
+		"""
+		try:
+			return _ANCESTOR_URIS[self.uri]
+		except KeyError:
+			_resolve_symbols()
+		ancestors = set([self.uri])
+		for parent in self._parents.itervalues():
+			ancestors.update(parent._get_ancestor_uris())
+		ancestors = frozenset(ancestors)
+		_ANCESTOR_URIS[self.uri] = ancestors
+		return ancestors
+	
 
 	@property
 	def uri(self):
@@ -159,8 +241,7 @@ class Symbol(str):
 	__name__ = name
 	
 	def __dir__(self):
-		self._ensure_all_children()
-		return self._all_children.keys()
+		return list(set(child.name for child in self.iter_all_children()))
 
 	@property
 	def doc(self):
@@ -174,6 +255,7 @@ class Symbol(str):
 		"""
 		Returns a list of immediate child symbols
 		"""
+		_resolve_symbols()
 		return frozenset(self._children.itervalues())
 		
 	def iter_all_children(self):
@@ -181,8 +263,9 @@ class Symbol(str):
 		Returns a generator that recursively iterates over all children
 		of this symbol
 		"""
-		self._ensure_all_children()
-		return self._all_children.itervalues()
+		_resolve_symbols()
+		return (_SYMBOLS_BY_URI[uri]
+			for uri in _DESCENDANT_URIS.get(self.uri, ()) if uri != self.uri)
 		
 	def get_all_children(self):
 		"""
@@ -194,27 +277,16 @@ class Symbol(str):
 		"""
 		Returns a list of immediate parent symbols
 		"""
+		_resolve_symbols()
 		return frozenset(self._parents.itervalues())
 	
 	def is_child_of (self, parent):
 		"""
 		Returns True if this symbol is a child of `parent`.
 		"""
-		if not isinstance (parent, Symbol):
-			try:
-				parent = _SYMBOLS_BY_URI[parent]
-			except KeyError, e:
-				# Parent is not a known URI
-				return self.uri == parent
-		
-		# Invariant: parent is a Symbol
-		if self.uri == parent.uri : return True
-		
-		parent._ensure_all_children()
-		
-		# FIXME: We should really check that child.uri is in there,
-		#        but that is not fast with the current code layout
-		return self.name in parent._all_children
+		# A Symbol compares equal to its URI, and unknown parent URIs
+		# can only match the URI of this symbol itself
+		return parent in self._get_ancestor_uris()
 	
 	@staticmethod
 	def uri_is_child_of (child, parent):
@@ -225,20 +297,21 @@ class Symbol(str):
 		"""
 		if isinstance (child, basestring):
 			try:
-				child = _SYMBOLS_BY_URI[child]
+				return parent in _ANCESTOR_URIS[child]
 			except KeyError, e:
+				if not _symbols_resolved:
+					_resolve_symbols()
+					return Symbol.uri_is_child_of(child, parent)
+				if isinstance (child, Symbol):
+					# Symbol created after the ontology was loaded
+					return child.is_child_of(parent)
 				# Child is not a know URI
-				if isinstance (parent, basestring):
-					return child == parent
-				elif isinstance (parent, Symbol):
-					return child == parent.uri
-				else:
-					return False
-		
-		if not isinstance (child, Symbol):
-			raise ValueError("Child argument must be a Symbol or string. Got %s" % type(child))
+				return isinstance (parent, basestring) and child == parent
+			except TypeError, e:
+				# Parent is not hashable, so it can't be a URI
+				return False
 		
-		return child.is_child_of(parent)
+		raise ValueError("Child argument must be a Symbol or string. Got %s" % type(child))
 		
 class TimeRange(list):
 	"""
@@ -514,7 +587,8 @@ class Subject(list):
 		Return True if this Subject matches *subject_template*. Empty
 		fields in the template are treated as wildcards.
 		Interpretations and manifestations are also matched if they are
-		children of the types specified in `subject_template`. 
+		children of the types specified in `subject_template`, unless
+		those are prefixed with :const:`NOEXPAND_OPERATOR`.
 		
 		See also :meth:`Event.matches_template`
 		"""
@@ -545,6 +619,10 @@ class Subject(list):
 				and expression.endswith(WILDCARD):
 			assert comp == EQUAL, "wildcards only work for pure text fields"
 			return self._check_field_match(field_id, expression[:-len(WILDCARD)], STARTSWITH)
+		elif comp == Symbol.uri_is_child_of \
+				and expression.startswith(NOEXPAND_OPERATOR):
+			# Only the symbol itself, not its children
+			return self._check_field_match(field_id, expression[len(NOEXPAND_OPERATOR):], EQUAL)
 		else:
 			return comp(self[field_id], expression)
 
@@ -821,7 +899,8 @@ class Event(list):
 		matching is done where unset fields in the template is
 		interpreted as wild cards. Interpretations and manifestations
 		are also matched if they are children of the types specified
-		in `event_template`. If the template has more than one
+		in `event_template`, unless those are prefixed with
+		:const:`NOEXPAND_OPERATOR`. If the template has more than one
 		subject, this event matches if at least one of the subjects
 		on this event matches any single one of the subjects on the
 		template.
@@ -869,6 +948,10 @@ class Event(list):
 				and expression.endswith(WILDCARD):
 			assert comp == EQUAL, "wildcards only work for pure text fields"
 			return self._check_field_match(field_id, expression[:-len(WILDCARD)], STARTSWITH)
+		elif comp == Symbol.uri_is_child_of \
+				and expression.startswith(NOEXPAND_OPERATOR):
+			# Only the symbol itself, not its children
+			return self._check_field_match(field_id, expression[len(NOEXPAND_OPERATOR):], EQUAL)
 		else:
 			return comp(self[0][field_id], expression)
 	
@@ -886,6 +969,823 @@ class Event(list):
 		t = int(self.timestamp) # The timestamp may be stored as a string
 		return (t >= time_range.begin) and (t <= time_range.end)
 
+def _compact_string(value):
+	"""
+	Return `value` as a plain string, dropping any D-Bus wrapper type
+	and preferring str over unicode whenever the value is ASCII-only.
+	"""
+	if type(value) is str:
+		return value
+	try:
+		return str(value)
+	except UnicodeEncodeError:
+		return unicode(value)
+
+def _compact_payload(payload):
+	"""Return the given payload (string or array of bytes) as a str"""
+	if not payload:
+		return ""
+	if isinstance(payload, unicode):
+		return payload.encode("UTF-8")
+	if isinstance(payload, str):
+		return str(payload)
+	return str(bytearray(payload))
+
+_INTERNED_SYMBOLS = {}
+
+def _intern_symbol(value):
+	"""
+	Return a shared instance of `value`. Only use this for fields with a
+	bounded set of values (interpretations, manifestations, actors, etc.).
+	"""
+	value = _compact_string(value)
+	return _INTERNED_SYMBOLS.setdefault(value, value)
+
+def _compact_accessors(field, doc, converter=None):
+	"""
+	Build the getter, setter and property for a field of a class storing
+	its values in the `_data` tuple.
+	"""
+	def getter(self):
+		return self._data[field]
+	def setter(self, value):
+		if converter is not None:
+			value = converter(value)
+		data = list(self._data)
+		data[field] = value
+		self._data = tuple(data)
+	return getter, setter, property(getter, setter, doc=doc)
+
+class CompactSubject(object):
+	"""
+	Memory efficient alternative to :class:`Subject`. Instead of a list,
+	all fields are kept in a single tuple, which is shared between all
+	identical subjects created through :meth:`CompactEvent.new_for_structs`.
+	
+	The accessors and :meth:`matches_template` behave as the ones in
+	:class:`Subject`; use :meth:`to_list` to obtain the D-Bus representation.
+	"""
+	__slots__ = ("_data",)
+	
+	Fields = Subject.Fields
+	SUPPORTS_NEGATION = Subject.SUPPORTS_NEGATION
+	SUPPORTS_WILDCARDS = Subject.SUPPORTS_WILDCARDS
+	
+	# Fields with a bounded set of values, which are interned
+	_SYMBOL_FIELDS = (Subject.Interpretation, Subject.Manifestation,
+		Subject.Mimetype, Subject.Storage)
+	_EMPTY_DATA = ("",) * len(Subject.Fields)
+	
+	def __init__(self, data=None):
+		if data:
+			self._data = self._make_data(data)
+		else:
+			self._data = self._EMPTY_DATA
+	
+	@classmethod
+	def _make_data(cls, data):
+		data = map(_compact_string, data)
+		if len(data) == len(Subject.Fields) - 2:
+			# current_uri has been added in Zeitgeist 0.8.0
+			data.append("")
+		if len(data) == len(Subject.Fields) - 1:
+			# current_origin has been added in Zeitgeist 1.0 Beta 1
+			data.append("")
+		if len(data) < len(Subject.Fields):
+			raise ValueError(
+				"Invalid subject data length %s, expected %s" \
+				%(len(data), len(Subject.Fields)))
+		for field in cls._SYMBOL_FIELDS:
+			data[field] = _intern_symbol(data[field])
+		return tuple(data)
+	
+	@classmethod
+	def _new_shared(cls, data, pool):
+		"""
+		Create a new instance, reusing the data tuple of any identical
+		subject found in `pool`.
+		"""
+		self = cls.__new__(cls)
+		data = cls._make_data(data)
+		self._data = pool.setdefault(data, data)
+		return self
+	
+	@staticmethod
+	def new_for_values(**values):
+		"""
+		Create a new CompactSubject. See :meth:`Subject.new_for_values`.
+		"""
+		return CompactSubject(Subject.new_for_values(**values))
+	
+	def __repr__(self):
+		return "%s(%r)" %(self.__class__.__name__, list(self._data))
+	
+	def __getitem__(self, field):
+		return self._data[field]
+	
+	def __len__(self):
+		return len(self._data)
+	
+	def __iter__(self):
+		return iter(self._data)
+	
+	__eq__ = Subject.__dict__["__eq__"]
+	
+	def __ne__(self, other):
+		return not self == other
+	
+	def to_list(self):
+		"""
+		Return the subject as a list of strings, as used in the D-Bus
+		representation of events.
+		"""
+		return list(self._data)
+	
+	get_uri, set_uri, uri = _compact_accessors(Subject.Uri,
+		Subject.uri.__doc__)
+	get_current_uri, set_current_uri, current_uri = _compact_accessors(
+		Subject.CurrentUri, Subject.current_uri.__doc__)
+	get_interpretation, set_interpretation, interpretation = \
+		_compact_accessors(Subject.Interpretation,
+		Subject.interpretation.__doc__, _intern_symbol)
+	get_manifestation, set_manifestation, manifestation = \
+		_compact_accessors(Subject.Manifestation,
+		Subject.manifestation.__doc__, _intern_symbol)
+	get_origin, set_origin, origin = _compact_accessors(Subject.Origin,
+		Subject.origin.__doc__)
+	get_current_origin, set_current_origin, current_origin = \
+		_compact_accessors(Subject.CurrentOrigin,
+		Subject.current_origin.__doc__)
+	get_mimetype, set_mimetype, mimetype = _compact_accessors(
+		Subject.Mimetype, Subject.mimetype.__doc__, _intern_symbol)
+	get_text, set_text, text = _compact_accessors(Subject.Text,
+		Subject.text.__doc__)
+	get_storage, set_storage, storage = _compact_accessors(Subject.Storage,
+		Subject.storage.__doc__, _intern_symbol)
+	
+	matches_template = Subject.__dict__["matches_template"]
+	_check_field_match = Subject.__dict__["_check_field_match"]
+
+class CompactEvent(object):
+	"""
+	Memory efficient alternative to :class:`Event`, meant for clients
+	holding large amounts of events at once.
+	
+	Instances use `__slots__` and keep the event metadata in a tuple, with
+	the id and timestamp stored as integers and with interpretations,
+	manifestations and actors interned. Subjects are
+	:class:`CompactSubject` instances.
+	
+	The accessors and :meth:`matches_template` behave as the ones in
+	:class:`Event`, except that :attr:`timestamp` is an integer. Instances
+	can't be passed over D-Bus directly; use :meth:`to_struct` or
+	:meth:`to_event` for that.
+	"""
+	__slots__ = ("_data", "_subjects", "_payload")
+	
+	Fields = Event.Fields
+	SUPPORTS_NEGATION = Event.SUPPORTS_NEGATION
+	SUPPORTS_WILDCARDS = Event.SUPPORTS_WILDCARDS
+	
+	_subject_type = CompactSubject
+	
+	def __init__(self, struct=None):
+		"""
+		If 'struct' is set it must be an :class:`Event`, or a list with
+		the same layout as described in :meth:`Event.__init__`.
+		"""
+		self._load(struct, {})
+	
+	def _load(self, struct, subject_pool):
+		if struct:
+			if not 1 <= len(struct) <= 3:
+				raise ValueError("Invalid struct length %s" % len(struct))
+			self._data = self._make_data(struct[0])
+			if len(struct) > 1:
+				self._subjects = tuple(self._subject_type._new_shared(
+					subject, subject_pool) for subject in struct[1])
+			else:
+				self._subjects = ()
+			if len(struct) > 2:
+				self._payload = _compact_payload(struct[2])
+			else:
+				self._payload = ""
+		else:
+			self._data = (0, get_timestamp_for_now(), "", "", "", "")
+			self._subjects = ()
+			self._payload = ""
+	
+	@classmethod
+	def _make_data(cls, event_data):
+		if len(event_data) == len(cls.Fields) - 1:
+			# Old versions of Zeitgeist didn't have the event origin field.
+			event_data = list(event_data) + [""]
+		if len(event_data) < len(cls.Fields):
+			raise ValueError("event_data must have %s members, found %s" % \
+				(len(cls.Fields), len(event_data)))
+		event_id = event_data[Event.Id]
+		timestamp = event_data[Event.Timestamp]
+		return (
+			int(event_id) if event_id else 0,
+			int(timestamp) if timestamp else get_timestamp_for_now(),
+			_intern_symbol(event_data[Event.Interpretation]),
+			_intern_symbol(event_data[Event.Manifestation]),
+			_intern_symbol(event_data[Event.Actor]),
+			_compact_string(event_data[Event.Origin] or ""))
+	
+	@classmethod
+	def new_for_struct(cls, struct):
+		"""Returns a new CompactEvent or None if `struct` is a `NULL_EVENT`"""
+		if struct == NULL_EVENT:
+			return None
+		return cls(struct)
+	
+	@classmethod
+	def new_for_structs(cls, structs):
+		"""
+		Returns a list of CompactEvents (or None for each `NULL_EVENT`) for
+		the given D-Bus structs, or :class:`Event` instances.
+		
+		Identical subjects found in different events will share the
+		same data.
+		"""
+		subject_pool = {}
+		events = []
+		for struct in structs:
+			if struct == NULL_EVENT:
+				events.append(None)
+				continue
+			event = cls.__new__(cls)
+			event._load(struct, subject_pool)
+			events.append(event)
+		return events
+	
+	@classmethod
+	def from_event(cls, event):
+		"""Create a new CompactEvent with the data of the given Event"""
+		return cls(event)
+	
+	new_for_values = classmethod(Event.__dict__["new_for_values"].__func__)
+	_dict_contains_subject_keys = Event.__dict__["_dict_contains_subject_keys"]
+	
+	def to_struct(self):
+		"""
+		Return the event in the struct layout used by :class:`Event` and
+		the D-Bus API.
+		"""
+		data = [str(field) for field in self._data[:Event.Interpretation]]
+		if data[Event.Id] == "0":
+			data[Event.Id] = ""
+		data.extend(self._data[Event.Interpretation:])
+		return (data, [subject.to_list() for subject in self._subjects],
+			self._payload)
+	
+	def to_event(self, event_type=Event):
+		"""Return a new :class:`Event` with the data of this event"""
+		return event_type(self.to_struct())
+	
+	def __repr__(self):
+		return "%s(%r)" %(self.__class__.__name__, self.to_struct())
+	
+	def __getitem__(self, index):
+		return (self._data, self._subjects, self._payload)[index]
+	
+	def __len__(self):
+		return 3
+	
+	def __eq__(self, other):
+		if not isinstance(other, CompactEvent):
+			return NotImplemented
+		return self._data == other._data and \
+			self._payload == other._payload and \
+			list(self._subjects) == list(other._subjects)
+	
+	def __ne__(self, other):
+		result = self.__eq__(other)
+		if result is NotImplemented:
+			return result
+		return not result
+	
+	def append_subject(self, subject=None):
+		"""
+		Append a new empty subject and return a reference to it
+		"""
+		if not subject:
+			subject = self._subject_type()
+		elif not isinstance(subject, CompactSubject):
+			subject = self._subject_type(subject)
+		self._subjects += (subject,)
+		return subject
+	
+	def get_subjects(self):
+		return self._subjects
+	
+	def set_subjects(self, subjects):
+		self._subjects = tuple(subject
+			if isinstance(subject, CompactSubject)
+			else self._subject_type(subject) for subject in subjects)
+	subjects = property(get_subjects, set_subjects,
+	doc="Read/write property with a tuple of :class:`CompactSubjects <CompactSubject>`")
+	
+	def get_id(self):
+		return self._data[Event.Id]
+	id = property(get_id,
+	doc="Read only property containing the the event id if the event has one")
+	
+	get_timestamp, set_timestamp, timestamp = _compact_accessors(
+		Event.Timestamp, "Read/write property with the event timestamp, "
+		"as an integer, defined as milliseconds since the Epoch", int)
+	get_interpretation, set_interpretation, interpretation = \
+		_compact_accessors(Event.Interpretation, Event.interpretation.__doc__,
+		_intern_symbol)
+	get_manifestation, set_manifestation, manifestation = \
+		_compact_accessors(Event.Manifestation, Event.manifestation.__doc__,
+		_intern_symbol)
+	get_actor, set_actor, actor = _compact_accessors(Event.Actor,
+		Event.actor.__doc__, _intern_symbol)
+	get_origin, set_origin, origin = _compact_accessors(Event.Origin,
+		Event.origin.__doc__, _compact_string)
+	
+	def get_payload(self):
+		return self._payload
+	
+	def set_payload(self, value):
+		self._payload = _compact_payload(value)
+	payload = property(get_payload, set_payload,
+	doc="Free form attachment for the event, as a string of bytes")
+	
+	matches_template = Event.__dict__["matches_template"]
+	matches_event = Event.__dict__["matches_event"]
+	
+	def _check_field_match(self, field_id, expression, comp):
+		if field_id == Event.Id and not \
+				expression.startswith(NEGATION_OPERATOR):
+			# The id is stored as an integer
+			return comp(str(self._data[Event.Id]), expression)
+		return Event._check_field_match.__func__(self, field_id,
+			expression, comp)
+	
+	def in_time_range(self, time_range):
+		"""
+		Check if the event timestamp lies within a :class:`TimeRange`
+		"""
+		t = self._data[Event.Timestamp]
+		return (t >= time_range.begin) and (t <= time_range.end)
+
+def _compile_field_check(field_id, expression, supports_negation,
+	supports_wildcards, symbol_field):
+	"""
+	Parse the operators in a template field once and return a function
+	testing the field `field_id` of an event or subject data sequence.
+	"""
+	negated = False
+	while field_id in supports_negation \
+			and expression.startswith(NEGATION_OPERATOR):
+		negated = not negated
+		expression = expression[len(NEGATION_OPERATOR):]
+	
+	if field_id in supports_wildcards and expression.endswith(WILDCARD):
+		prefix = expression[:-len(WILDCARD)]
+		if negated:
+			return lambda data: not data[field_id].startswith(prefix)
+		return lambda data: data[field_id].startswith(prefix)
+	
+	if symbol_field:
+		if expression.startswith(NOEXPAND_OPERATOR):
+			# Matching only the URI itself
+			uris = frozenset([expression[len(NOEXPAND_OPERATOR):]])
+		else:
+			# Matching the URI or any of its children, see
+			# Symbol.uri_is_child_of
+			_resolve_symbols()
+			uris = _DESCENDANT_URIS.get(expression) or \
+				frozenset([expression])
+		if negated:
+			return lambda data: data[field_id] not in uris
+		return lambda data: data[field_id] in uris
+	
+	if negated:
+		return lambda data: data[field_id] != expression
+	return lambda data: data[field_id] == expression
+
+def _compile_subject_template(subject_template):
+	checks = []
+	for field_id in Subject.Fields:
+		expression = subject_template[field_id]
+		if not expression:
+			# empty fields are handled as wildcards
+			continue
+		if field_id == Subject.Storage:
+			# we do not support searching by storage field for now
+			# see LP: #580364
+			raise ValueError("zeitgeist does not support searching by 'storage' field")
+		checks.append(_compile_field_check(field_id, expression,
+			Subject.SUPPORTS_NEGATION, Subject.SUPPORTS_WILDCARDS,
+			field_id in (Subject.Interpretation, Subject.Manifestation)))
+	checks = tuple(checks)
+	
+	def matches(subject):
+		for check in checks:
+			if not check(subject):
+				return False
+		return True
+	return matches
+
+def compile_template(event_template):
+	"""
+	Return a function taking an event and returning True if it matches
+	`event_template`, following the same rules as
+	:meth:`Event.matches_template`.
+	
+	Operators and symbol hierarchies are resolved only once, so this is
+	much faster than :meth:`Event.matches_template` when the same
+	template is tested against many events. Both :class:`Event` and
+	:class:`CompactEvent` instances are supported.
+	
+	Unlike :meth:`Event.matches_template`, a ValueError is raised right
+	away if the template contains subjects with an unsupported field.
+	"""
+	checks = []
+	data = event_template[0]
+	for field_id in Event.Fields:
+		expression = data[field_id]
+		if field_id == Event.Timestamp or not expression:
+			# matching by timestamp is not supported and
+			# empty template-fields are treated as wildcards
+			continue
+		if field_id == Event.Id:
+			# CompactEvent stores the id as an integer
+			event_id = str(expression)
+			checks.append(lambda data: str(data[Event.Id]) == event_id)
+			continue
+		checks.append(_compile_field_check(field_id, expression,
+			Event.SUPPORTS_NEGATION, Event.SUPPORTS_WILDCARDS,
+			field_id in (Event.Interpretation, Event.Manifestation)))
+	checks = tuple(checks)
+	subject_checks = tuple(_compile_subject_template(subject_template)
+		for subject_template in event_template[1])
+	
+	def matches(event):
+		data = event[0]
+		for check in checks:
+			if not check(data):
+				return False
+		
+		# If template has no subjects we have a match
+		if not subject_checks:
+			return True
+		
+		# Otherwise at least one subject has to match any of the
+		# subject templates
+		for subject in event[1]:
+			for subject_check in subject_checks:
+				if subject_check(subject):
+					return True
+		return False
+	return matches
+
+def compile_templates(event_templates):
+	"""
+	Return a function taking an event and returning True if it matches
+	any of the given templates. As with the Zeitgeist engine, an empty
+	list of templates matches all events.
+	
+	See :func:`compile_template`.
+	"""
+	predicates = tuple(compile_template(template)
+		for template in event_templates)
+	if not predicates:
+		return lambda event: True
+	if len(predicates) == 1:
+		return predicates[0]
+	
+	def matches(event):
+		for predicate in predicates:
+			if predicate(event):
+				return True
+		return False
+	return matches
+
+def filter_events(events, event_templates):
+	"""
+	Return a list with the events matching any of the given templates,
+	in their original order. Items which are None (as returned for
+	unknown event ids) are skipped.
+	
+	`event_templates` may also be a predicate as returned by
+	:func:`compile_templates`, to avoid compiling the same templates
+	for each batch.
+	"""
+	if callable(event_templates):
+		predicate = event_templates
+	else:
+		predicate = compile_templates(event_templates)
+	return [event for event in events
+		if event is not None and predicate(event)]
+
+class EventBatch(object):
+	"""
+	Columnar, NumPy backed, representation of a set of events, meant for
+	bulk analysis of large result sets without building a Python object
+	for each event.
+	
+	Event ids and timestamps are kept in integer arrays. All other
+	fields are dictionary encoded: each column is an array of integer
+	codes indexing the list of distinct values found in the column.
+	Event columns have one entry per event, while subject columns have
+	one entry per subject, with :attr:`subject_events` giving the index
+	of the event each subject belongs to.
+	
+	Columns are named after the :class:`Event` properties
+	(`interpretation`, `manifestation`, `actor`, `origin` and `payload`)
+	and the :class:`Subject` properties prefixed by `subject_` (as in
+	:meth:`Event.new_for_values`).
+	
+	Masks are boolean arrays with one entry per event, which can be
+	combined using NumPy operators and passed to :meth:`filter`.
+	
+	This class is only available if NumPy is installed.
+	"""
+	
+	EVENT_COLUMNS = ("interpretation", "manifestation", "actor", "origin",
+		"payload")
+	SUBJECT_COLUMNS = ("subject_uri", "subject_interpretation",
+		"subject_manifestation", "subject_origin", "subject_mimetype",
+		"subject_text", "subject_storage", "subject_current_uri",
+		"subject_current_origin")
+	
+	# Event field of each event column (except for the payload)
+	_EVENT_FIELDS = {
+		"interpretation": Event.Interpretation,
+		"manifestation": Event.Manifestation,
+		"actor": Event.Actor,
+		"origin": Event.Origin,
+	}
+	
+	def __init__(self, events=None):
+		"""
+		Create a new batch with the given :class:`Event`,
+		:class:`CompactEvent` instances or event structs, as returned
+		over D-Bus. None items (as returned for unknown event ids) are
+		skipped.
+		"""
+		_import_numpy()
+		event_rows = []
+		subject_rows = []
+		subject_events = []
+		num_subject_fields = len(self.SUBJECT_COLUMNS)
+		for event in events or ():
+			if event is None or not event[0]:
+				# Unknown event, see NULL_EVENT
+				continue
+			data = event[0]
+			event_index = len(event_rows)
+			event_rows.append((int(data[Event.Id] or 0),
+				int(data[Event.Timestamp]), data[Event.Interpretation],
+				data[Event.Manifestation], data[Event.Actor],
+				data[Event.Origin] or "",
+				_compact_payload(event[2]) if len(event) > 2 else ""))
+			for subject in event[1]:
+				subject_events.append(event_index)
+				if len(subject) < num_subject_fields:
+					# Old subjects don't have the current_uri and
+					# current_origin fields
+					subject = list(subject) + \
+						[""] * (num_subject_fields - len(subject))
+				subject_rows.append(subject)
+		
+		event_columns = zip(*event_rows) or [()] * 7
+		subject_columns = zip(*subject_rows) or [()] * num_subject_fields
+		self._ids = numpy.array(event_columns[0], dtype=numpy.uint32)
+		self._timestamps = numpy.array(event_columns[1], dtype=numpy.int64)
+		self._subject_events = numpy.array(subject_events,
+			dtype=numpy.int32)
+		self._codes = {}
+		self._values = {}
+		for column, values in zip(self.EVENT_COLUMNS, event_columns[2:]) + \
+				zip(self.SUBJECT_COLUMNS, subject_columns):
+			self._codes[column], self._values[column] = \
+				self._encode_column(values)
+	
+	@staticmethod
+	def _encode_column(values):
+		"""
+		Return an array of codes and the list of distinct values for
+		the given column values
+		"""
+		vocabulary = {}
+		setdefault = vocabulary.setdefault
+		codes = numpy.array([setdefault(value, len(vocabulary))
+			for value in values], dtype=numpy.int32)
+		distinct = [None] * len(vocabulary)
+		for value, code in vocabulary.iteritems():
+			distinct[code] = _compact_string(value)
+		return codes, distinct
+	
+	@classmethod
+	def _new_for_arrays(cls, ids, timestamps, subject_events, codes, values):
+		self = cls.__new__(cls)
+		self._ids = ids
+		self._timestamps = timestamps
+		self._subject_events = subject_events
+		self._codes = codes
+		self._values = values
+		return self
+	
+	def __len__(self):
+		return len(self._ids)
+	
+	def __repr__(self):
+		return "<%s with %d events and %d subjects>" % (
+			self.__class__.__name__, len(self), len(self._subject_events))
+	
+	@property
+	def ids(self):
+		"""Array with the id of each event (0 if it hasn't one)"""
+		return self._ids
+	
+	@property
+	def timestamps(self):
+		"""Array with the timestamp of each event"""
+		return self._timestamps
+	
+	@property
+	def subject_events(self):
+		"""Array with the index of the event of each subject"""
+		return self._subject_events
+	
+	def get_column(self, column):
+		"""
+		Return a tuple with the array of codes and the list of distinct
+		values of the given column
+		"""
+		return self._codes[column], self._values[column]
+	
+	def get_values(self, column):
+		"""
+		Return a list with the value of the given column for each event
+		(or subject, for subject columns)
+		"""
+		codes, values = self.get_column(column)
+		return [values[code] for code in codes]
+	
+	def time_range_mask(self, time_range):
+		"""
+		Return a mask selecting the events within the given
+		:class:`TimeRange`
+		"""
+		return (self._timestamps >= time_range.begin) & \
+			(self._timestamps <= time_range.end)
+	
+	def _match_column(self, column, field_id, expression, supports_negation,
+		supports_wildcards, symbol_field):
+		"""
+		Return a mask over the entries of a column, by evaluating the
+		template expression only once for each distinct value.
+		"""
+		check = _compile_field_check(field_id, expression,
+			supports_negation, supports_wildcards, symbol_field)
+		data = [None] * (field_id + 1)
+		matches = []
+		for value in self._values[column]:
+			data[field_id] = value
+			matches.append(check(data))
+		return numpy.array(matches, dtype=bool)[self._codes[column]]
+	
+	def _template_mask(self, event_template):
+		mask = numpy.ones(len(self), dtype=bool)
+		data = event_template[0]
+		if data[Event.Id]:
+			mask &= self._ids == int(data[Event.Id])
+		for column, field_id in self._EVENT_FIELDS.iteritems():
+			if data[field_id]:
+				mask &= self._match_column(column, field_id, data[field_id],
+					Event.SUPPORTS_NEGATION, Event.SUPPORTS_WILDCARDS,
+					field_id in (Event.Interpretation, Event.Manifestation))
+		
+		# If template has no subjects we have a match
+		if not event_template[1]:
+			return mask
+		
+		subjects_mask = numpy.zeros(len(self._subject_events), dtype=bool)
+		for subject_template in event_template[1]:
+			subject_mask = numpy.ones(len(self._subject_events), dtype=bool)
+			for field_id, column in enumerate(self.SUBJECT_COLUMNS):
+				if not subject_template[field_id]:
+					continue
+				if field_id == Subject.Storage:
+					# we do not support searching by storage field for now
+					# see LP: #580364
+					raise ValueError("zeitgeist does not support searching by 'storage' field")
+				subject_mask &= self._match_column(column, field_id,
+					subject_template[field_id], Subject.SUPPORTS_NEGATION,
+					Subject.SUPPORTS_WILDCARDS,
+					field_id in (Subject.Interpretation, Subject.Manifestation))
+			subjects_mask |= subject_mask
+		
+		# Events match if any of their subjects matches
+		mask &= numpy.bincount(self._subject_events[subjects_mask],
+			minlength=len(self)).astype(bool)
+		return mask
+	
+	def template_mask(self, event_templates):
+		"""
+		Return a mask selecting the events matching any of the given
+		templates, following the same rules as
+		:meth:`Event.matches_template`. An empty list of templates
+		matches all events.
+		"""
+		if not event_templates:
+			return numpy.ones(len(self), dtype=bool)
+		mask = numpy.zeros(len(self), dtype=bool)
+		for event_template in event_templates:
+			mask |= self._template_mask(event_template)
+		return mask
+	
+	def filter(self, mask):
+		"""
+		Return a new EventBatch with the events selected by `mask`.
+		The new batch shares the lists of distinct values with this one.
+		"""
+		mask = numpy.asarray(mask, dtype=bool)
+		subject_mask = mask[self._subject_events]
+		# New index of each selected event
+		new_indices = numpy.cumsum(mask, dtype=numpy.int32) - 1
+		codes = {}
+		for column in self.EVENT_COLUMNS:
+			codes[column] = self._codes[column][mask]
+		for column in self.SUBJECT_COLUMNS:
+			codes[column] = self._codes[column][subject_mask]
+		return self._new_for_arrays(self._ids[mask],
+			self._timestamps[mask],
+			new_indices[self._subject_events[subject_mask]],
+			codes, self._values)
+	
+	def count_by(self, column, mask=None):
+		"""
+		Return a dictionary mapping each value of `column` to the number
+		of events (or subjects, for subject columns) with that value.
+		If `mask` is given only the events it selects are counted.
+		"""
+		codes = self._codes[column]
+		if mask is not None:
+			mask = numpy.asarray(mask, dtype=bool)
+			if column in self.SUBJECT_COLUMNS:
+				mask = mask[self._subject_events]
+			codes = codes[mask]
+		values = self._values[column]
+		counts = numpy.bincount(codes, minlength=len(values))
+		return dict((values[code], int(counts[code]))
+			for code in numpy.flatnonzero(counts))
+	
+	def _get_event(self, index, subject_start, subject_end, event_type):
+		event_data = [""] * len(Event.Fields)
+		if self._ids[index]:
+			event_data[Event.Id] = str(self._ids[index])
+		event_data[Event.Timestamp] = str(self._timestamps[index])
+		for column, field_id in self._EVENT_FIELDS.iteritems():
+			event_data[field_id] = \
+				self._values[column][self._codes[column][index]]
+		subject_columns = [(self._codes[column], self._values[column])
+			for column in self.SUBJECT_COLUMNS]
+		subjects = [[values[codes[row]] for codes, values in subject_columns]
+			for row in xrange(subject_start, subject_end)]
+		payload = self._values["payload"][self._codes["payload"][index]]
+		return event_type((event_data, subjects, payload))
+	
+	def _get_subject_bounds(self):
+		counts = numpy.bincount(self._subject_events, minlength=len(self))
+		bounds = numpy.zeros(len(self) + 1, dtype=numpy.int64)
+		numpy.cumsum(counts, out=bounds[1:])
+		return bounds
+	
+	def __getitem__(self, index):
+		"""Return the event at the given index as an :class:`Event`"""
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("EventBatch index out of range")
+		start, end = numpy.searchsorted(self._subject_events,
+			(index, index + 1))
+		return self._get_event(index, start, end, Event)
+	
+	def iter_events(self, event_type=Event):
+		"""
+		Return a generator building an `event_type` instance
+		(:class:`Event` by default) for each event
+		"""
+		bounds = self._get_subject_bounds()
+		for index in xrange(len(self)):
+			yield self._get_event(index, bounds[index], bounds[index + 1],
+				event_type)
+	
+	def to_events(self, event_type=Event):
+		"""
+		Return a list with an `event_type` instance (:class:`Event` by
+		default) for each event
+		"""
+		return list(self.iter_events(event_type))
+
 class DataSource(list):
 	""" Optimized and convenient data structure representing a datasource.
 	
@@ -1167,41 +2067,67 @@ Manifestation = Symbol("Manifestation", doc=MANIFESTATION_DOC)
 _SYMBOLS_BY_URI["Interpretation"] = Interpretation
 _SYMBOLS_BY_URI["Manifestation"] = Manifestation
 
-# Load the ontology definitions
-ontology_file = os.path.join(os.path.dirname(__file__), "_ontology.py")
+# Load the ontology definitions. Relations between symbols are only
+# resolved on first use, see _resolve_symbols().
 try:
-	execfile(ontology_file)
-except IOError:
+	from _ontology import SYMBOLS as _ONTOLOGY_SYMBOLS
+except ImportError:
 	raise ImportError("Unable to load Zeitgeist ontology. Did you run `make`?")
 
-#
-# Bootstrap the symbol relations. We use a 2-pass strategy:
-#
-# 1) Make sure that all parents and children are registered on each symbol
-for symbol in _SYMBOLS_BY_URI.itervalues():
-	for parent in symbol._parents:
-		try:
-			_SYMBOLS_BY_URI[parent]._children[symbol.uri] = None
-		except KeyError, e:
-			print "ERROR", e, parent, symbol.uri
-			pass
-	for child in symbol._children:
-		try:
-			_SYMBOLS_BY_URI[child]._parents.add(symbol.uri)
-		except KeyError:
-			print "ERROR", e, child, symbol.uri
-			pass
-
-# 2) Resolve all child and parent URIs to their actual Symbol instances
-for symbol in _SYMBOLS_BY_URI.itervalues():
-	for child_uri in symbol._children.iterkeys():
-		symbol._children[child_uri] = _SYMBOLS_BY_URI[child_uri]
-	
-	parents = {}
-	for parent_uri in symbol._parents:
-		parents[parent_uri] = _SYMBOLS_BY_URI[parent_uri]
-	symbol._parents = parents
+for name, uri, display_name, doc, parents in _ONTOLOGY_SYMBOLS:
+	Symbol(name, parent=set(parents), uri=uri, display_name=display_name,
+		doc=doc, auto_resolve=False)
+del _ONTOLOGY_SYMBOLS
 
+def _resolve_symbols():
+	"""
+	Bootstrap the relations between all symbols, if that hasn't been
+	done yet.
+	"""
+	global _symbols_resolved
+	if _symbols_resolved:
+		return
+	_symbols_resolved = True
+	
+	#
+	# Bootstrap the symbol relations. We use a 2-pass strategy:
+	#
+	# 1) Make sure that all parents and children are registered on each symbol
+	for symbol in _SYMBOLS_BY_URI.itervalues():
+		for parent in symbol._parents:
+			try:
+				_SYMBOLS_BY_URI[parent]._children[symbol.uri] = None
+			except KeyError, e:
+				print "ERROR", e, parent, symbol.uri
+				pass
+		for child in symbol._children:
+			try:
+				_SYMBOLS_BY_URI[child]._parents.add(symbol.uri)
+			except KeyError:
+				print "ERROR", e, child, symbol.uri
+				pass
+	
+	# 2) Resolve all child and parent URIs to their actual Symbol instances
+	for symbol in _SYMBOLS_BY_URI.itervalues():
+		for child_uri in symbol._children.iterkeys():
+			symbol._children[child_uri] = _SYMBOLS_BY_URI[child_uri]
+		
+		parents = {}
+		for parent_uri in symbol._parents:
+			parents[parent_uri] = _SYMBOLS_BY_URI[parent_uri]
+		symbol._parents = parents
+	
+	# 3) Precompute the ancestors and descendants of each symbol, so checking
+	#    the relation between two symbols doesn't need to walk the hierarchy
+	for symbol in set(_SYMBOLS_BY_URI.itervalues()):
+		for ancestor_uri in symbol._get_ancestor_uris():
+			_DESCENDANT_URIS.setdefault(ancestor_uri, set()).add(symbol.uri)
+	for uri, descendants in _DESCENDANT_URIS.iteritems():
+		_DESCENDANT_URIS[uri] = frozenset(descendants)
+	for uri, symbol in _SYMBOLS_BY_URI.iteritems():
+		if uri is not None and uri != symbol.uri:
+			_ANCESTOR_URIS[uri] = _ANCESTOR_URIS[symbol.uri]
+			_DESCENDANT_URIS[uri] = _DESCENDANT_URIS[symbol.uri]
 
 if __name__ == "__main__":
 	print "Success"
@@ -0,0 +1,595 @@
+# -.- coding: utf-8 -.-
+
+# Zeitgeist
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read-only access to the Zeitgeist database, bypassing the engine.
+
+This is a port of the query code in libzeitgeist's DbReader (and
+WhereClause); queries must give the same results as when answered by
+the engine. Results are returned in the same form as the D-Bus replies
+of the engine, so they can be handled by the same code.
+"""
+
+import os
+import sqlite3
+import threading
+
+from zeitgeist.datamodel import Event, Subject, Symbol, StorageState, \
+	ResultType, NULL_EVENT
+
+# Version of the core database schema understood by this module, see
+# DatabaseSchema.CORE_SCHEMA_VERSION in libzeitgeist/sql-schema.vala
+CORE_SCHEMA_VERSION = 11
+
+# Columns of event_view, see EventViewRows in libzeitgeist/sql.vala
+(ID, TIMESTAMP, INTERPRETATION, MANIFESTATION, ACTOR, PAYLOAD, SUBJECT_URI,
+	SUBJECT_ID, SUBJECT_INTERPRETATION, SUBJECT_MANIFESTATION, SUBJECT_ORIGIN,
+	SUBJECT_ORIGIN_URI, SUBJECT_MIMETYPE, SUBJECT_TEXT, SUBJECT_STORAGE,
+	SUBJECT_STORAGE_STATE, EVENT_ORIGIN, EVENT_ORIGIN_URI, SUBJECT_CURRENT_URI,
+	SUBJECT_ID_CURRENT, SUBJECT_TEXT_ID, SUBJECT_STORAGE_ID, ACTOR_URI,
+	SUBJECT_CURRENT_ORIGIN, SUBJECT_CURRENT_ORIGIN_URI) = range(25)
+
+class DirectReadUnavailable(Exception):
+	"""
+	Raised when the database can't be read directly, or a query can't
+	be answered the same way as by the engine (eg. because it is
+	invalid, so the engine should report the error). Such queries need
+	to be sent to the engine instead.
+	"""
+
+def _to_unicode(value):
+	if isinstance(value, str):
+		return value.decode("UTF-8")
+	return unicode(value)
+
+def _parse_wildcard(value):
+	if value.endswith("*"):
+		return value[:-1], True
+	return value, False
+
+def _parse_negation(value):
+	if value.startswith("!"):
+		return value[1:], True
+	return value, False
+
+def _parse_noexpand(value):
+	if value.startswith("+"):
+		return value[1:], True
+	return value, False
+
+def _get_right_boundary(text):
+	"""Return the smallest string which is greater than *text*"""
+	if not text:
+		return u"\U0010ffff"
+	if text[-1] == u"\U0010ffff":
+		return _get_right_boundary(text[:-1])
+	return text[:-1] + unichr(ord(text[-1]) + 1)
+
+def _get_search_table_for_column(column):
+	if column in ("origin", "subj_origin", "subj_origin_current", "subj_id",
+			"subj_id_current"):
+		return "uri"
+	if column == "subj_mimetype":
+		return "mimetype"
+	if column == "subj_text_id":
+		return "text"
+	if column == "subj_storage_id":
+		return "storage"
+	return column
+
+class _WhereClause(object):
+	"""
+	Conditions of a SQL WHERE clause, joined together with either AND
+	or OR, and the arguments they need bound.
+	"""
+	
+	AND = " AND "
+	OR = " OR "
+	
+	def __init__(self, relation, negated=False):
+		self.relation = relation
+		self.negated = negated
+		self.conditions = []
+		self.arguments = []
+		# Whether only columns of the event table (and not of
+		# event_view) are needed
+		self.is_simple = True
+	
+	def __len__(self):
+		return len(self.conditions)
+	
+	def add(self, condition, *arguments):
+		self.conditions.append(condition)
+		self.arguments.extend(arguments)
+	
+	def add_match_condition(self, column, value, negation=False):
+		self.add("%s %s= %d" % (column, "!" if negation else "", value))
+	
+	def add_text_condition_subquery(self, column, value, negation=False):
+		self.add("%s %s= (SELECT id FROM %s WHERE value = ?)" % (column,
+			"!" if negation else "", _get_search_table_for_column(column)),
+			_to_unicode(value))
+		self.is_simple = False
+	
+	def add_wildcard_condition(self, column, needle, negation=False):
+		table = _get_search_table_for_column(column)
+		needle = _to_unicode(needle)
+		if needle:
+			subquery = "SELECT id FROM %s WHERE (value >= ? AND value < ?)" \
+				% table
+			arguments = (needle, _get_right_boundary(needle))
+		else:
+			subquery = "SELECT id FROM %s" % table
+			arguments = ()
+		if not negation:
+			sql = "%s IN (%s)" % (column, subquery)
+		else:
+			sql = "(%s NOT IN (%s) OR %s is NULL)" % (column, subquery, column)
+		self.add(sql, *arguments)
+		self.is_simple = False
+	
+	def extend(self, clause):
+		if clause:
+			self.add(clause.get_sql_conditions(), *clause.arguments)
+			self.is_simple = self.is_simple and clause.is_simple
+	
+	def has_non_timestamp_condition(self):
+		for condition in self.conditions:
+			if not condition.startswith("timestamp"):
+				return True
+		return False
+	
+	def get_sql_conditions(self):
+		negation = "NOT " if self.negated else ""
+		if len(self.conditions) == 1:
+			return negation + self.conditions[0]
+		return "%s(%s)" % (negation, self.relation.join(self.conditions))
+
+class _TableLookup(object):
+	"""
+	Cache of one of the tables mapping ids to values. Unlike the one in
+	the engine, it isn't kept up to date on insertions, so the database
+	is queried whenever an id or value isn't known yet.
+	"""
+	
+	def __init__(self, connection, table):
+		self._connection = connection
+		self._table = table
+		self._id_to_value = {}
+		self._value_to_id = {}
+		for id, value in connection.execute(
+				"SELECT id, value FROM %s" % table):
+			self._id_to_value[id] = value
+			self._value_to_id[value] = id
+	
+	def id_try_string(self, value):
+		"""Return the id of *value*, or -1 if it isn't in the table"""
+		value = _to_unicode(value)
+		try:
+			return self._value_to_id[value]
+		except KeyError:
+			row = self._connection.execute(
+				"SELECT id FROM %s WHERE value = ?" % self._table,
+				(value,)).fetchone()
+			if row is None:
+				return -1
+			self._id_to_value[row[0]] = value
+			self._value_to_id[value] = row[0]
+			return row[0]
+	
+	def get_value(self, id):
+		if id is None or id == 0:
+			return u""
+		try:
+			return self._id_to_value[id]
+		except KeyError:
+			row = self._connection.execute(
+				"SELECT value FROM %s WHERE id = ?" % self._table,
+				(id,)).fetchone()
+			if row is None:
+				return u""
+			self._id_to_value[id] = row[0]
+			self._value_to_id[row[0]] = id
+			return row[0]
+
+# Columns grouped by (and whether they're sorted by popularity) for each
+# ResultType except for MostRecentEvents and LeastRecentEvents
+_GROUPED_RESULT_TYPES = {
+	ResultType.MostRecentEventOrigin: ("origin", None),
+	ResultType.LeastRecentEventOrigin: ("origin", None),
+	ResultType.MostPopularEventOrigin: ("origin", False),
+	ResultType.LeastPopularEventOrigin: ("origin", True),
+	ResultType.MostRecentSubjects: ("subj_id", None),
+	ResultType.LeastRecentSubjects: ("subj_id", None),
+	ResultType.MostPopularSubjects: ("subj_id", False),
+	ResultType.LeastPopularSubjects: ("subj_id", True),
+	ResultType.MostRecentCurrentUri: ("subj_id_current", None),
+	ResultType.LeastRecentCurrentUri: ("subj_id_current", None),
+	ResultType.MostPopularCurrentUri: ("subj_id_current", False),
+	ResultType.LeastPopularCurrentUri: ("subj_id_current", True),
+	ResultType.MostRecentActor: ("actor", None),
+	ResultType.LeastRecentActor: ("actor", None),
+	ResultType.MostPopularActor: ("actor", False),
+	ResultType.LeastPopularActor: ("actor", True),
+	ResultType.MostRecentOrigin: ("subj_origin", None),
+	ResultType.LeastRecentOrigin: ("subj_origin", None),
+	ResultType.MostPopularOrigin: ("subj_origin", False),
+	ResultType.LeastPopularOrigin: ("subj_origin", True),
+	ResultType.MostRecentCurrentOrigin: ("subj_origin_current", None),
+	ResultType.LeastRecentCurrentOrigin: ("subj_origin_current", None),
+	ResultType.MostPopularCurrentOrigin: ("subj_origin_current", False),
+	ResultType.LeastPopularCurrentOrigin: ("subj_origin_current", True),
+	ResultType.MostRecentSubjectInterpretation: ("subj_interpretation", None),
+	ResultType.LeastRecentSubjectInterpretation: ("subj_interpretation", None),
+	ResultType.MostPopularSubjectInterpretation: ("subj_interpretation", False),
+	ResultType.LeastPopularSubjectInterpretation: ("subj_interpretation", True),
+	ResultType.MostRecentMimeType: ("subj_mimetype", None),
+	ResultType.LeastRecentMimeType: ("subj_mimetype", None),
+	ResultType.MostPopularMimeType: ("subj_mimetype", False),
+	ResultType.LeastPopularMimeType: ("subj_mimetype", True),
+}
+
+# Result types sorted by ascending timestamps
+_ASCENDING_RESULT_TYPES = frozenset((
+	ResultType.LeastRecentEvents, ResultType.LeastRecentEventOrigin,
+	ResultType.LeastPopularEventOrigin, ResultType.LeastRecentSubjects,
+	ResultType.LeastPopularSubjects, ResultType.LeastRecentCurrentUri,
+	ResultType.LeastPopularCurrentUri, ResultType.LeastRecentActor,
+	ResultType.LeastPopularActor, ResultType.OldestActor,
+	ResultType.LeastRecentOrigin, ResultType.LeastPopularOrigin,
+	ResultType.LeastRecentCurrentOrigin, ResultType.LeastPopularCurrentOrigin,
+	ResultType.LeastRecentSubjectInterpretation,
+	ResultType.LeastPopularSubjectInterpretation,
+	ResultType.LeastRecentMimeType, ResultType.LeastPopularMimeType))
+
+def _field(data, index):
+	"""Return the value of a template field, or "" if it isn't set"""
+	if index < len(data) and data[index]:
+		return data[index]
+	return ""
+
+class DbReader(object):
+	"""
+	Read-only connection to the database at *path*, which must be in
+	write-ahead logging mode (as set up by the engine) so that reading
+	never blocks the engine, nor the other way around.
+	
+	Raises :class:`DirectReadUnavailable` if the database can't be
+	opened or doesn't have the expected schema version.
+	"""
+	
+	def __init__(self, path):
+		if path == ":memory:" or not os.path.isfile(path):
+			raise DirectReadUnavailable("No database at %r" % path)
+		try:
+			self._connection = sqlite3.connect(path, isolation_level=None,
+				check_same_thread=False)
+			self._connection.execute("PRAGMA query_only = 1")
+			journal_mode = self._connection.execute(
+				"PRAGMA journal_mode").fetchone()[0]
+			if journal_mode.lower() != "wal":
+				raise DirectReadUnavailable(
+					"Database isn't in WAL mode: %s" % journal_mode)
+			self._check_schema_version()
+			self._interpretations = _TableLookup(self._connection,
+				"interpretation")
+			self._manifestations = _TableLookup(self._connection,
+				"manifestation")
+			self._mimetypes = _TableLookup(self._connection, "mimetype")
+			self._actors = _TableLookup(self._connection, "actor")
+		except sqlite3.Error, e:
+			raise DirectReadUnavailable("Can't open database: %s" % e)
+		self._lock = threading.Lock()
+	
+	def close(self):
+		# Queries may be running in another thread
+		with self._lock:
+			self._connection.close()
+	
+	def _check_schema_version(self):
+		try:
+			row = self._connection.execute("SELECT version FROM "
+				"schema_version WHERE schema = 'core'").fetchone()
+		except sqlite3.OperationalError:
+			row = None
+		if row is None or row[0] != CORE_SCHEMA_VERSION:
+			raise DirectReadUnavailable("Unsupported schema version: %s" % \
+				(row[0] if row else None))
+	
+	def _read(self, method, *args):
+		"""
+		Call *method* inside a read transaction, so that it sees a
+		consistent snapshot of the database.
+		"""
+		with self._lock:
+			try:
+				self._connection.execute("BEGIN")
+				try:
+					# The engine may have been upgraded meanwhile
+					self._check_schema_version()
+					return method(*args)
+				finally:
+					self._connection.execute("COMMIT")
+			except sqlite3.Error, e:
+				raise DirectReadUnavailable("Error reading database: %s" % e)
+	
+	def get_events(self, event_ids):
+		"""
+		Return the event structs for *event_ids*, with :const:`NULL_EVENT`
+		for the ids which don't exist.
+		"""
+		return self._read(self._get_events, event_ids)
+	
+	def find_event_ids(self, time_range, event_templates, storage_state,
+		num_events, result_type):
+		"""Equivalent of the FindEventIds D-Bus method"""
+		return self._read(self._find_event_ids, time_range, event_templates,
+			storage_state, num_events, result_type)
+	
+	def find_events(self, time_range, event_templates, storage_state,
+		num_events, result_type):
+		"""Equivalent of the FindEvents D-Bus method"""
+		return self._read(lambda *args: self._get_events(
+			self._find_event_ids(*args)), time_range, event_templates,
+			storage_state, num_events, result_type)
+	
+	def _get_events(self, event_ids):
+		event_ids = [int(event_id) for event_id in event_ids]
+		if not event_ids:
+			return []
+		events = {}
+		cursor = self._connection.execute(
+			"SELECT * FROM event_view WHERE id IN (%s)" % \
+			", ".join(map(str, event_ids)))
+		for row in cursor:
+			event = events.get(row[ID])
+			if event is None:
+				payload = row[PAYLOAD]
+				event = events[row[ID]] = ([
+					unicode(row[ID]),
+					unicode(row[TIMESTAMP]),
+					self._interpretations.get_value(row[INTERPRETATION]),
+					self._manifestations.get_value(row[MANIFESTATION]),
+					self._actors.get_value(row[ACTOR]),
+					row[EVENT_ORIGIN_URI] or u"",
+				], [], map(ord, payload) if payload else [])
+			event[1].append([
+				row[SUBJECT_URI] or u"",
+				self._interpretations.get_value(row[SUBJECT_INTERPRETATION]),
+				self._manifestations.get_value(row[SUBJECT_MANIFESTATION]),
+				row[SUBJECT_ORIGIN_URI] or u"",
+				self._mimetypes.get_value(row[SUBJECT_MIMETYPE]),
+				row[SUBJECT_TEXT] or u"",
+				row[SUBJECT_STORAGE] or u"",
+				row[SUBJECT_CURRENT_URI] or u"",
+				row[SUBJECT_CURRENT_ORIGIN_URI] or u"",
+			])
+		return [events.get(event_id, NULL_EVENT) for event_id in event_ids]
+	
+	def _find_event_ids(self, time_range, event_templates, storage_state,
+		num_events, result_type):
+		where = self._get_where_clause_for_query(time_range, event_templates,
+			storage_state)
+		
+		if result_type in (ResultType.MostRecentEvents,
+				ResultType.LeastRecentEvents):
+			sql = "SELECT id FROM event_view "
+			if where:
+				sql += "WHERE " + where.get_sql_conditions()
+			sql += " ORDER BY "
+		elif not where:
+			# The engine doesn't support grouping all events
+			raise DirectReadUnavailable("Grouping needs a condition")
+		elif result_type == ResultType.OldestActor:
+			sql = self._group_and_sort("actor", where, None, "min")
+		elif result_type in _GROUPED_RESULT_TYPES:
+			field, count_asc = _GROUPED_RESULT_TYPES[result_type]
+			sql = self._group_and_sort(field, where, count_asc)
+		else:
+			raise DirectReadUnavailable("Invalid ResultType")
+		sql += " timestamp %s" % ("ASC" if result_type in
+			_ASCENDING_RESULT_TYPES else "DESC")
+		if where.is_simple:
+			sql = sql.replace("FROM event_view", "FROM event")
+		
+		event_ids = []
+		for row in self._connection.execute(sql, where.arguments):
+			event_id = int(row[0])
+			# Events are supposed to be contiguous in the database
+			if not event_ids or event_ids[-1] != event_id:
+				event_ids.append(event_id)
+				if len(event_ids) == num_events:
+					break
+		return event_ids
+	
+	def _group_and_sort(self, field, where, count_asc=None,
+		aggregation_type="max"):
+		aggregation_sql = ""
+		order_sql = ""
+		where_sql = where.get_sql_conditions()
+		if count_asc is not None:
+			aggregation_sql = ", COUNT(%s) AS num_events" % field
+			order_sql = "num_events %s," % ("ASC" if count_asc else "DESC")
+		if count_asc is not None or not where.has_non_timestamp_condition():
+			return """
+				SELECT id FROM event
+				NATURAL JOIN (
+					SELECT %s,
+					%s(timestamp) AS timestamp
+					%s
+					FROM event_view WHERE %s
+					GROUP BY %s)
+				GROUP BY %s
+				ORDER BY %s
+				""" % (field, aggregation_type, aggregation_sql, where_sql,
+					field, field, order_sql)
+		return """
+			SELECT id, %s(timestamp) AS timestamp
+				FROM event_view WHERE %s AND %s IS NOT NULL
+			GROUP BY %s
+			ORDER BY
+			""" % (aggregation_type, where_sql, field, field)
+	
+	def _get_where_clause_for_query(self, time_range, event_templates,
+		storage_state):
+		where = _WhereClause(_WhereClause.AND)
+		
+		if time_range[0] != 0:
+			where.add("timestamp >= %d" % int(time_range[0]))
+		if time_range[1] != 0:
+			where.add("timestamp <= %d" % int(time_range[1]))
+		
+		if storage_state in (StorageState.Available,
+				StorageState.NotAvailable):
+			where.add("(subj_storage_state=? OR subj_storage_state IS NULL)",
+				unicode(int(storage_state)))
+			where.is_simple = False
+		elif storage_state != StorageState.Any:
+			raise DirectReadUnavailable(
+				"Unknown storage state '%s'" % storage_state)
+		
+		templates_where = _WhereClause(_WhereClause.OR)
+		for template in event_templates:
+			templates_where.extend(
+				self._get_where_clause_from_event_template(template))
+		where.extend(templates_where)
+		return where
+	
+	# The checks done in the following methods (and their omissions) are
+	# those done by the engine
+	
+	@staticmethod
+	def _assert_no_wildcard(field, value):
+		if value.endswith("*"):
+			raise DirectReadUnavailable(
+				"Field '%s' doesn't support prefix search" % field)
+	
+	def _get_where_clause_for_symbol(self, column, symbol, lookup):
+		symbol, negated = _parse_negation(symbol)
+		symbol, noexpand = _parse_noexpand(symbol)
+		if noexpand:
+			symbols = [symbol]
+		else:
+			symbols = [symbol] + [uri for uri in
+				Symbol.find_child_uris_extended(symbol) if uri != symbol]
+		
+		where = _WhereClause(_WhereClause.OR, negated)
+		if len(symbols) == 1:
+			where.add_match_condition(column, lookup.id_try_string(symbol))
+		else:
+			where.add("(%s)" % " OR ".join("%s = %i " % (column,
+				lookup.id_try_string(uri)) for uri in symbols))
+		return where
+	
+	def _add_uri_condition(self, where, column, value):
+		value, like = _parse_wildcard(value)
+		value, negated = _parse_negation(value)
+		if like:
+			where.add_wildcard_condition(column, value, negated)
+		else:
+			where.add_text_condition_subquery(column, value, negated)
+	
+	def _get_where_clause_from_event_template(self, template):
+		where = _WhereClause(_WhereClause.AND)
+		metadata = template[0]
+		
+		event_id = _field(metadata, Event.Id)
+		if event_id and int(event_id) != 0:
+			where.add("id=?", unicode(int(event_id)))
+		
+		interpretation = _field(metadata, Event.Interpretation)
+		if interpretation:
+			self._assert_no_wildcard("interpretation", interpretation)
+			where.extend(self._get_where_clause_for_symbol(
+				"interpretation", interpretation, self._interpretations))
+		
+		manifestation = _field(metadata, Event.Manifestation)
+		if manifestation:
+			where.extend(self._get_where_clause_for_symbol(
+				"manifestation", manifestation, self._manifestations))
+		
+		actor = _field(metadata, Event.Actor)
+		if actor:
+			actor, like = _parse_wildcard(actor)
+			actor, negated = _parse_negation(actor)
+			if like:
+				where.add_wildcard_condition("actor", actor, negated)
+			else:
+				where.add_match_condition("actor",
+					self._actors.id_try_string(actor), negated)
+		
+		origin = _field(metadata, Event.Origin)
+		if origin:
+			self._add_uri_condition(where, "origin", origin)
+		
+		# Subject templates within the same event template are AND'd
+		for subject in template[1]:
+			value = _field(subject, Subject.Interpretation)
+			if value:
+				where.extend(self._get_where_clause_for_symbol(
+					"subj_interpretation", value, self._interpretations))
+			
+			value = _field(subject, Subject.Manifestation)
+			if value:
+				self._assert_no_wildcard("subject manifestation", value)
+				where.extend(self._get_where_clause_for_symbol(
+					"subj_manifestation", value, self._manifestations))
+			
+			value = _field(subject, Subject.Mimetype)
+			if value:
+				value, like = _parse_wildcard(value)
+				value, negated = _parse_negation(value)
+				if like:
+					where.add_wildcard_condition("subj_mimetype", value,
+						negated)
+				else:
+					where.add_match_condition("subj_mimetype",
+						self._mimetypes.id_try_string(value), negated)
+			
+			value = _field(subject, Subject.Uri)
+			if value:
+				self._add_uri_condition(where, "subj_id", value)
+			
+			value = _field(subject, Subject.Origin)
+			if value:
+				self._add_uri_condition(where, "subj_origin", value)
+			
+			value = _field(subject, Subject.Text)
+			if value:
+				# Negation, noexpand and prefix search aren't supported
+				# for subject texts
+				where.add_text_condition_subquery("subj_text_id", value)
+			
+			value = _field(subject, Subject.CurrentUri)
+			if value:
+				self._add_uri_condition(where, "subj_id_current", value)
+			
+			value = _field(subject, Subject.CurrentOrigin)
+			if value:
+				self._add_uri_condition(where, "subj_origin_current", value)
+			
+			value = _field(subject, Subject.Storage)
+			if value:
+				if value.startswith("!"):
+					raise DirectReadUnavailable(
+						"Field 'subject storage' doesn't support negation")
+				self._assert_no_wildcard("subject storage", value)
+				where.add_text_condition_subquery("subj_storage_id", value)
+		
+		return where
+
+# vim:noexpandtab:ts=4:sw=4
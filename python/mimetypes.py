@@ -26,8 +26,14 @@ from datamodel import Interpretation, Manifestation
 __all__ = [
     "get_interpretation_for_mimetype",
     "get_manifestation_for_uri",
+    "classify_subjects",
+    "classify_events",
 ]
 
+# Maximal number of mimetypes whose interpretation is remembered after
+# being looked up in MIMES_REGEX
+MEMO_SIZE = 1024
+
 class RegExpr(object):
     """ Helper class which holds a compiled regular expression
     and its pattern."""
@@ -46,6 +52,56 @@ class RegExpr(object):
 def make_regex_tuple(*items):
     return tuple((RegExpr(k), v) for k, v in items)
 
+
+class _CombinedRegex(object):
+    """ Helper class matching a string against a tuple of (RegExpr,
+    value) pairs with a single regular expression. Returns the value
+    of the first pair whose pattern matches, the results are memoized
+    for up to :const:`MEMO_SIZE` strings."""
+    
+    def __init__(self, regex_tuple):
+        self.values = [value for pattern, value in regex_tuple]
+        # Alternatives are tried from left to right, so the first
+        # matching pattern wins, as when trying them one by one
+        self.regex = re.compile("|".join("(?P<p%d>%s)" % (i, pattern)
+            for i, (pattern, value) in enumerate(regex_tuple)))
+        self.memo = {}
+    
+    def match(self, string):
+        try:
+            return self.memo[string]
+        except KeyError:
+            pass
+        match = self.regex.match(string)
+        value = self.values[int(match.lastgroup[1:])] if match else None
+        if len(self.memo) >= MEMO_SIZE:
+            self.memo.clear()
+        self.memo[string] = value
+        return value
+
+
+class _PrefixTable(object):
+    """ Helper class returning the value of the first of a tuple of
+    (prefix, value) pairs whose prefix starts a given string, with one
+    dictionary lookup per distinct prefix length instead of comparing
+    the string with every prefix."""
+    
+    def __init__(self, prefix_tuple):
+        tables = {}
+        for position, (prefix, value) in enumerate(prefix_tuple):
+            table = tables.setdefault(len(prefix), {})
+            table.setdefault(prefix, (position, value))
+        self.tables = sorted(tables.items())
+    
+    def lookup(self, string):
+        result = None
+        for length, table in self.tables:
+            entry = table.get(string[:length])
+            if entry is not None and (result is None or entry < result):
+                result = entry
+        return result[1] if result is not None else None
+
+
 def get_interpretation_for_mimetype(mimetype):
     """ get interpretation for a given mimetype, returns :const:`None`
     if none of the predefined interpretations matches
@@ -53,19 +109,40 @@ def get_interpretation_for_mimetype(mimetype):
     interpretation = MIMES.get(mimetype, None)
     if interpretation is not None:
         return interpretation
-    for pattern, interpretation in MIMES_REGEX:
-        if pattern.match(mimetype):
-            return interpretation
-    return None
-    
+    return _MIMES_REGEX_COMBINED.match(mimetype)
+
 def get_manifestation_for_uri(uri):
     """ Lookup Manifestation for a given uri based on the scheme part,
     returns :const:`None` if no suitable manifestation is found
     """
-    for scheme, manifestation in SCHEMES:
-        if uri.startswith(scheme):
-            return manifestation
-    return None
+    return _SCHEMES_TABLE.lookup(uri)
+
+def classify_subjects(subjects):
+    """ Fill in the interpretation of the given :class:`Subjects
+    <zeitgeist.datamodel.Subject>` which don't have one based on their
+    mimetype, and their manifestation based on their uri, as far as
+    those are known. The subjects are modified in place.
+    """
+    interpretations = {}
+    for subject in subjects:
+        if not subject.interpretation and subject.mimetype:
+            mimetype = subject.mimetype
+            if mimetype not in interpretations:
+                interpretations[mimetype] = \
+                    get_interpretation_for_mimetype(mimetype)
+            if interpretations[mimetype] is not None:
+                subject.interpretation = interpretations[mimetype]
+        if not subject.manifestation and subject.uri:
+            manifestation = _SCHEMES_TABLE.lookup(subject.uri)
+            if manifestation is not None:
+                subject.manifestation = manifestation
+
+def classify_events(events):
+    """ Call :func:`classify_subjects` for the subjects of all given
+    :class:`Events <zeitgeist.datamodel.Event>`
+    """
+    classify_subjects(subject for event in events
+        for subject in event.subjects)
     
     
 MIMES = {
@@ -250,4 +327,7 @@ SCHEMES = tuple((
     ("smb://", Manifestation.REMOTE_DATA_OBJECT),
 ))
 
+_MIMES_REGEX_COMBINED = _CombinedRegex(MIMES_REGEX)
+_SCHEMES_TABLE = _PrefixTable(SCHEMES)
+
 # vim:noexpandtab:ts=4:sw=4
@@ -40,6 +40,73 @@ public class Engine : DbReader
 
     private uint32 last_id;
 
+    // Maximal number of entries in payload_cache before it's cleared
+    private const uint PAYLOAD_CACHE_SIZE = 512;
+
+    // IDs of recently stored payloads, by the hash of their content
+    private HashTable<string, int64?> payload_cache =
+        new HashTable<string, int64?> (str_hash, str_equal);
+
+    // Maximal number of values in the ID caches of the uri, text
+    // and storage tables
+    private const uint URI_CACHE_SIZE = 4096;
+    private const uint TEXT_CACHE_SIZE = 1024;
+    private const uint STORAGE_CACHE_SIZE = 64;
+
+    private IdCache uris_cache = new IdCache (URI_CACHE_SIZE);
+    private IdCache texts_cache = new IdCache (TEXT_CACHE_SIZE);
+    private IdCache storages_cache = new IdCache (STORAGE_CACHE_SIZE);
+
+    // Maximal number of events deleted by a single transaction
+    private const int DELETION_CHUNK_SIZE = 5000;
+
+    // Tables with rows which are garbage collected once no event uses
+    // them anymore (see schedule_garbage_collection ())
+    private const string[] COLLECTED_TABLES = {
+        "uri", "text", "payload", "storage"
+    };
+    // Number of rows checked, or of pages vacuumed, per step of the
+    // garbage collection, and time between steps in milliseconds
+    private const int GC_STEP_ROWS = 1000;
+    private const int GC_STEP_PAGES = 256;
+    private const uint GC_STEP_INTERVAL = 50;
+
+    private uint gc_source_id = 0;
+    private int gc_table = 0;
+    private int64 gc_position = 0;
+    // Set when events were deleted during a pass of the collector
+    private bool gc_dirty = false;
+
+    // Default for group_commit_window
+    public const uint DEFAULT_GROUP_COMMIT_WINDOW = 5;
+
+    /**
+     * Time, in milliseconds, for which insertions made with
+     * insert_events_async () are queued before they are committed
+     * together with all others made in the meantime.
+     */
+    public uint group_commit_window {
+        get; set; default = DEFAULT_GROUP_COMMIT_WINDOW;
+    }
+
+    private class PendingInsertion
+    {
+        public GenericArray<Event> events;
+        public uint32[] event_ids;
+        public EngineError? error = null;
+        public SourceFunc callback;
+
+        public PendingInsertion (GenericArray<Event> events)
+        {
+            this.events = events;
+            event_ids = new uint32[events.length];
+        }
+    }
+
+    private GenericArray<PendingInsertion> pending_insertions =
+        new GenericArray<PendingInsertion> ();
+    private uint group_commit_source_id = 0;
+
     public Engine () throws EngineError
     {
         Object (database: new Zeitgeist.SQLite.Database ());
@@ -74,31 +141,23 @@ public class Engine : DbReader
     public uint32[] insert_events (GenericArray<Event> events,
         BusName? sender=null) throws EngineError
     {
-        // Any changes to events need to be done here so they'll
-        // be taken into consideration by the extensions (LP: #928804).
-        for (int i = 0; i < events.length; ++i)
-        {
-            preprocess_event (events[i]);
-        }
+        // Keep the order in which the events are inserted
+        commit_pending_insertions ();
 
-        extension_collection.call_pre_insert_events (events, sender);
+        prepare_events (events, sender);
         uint32[] event_ids = new uint32[events.length];
         EngineError? err = null;
         database.begin_transaction ();
         try
         {
-            insert_event_data (events);
-            for (int i = 0; i < events.length; ++i)
-            {
-                if (events[i] != null)
-                    event_ids[i] = insert_event (events[i]);
-            }
+            store_events (events, event_ids);
             database.end_transaction ();
         }
         catch (EngineError e)
         {
             err = e;
             database.abort_transaction ();
+            forget_uncommitted_ids ();
         }
         if (err != null) throw err;
 
@@ -106,6 +165,160 @@ public class Engine : DbReader
         return event_ids;
     }
 
+    /**
+     * Like insert_events (), but the events are committed together
+     * with those of all other calls made within group_commit_window
+     * milliseconds, in a single transaction, so that many small
+     * insertions don't pay for one commit each. Returns once the events
+     * have been committed.
+     */
+    public async uint32[] insert_events_async (GenericArray<Event> events,
+        BusName? sender=null) throws EngineError
+    {
+        prepare_events (events, sender);
+
+        var insertion = new PendingInsertion (events);
+        insertion.callback = insert_events_async.callback;
+        pending_insertions.add (insertion);
+        if (group_commit_source_id == 0)
+        {
+            group_commit_source_id = Timeout.add (group_commit_window, () =>
+                {
+                    group_commit_source_id = 0;
+                    commit_pending_insertions ();
+                    return false;
+                });
+        }
+        yield;
+
+        EngineError? err = (owned) insertion.error;
+        if (err != null) throw err;
+
+        extension_collection.call_post_insert_events (events, sender);
+        return insertion.event_ids;
+    }
+
+    /**
+     * Commits the insertions queued by insert_events_async () right
+     * away. Call this before anything which has to see them.
+     *
+     * Each insertion gets a savepoint, so that if one of them fails
+     * only the call which made it gets an error.
+     */
+    public void commit_pending_insertions ()
+    {
+        if (group_commit_source_id != 0)
+        {
+            Source.remove (group_commit_source_id);
+            group_commit_source_id = 0;
+        }
+        if (pending_insertions.length == 0)
+            return;
+
+        var insertions = pending_insertions;
+        pending_insertions = new GenericArray<PendingInsertion> ();
+
+        try
+        {
+            database.begin_transaction ();
+            try
+            {
+                for (int i = 0; i < insertions.length; ++i)
+                    store_pending_insertion (insertions[i]);
+                database.end_transaction ();
+            }
+            catch (EngineError e)
+            {
+                database.abort_transaction ();
+                throw e;
+            }
+        }
+        catch (EngineError e)
+        {
+            forget_uncommitted_ids ();
+            for (int i = 0; i < insertions.length; ++i)
+            {
+                if (insertions[i].error == null)
+                {
+                    insertions[i].error = new EngineError.DATABASE_ERROR (
+                        e.message);
+                }
+            }
+        }
+
+        for (int i = 0; i < insertions.length; ++i)
+            insertions[i].callback ();
+    }
+
+    private void store_pending_insertion (PendingInsertion insertion)
+        throws EngineError
+    {
+        uint32 first_id = last_id;
+        database.set_savepoint ("insertion");
+        try
+        {
+            store_events (insertion.events, insertion.event_ids);
+            database.release_savepoint ("insertion");
+        }
+        catch (EngineError e)
+        {
+            database.rollback_to_savepoint ("insertion");
+            last_id = first_id;
+            forget_uncommitted_ids ();
+            insertion.error = e;
+        }
+    }
+
+    /**
+     * Clears the caches of IDs, which may contain some of rows inserted
+     * by a transaction (or savepoint) which was rolled back.
+     */
+    private void forget_uncommitted_ids ()
+    {
+        payload_cache.remove_all ();
+        uris_cache.clear ();
+        texts_cache.clear ();
+        storages_cache.clear ();
+    }
+
+    protected override void delete_from_cache (string table, int64 rowid)
+    {
+        if (table == "uri")
+            uris_cache.remove ((int) rowid);
+        else if (table == "text")
+            texts_cache.remove ((int) rowid);
+        else if (table == "storage")
+            storages_cache.remove ((int) rowid);
+        else if (table == "payload")
+            payload_cache.remove_all ();
+        else
+            base.delete_from_cache (table, rowid);
+    }
+
+    private void prepare_events (GenericArray<Event> events,
+        BusName? sender) throws EngineError
+    {
+        // Any changes to events need to be done here so they'll
+        // be taken into consideration by the extensions (LP: #928804).
+        for (int i = 0; i < events.length; ++i)
+        {
+            preprocess_event (events[i]);
+        }
+
+        extension_collection.call_pre_insert_events (events, sender);
+    }
+
+    private void store_events (GenericArray<Event> events,
+        uint32[] event_ids) throws EngineError
+    {
+        var uris = new DataInserter (database, "uri", uris_cache);
+        var texts = new DataInserter (database, "text", texts_cache);
+        var storages = new DataInserter (database, "storage",
+            storages_cache);
+        insert_event_data (events, uris, texts, storages);
+        insert_event_rows (events, event_ids, uris, texts, storages);
+    }
+
     private void preprocess_event (Event event) throws EngineError
     {
         if (is_empty_string (event.interpretation)
@@ -185,13 +398,18 @@ public class Engine : DbReader
 
         private Database database;
         private string type;
+        private IdCache cache;
         private GenericArray<string> data;
+        // IDs of all values added or referenced, 0 until resolved
+        private HashTable<string, int> ids;
 
-        public DataInserter (Database db, string data_type)
+        public DataInserter (Database db, string data_type, IdCache id_cache)
         {
             database = db;
             type = data_type;
+            cache = id_cache;
             data = new GenericArray<string> ();
+            ids = new HashTable<string, int> (str_hash, str_equal);
         }
 
         ~DataInserter ()
@@ -202,11 +420,25 @@ public class Engine : DbReader
 
         public void add (string val) throws EngineError
         {
+            reference (val);
+            // Values with a known ID are already in the database
+            if (ids.lookup (val) != 0)
+                return;
             if (data.length == MAX_PARAMETERS)
                 flush ();
             data.add (val);
         }
 
+        /**
+         * Remembers that the ID of the given value is needed, without
+         * inserting it.
+         */
+        public void reference (string? val)
+        {
+            if (val != null && !ids.contains (val))
+                ids.insert (val, cache.lookup (val));
+        }
+
         public void flush () throws EngineError
         {
             if (data.length > 0)
@@ -215,19 +447,65 @@ public class Engine : DbReader
                 data = new GenericArray<string> ();
             }
         }
+
+        /**
+         * Looks up the IDs of all added and referenced values, after
+         * they have been flushed.
+         */
+        public void resolve_ids () throws EngineError
+        {
+            var values = new GenericArray<string> ();
+            foreach (unowned string val in ids.get_keys ())
+            {
+                // Cached values were resolved when they were referenced
+                if (ids.lookup (val) != 0)
+                    continue;
+                if (values.length == MAX_PARAMETERS)
+                {
+                    resolve_values (values);
+                    values = new GenericArray<string> ();
+                }
+                values.add (val);
+            }
+            resolve_values (values);
+        }
+
+        private void resolve_values (GenericArray<string> values)
+            throws EngineError
+        {
+            database.get_ids_for_values (type, values, ids);
+            for (int i = 0; i < values.length; ++i)
+            {
+                int id = ids.lookup (values[i]);
+                if (id != 0)
+                    cache.insert (values[i], id);
+            }
+        }
+
+        /**
+         * Binds the ID of the given value, or NULL if it isn't in the
+         * table, like a "(SELECT id FROM table WHERE value=?)" would.
+         */
+        public void bind_id (Sqlite.Statement stmt, int position,
+            string? val)
+        {
+            int id = (val != null) ? ids.lookup (val) : 0;
+            if (id != 0)
+                stmt.bind_int64 (position, id);
+            else
+                stmt.bind_null (position);
+        }
     }
 
     /**
      * Makes sure all the URIs, texts and storage values used
-     * by the given events are in the database.
+     * by the given events are in the database, and looks up
+     * their IDs.
      */
-    private void insert_event_data (GenericArray<Event> events)
+    private void insert_event_data (GenericArray<Event> events,
+        DataInserter uris, DataInserter texts, DataInserter storages)
         throws EngineError
     {
-        var uris = new DataInserter (database, "uri");
-        var texts = new DataInserter (database, "text");
-        var storages = new DataInserter (database, "storage");
-
         for (int j = 0; j < events.length; ++j)
         {
             if (events[j] == null) continue;
@@ -237,6 +515,7 @@ public class Engine : DbReader
 
             if (!is_empty_string (event.origin))
                 uris.add (event.origin);
+            uris.reference (event.origin);
 
             // Iterate through subjects and check for validity
             for (int i = 0; i < event.num_subjects (); ++i)
@@ -262,12 +541,170 @@ public class Engine : DbReader
                     texts.add (subject.text);
                 if (!is_empty_string(subject.storage))
                     storages.add (subject.storage);
+
+                uris.reference (subject.current_uri);
+                uris.reference (subject.origin);
+                uris.reference (subject.current_origin);
+                texts.reference (subject.text);
+                storages.reference (subject.storage);
             }
         }
 
         uris.flush ();
         texts.flush ();
         storages.flush ();
+
+        uris.resolve_ids ();
+        texts.resolve_ids ();
+        storages.resolve_ids ();
+    }
+
+    /**
+     * Inserts the rows (one per subject) of the given events, as many
+     * as possible per statement. Batches consist of whole events, and
+     * end with move events, so that those are handled before any later
+     * event is inserted.
+     */
+    private void insert_event_rows (GenericArray<Event> events,
+        uint32[] event_ids, DataInserter uris, DataInserter texts,
+        DataInserter storages) throws EngineError
+    {
+        int max_rows = database.event_batch_max_rows;
+        int batch_start = 0;
+        int batch_rows = 0;
+
+        for (int i = 0; i < events.length; ++i)
+        {
+            if (events[i] == null)
+                continue;
+
+            int rows = events[i].num_subjects ();
+            if (events[i].id != 0 || rows == 0 || rows > max_rows)
+            {
+                // Let insert_event () reject it or insert it on its own
+                insert_event_batch (events, batch_start, i, batch_rows,
+                    event_ids, uris, texts, storages);
+                int64 payload_id = 0;
+                if (events[i].id == 0 && rows > 0)
+                    payload_id = store_payload (events[i]);
+                event_ids[i] = insert_event (events[i], payload_id);
+                batch_start = i + 1;
+                batch_rows = 0;
+                continue;
+            }
+
+            if (batch_rows + rows > max_rows)
+            {
+                insert_event_batch (events, batch_start, i, batch_rows,
+                    event_ids, uris, texts, storages);
+                batch_start = i;
+                batch_rows = 0;
+            }
+            batch_rows += rows;
+
+            if (events[i].interpretation == ZG.MOVE_EVENT)
+            {
+                insert_event_batch (events, batch_start, i + 1, batch_rows,
+                    event_ids, uris, texts, storages);
+                batch_start = i + 1;
+                batch_rows = 0;
+            }
+        }
+
+        insert_event_batch (events, batch_start, events.length, batch_rows,
+            event_ids, uris, texts, storages);
+    }
+
+    /**
+     * Inserts the events from start to end (exclusive), which have
+     * the given number of subjects in total, with a single statement.
+     *
+     * If this fails, eg. because one of them was already registered,
+     * they are inserted one by one instead, so that we get the ID of
+     * the original event for duplicates.
+     */
+    private void insert_event_batch (GenericArray<Event> events, int start,
+        int end, int rows, uint32[] event_ids, DataInserter uris,
+        DataInserter texts, DataInserter storages) throws EngineError
+    {
+        if (rows == 0)
+            return;
+
+        uint32 first_id = last_id;
+        int64[] payload_ids = new int64[end - start];
+        unowned Sqlite.Statement insert_stmt =
+            database.get_event_batch_insertion_stmt (rows);
+        insert_stmt.reset ();
+
+        int position = 1;
+        for (int i = start; i < end; ++i)
+        {
+            unowned Event? event = events[i];
+            if (event == null)
+                continue;
+
+            event.id = ++last_id;
+            payload_ids[i - start] = store_payload (event);
+
+            for (int j = 0; j < event.num_subjects (); ++j)
+            {
+                bind_event_row (insert_stmt, position, event,
+                    event.subjects[j], payload_ids[i - start], uris, texts,
+                    storages);
+                position += Database.EVENT_ROW_PARAMETERS;
+            }
+        }
+
+        if (insert_stmt.step () == Sqlite.DONE)
+        {
+            for (int i = start; i < end; ++i)
+            {
+                if (events[i] == null)
+                    continue;
+                event_ids[i] = events[i].id;
+                after_event_insertion (events[i]);
+            }
+            return;
+        }
+
+        // The failed statement didn't change anything
+        insert_stmt.reset ();
+        last_id = first_id;
+        for (int i = start; i < end; ++i)
+        {
+            if (events[i] == null)
+                continue;
+            events[i].id = 0;
+            event_ids[i] = insert_event (events[i], payload_ids[i - start]);
+        }
+    }
+
+    private void bind_event_row (Sqlite.Statement stmt, int position,
+        Event event, Subject subject, int64 payload_id, DataInserter uris,
+        DataInserter texts, DataInserter storages) throws EngineError
+    {
+        stmt.bind_int64 (position, event.id);
+        stmt.bind_int64 (position + 1, event.timestamp);
+        bind_cached_reference (stmt, position + 2, interpretations_table,
+            event.interpretation);
+        bind_cached_reference (stmt, position + 3, manifestations_table,
+            event.manifestation);
+        bind_cached_reference (stmt, position + 4, actors_table, event.actor);
+        uris.bind_id (stmt, position + 5, event.origin);
+        stmt.bind_int64 (position + 6, payload_id);
+
+        uris.bind_id (stmt, position + 7, subject.uri);
+        uris.bind_id (stmt, position + 8, subject.current_uri);
+        bind_cached_reference (stmt, position + 9, interpretations_table,
+            subject.interpretation);
+        bind_cached_reference (stmt, position + 10, manifestations_table,
+            subject.manifestation);
+        uris.bind_id (stmt, position + 11, subject.origin);
+        uris.bind_id (stmt, position + 12, subject.current_origin);
+        bind_cached_reference (stmt, position + 13, mimetypes_table,
+            subject.mimetype);
+        texts.bind_id (stmt, position + 14, subject.text);
+        storages.bind_id (stmt, position + 15, subject.storage);
     }
 
     private void bind_cached_reference (Sqlite.Statement stmt,
@@ -279,14 +716,13 @@ public class Engine : DbReader
             stmt.bind_null (position);
     }
 
-    private uint32 insert_event (Event event) throws EngineError
+    private uint32 insert_event (Event event, int64 payload_id)
+        throws EngineError
         requires (event.id == 0)
         requires (event.num_subjects () > 0)
     {
         event.id = ++last_id;
 
-        var payload_id = store_payload (event);
-
         // FIXME: Should we add something just like TableLookup but with LRU
         //        for those? Or is embedding the query faster? Needs testing!
 
@@ -357,6 +793,12 @@ public class Engine : DbReader
             }
         }
 
+        after_event_insertion (event);
+        return event.id;
+    }
+
+    private void after_event_insertion (Event event)
+    {
         if (event.interpretation == ZG.MOVE_EVENT)
         {
             handle_move_event (event);
@@ -364,40 +806,233 @@ public class Engine : DbReader
         // After every 1000 events we analyze the queries
         if (event.id % 1000 == 0)
             Idle.add((SourceFunc)database.analyze);
-        return event.id;
     }
 
+    /**
+     * Emitted once events have been deleted, with their time range and
+     * the IDs of those which existed. Deletions which fail partway
+     * through emit it for the events deleted before the failure.
+     */
+    public signal void events_deleted (TimeRange time_range,
+        uint32[] event_ids);
+
     public TimeRange? delete_events (uint32[] event_ids, BusName? sender)
         throws EngineError
         requires (event_ids.length > 0)
     {
-        event_ids = extension_collection.call_pre_delete_events (
+        event_ids = prepare_deletion (event_ids, sender);
+
+        TimeRange? time_range = null;
+        uint32[] deleted_ids = {};
+        try
+        {
+            for (int start = 0; start < event_ids.length;
+                start += DELETION_CHUNK_SIZE)
+            {
+                delete_event_chunk (event_ids, start, ref time_range,
+                    ref deleted_ids);
+            }
+        }
+        catch (EngineError e)
+        {
+            abort_deletion (event_ids, deleted_ids, time_range, sender, e);
+        }
+
+        return finish_deletion (event_ids, deleted_ids, time_range, sender);
+    }
+
+    /**
+     * Like delete_events (), but returns to the main loop after deleting
+     * each DELETION_CHUNK_SIZE events, so that other calls don't have to
+     * wait until hundreds of thousands of events have been deleted.
+     */
+    public async TimeRange? delete_events_async (uint32[] event_ids,
+        BusName? sender) throws EngineError
+        requires (event_ids.length > 0)
+    {
+        event_ids = prepare_deletion (event_ids, sender);
+
+        TimeRange? time_range = null;
+        uint32[] deleted_ids = {};
+        try
+        {
+            for (int start = 0; start < event_ids.length;
+                start += DELETION_CHUNK_SIZE)
+            {
+                if (start > 0)
+                {
+                    Idle.add (delete_events_async.callback);
+                    yield;
+                }
+                delete_event_chunk (event_ids, start, ref time_range,
+                    ref deleted_ids);
+            }
+        }
+        catch (EngineError e)
+        {
+            abort_deletion (event_ids, deleted_ids, time_range, sender, e);
+        }
+
+        return finish_deletion (event_ids, deleted_ids, time_range, sender);
+    }
+
+    private uint32[] prepare_deletion (uint32[] event_ids, BusName? sender)
+        throws EngineError
+    {
+        // The events to delete may not have been committed yet
+        commit_pending_insertions ();
+
+        return extension_collection.call_pre_delete_events (
             event_ids, sender);
+    }
+
+    /**
+     * Deletes up to DELETION_CHUNK_SIZE events, starting with the one
+     * at the given position, in one transaction. Extends time_range with
+     * the time range of the deleted events, and appends their IDs to
+     * deleted_ids.
+     */
+    private void delete_event_chunk (uint32[] event_ids, int start,
+        ref TimeRange? time_range, ref uint32[] deleted_ids)
+        throws EngineError
+    {
+        int end = int.min (start + DELETION_CHUNK_SIZE, event_ids.length);
+        uint32[] chunk_ids = {};
+
+        database.begin_transaction ();
+        try
+        {
+            // Bound through a table, to not build a huge "IN (...)"
+            database.set_event_id_table (event_ids, start, end);
+            TimeRange? chunk_range =
+                database.get_time_range_for_event_id_table ();
+            if (chunk_range != null)
+            {
+                chunk_ids = database.get_existing_ids_in_event_id_table ();
+                int rc = db.exec (
+                    "DELETE FROM event WHERE id IN temp.event_ids");
+                database.assert_query_success (rc, "SQL Error");
+            }
+            database.end_transaction ();
+
+            if (chunk_range != null && time_range != null)
+            {
+                time_range = new TimeRange (
+                    int64.min (time_range.start, chunk_range.start),
+                    int64.max (time_range.end, chunk_range.end));
+            }
+            else if (chunk_range != null)
+            {
+                time_range = chunk_range;
+            }
+        }
+        catch (EngineError e)
+        {
+            database.abort_transaction ();
+            throw e;
+        }
 
-        TimeRange? time_range = database.get_time_range_for_event_ids (
-            event_ids);
+        foreach (uint32 id in chunk_ids)
+            deleted_ids += id;
+    }
 
-        string sql_event_ids = database.get_sql_string_from_event_ids (
-            event_ids);
+    /**
+     * Handles the failure of a chunk. The chunks before it have been
+     * committed, so the deletion is finished for the events they
+     * deleted, before the error is passed on.
+     */
+    private void abort_deletion (uint32[] event_ids, uint32[] deleted_ids,
+        TimeRange? time_range, BusName? sender, EngineError error)
+        throws EngineError
+    {
+        if (time_range != null)
+        {
+            warning ("Deletion failed after deleting %d of %d events".printf (
+                deleted_ids.length, event_ids.length));
+            finish_deletion (event_ids, deleted_ids, time_range, sender);
+        }
+        throw error;
+    }
 
+    private TimeRange? finish_deletion (uint32[] event_ids,
+        uint32[] deleted_ids, TimeRange? time_range, BusName? sender)
+    {
         if (time_range == null)
         {
-            warning ("Tried to delete non-existing event(s): %s".printf (
-                sql_event_ids));
+            warning ("Tried to delete %d non-existing event(s)".printf (
+                event_ids.length));
             return null;
         }
 
-        int rc = db.exec ("DELETE FROM event WHERE id IN (%s)".printf(
-            sql_event_ids), null, null);
-        database.assert_query_success (rc, "SQL Error");
         message ("Deleted %d (out of %d) events.".printf (
-            db.changes(), event_ids.length));
+            deleted_ids.length, event_ids.length));
 
-        extension_collection.call_post_delete_events (event_ids, sender);
+        extension_collection.call_post_delete_events (deleted_ids, sender);
+        events_deleted (time_range, deleted_ids);
+
+        // The events' URIs, texts, payloads and storages may be unused now
+        schedule_garbage_collection ();
 
         return time_range;
     }
 
+    /**
+     * Starts deleting the rows of the uri, text, payload and storage
+     * tables which aren't used by any event (anymore), in the
+     * background, a few at a time. The space they took is then returned
+     * to the file system, if the database uses incremental auto-vacuum.
+     *
+     * If a pass is already running, it's finished first (so that frequent
+     * deletions don't keep restarting it), followed by another one for
+     * the rows which became unused meanwhile.
+     */
+    public void schedule_garbage_collection ()
+    {
+        if (gc_source_id != 0)
+        {
+            gc_dirty = true;
+            return;
+        }
+
+        gc_table = 0;
+        gc_position = 0;
+        gc_source_id = Timeout.add (GC_STEP_INTERVAL,
+            collect_garbage_step, Priority.LOW);
+    }
+
+    private bool collect_garbage_step ()
+    {
+        try
+        {
+            if (gc_table < COLLECTED_TABLES.length)
+            {
+                gc_position = database.delete_unreferenced_rows (
+                    COLLECTED_TABLES[gc_table], gc_position, GC_STEP_ROWS);
+                if (gc_position == 0)
+                    gc_table++;
+                return true;
+            }
+            if (database.incremental_vacuum (GC_STEP_PAGES))
+                return true;
+            if (gc_dirty)
+            {
+                // Start over, for the rows unused since the pass started
+                gc_dirty = false;
+                gc_table = 0;
+                gc_position = 0;
+                return true;
+            }
+        }
+        catch (EngineError err)
+        {
+            warning ("Garbage collection failed: %s", err.message);
+        }
+
+        gc_source_id = 0;
+        gc_dirty = false;
+        return false;
+    }
+
     /**
      * Clear all resources Engine is using (close database connection,
      * unload extensions, etc.).
@@ -407,6 +1042,13 @@ public class Engine : DbReader
      */
     public override void close ()
     {
+        commit_pending_insertions ();
+        if (gc_source_id != 0)
+        {
+            Source.remove (gc_source_id);
+            gc_source_id = 0;
+        }
+
         // We delete the ExtensionCollection here so that it unloads
         // all extensions and they get a chance to access the database
         // (including through ExtensionStore) before it's closed.
@@ -445,31 +1087,60 @@ public class Engine : DbReader
     private int64 store_payload (Event event)
     {
         /**
-        * TODO: Right now payloads are not unique and every event has its
-        * own one. We could optimize this to store those which are repeated
-        * for different events only once, especially considering that
-        * events cannot be modified once they've been inserted.
+        * Payloads are stored only once for all events with the same
+        * content, which is identified by its hash. Since events cannot
+        * be modified once they've been inserted, the ID of a payload
+        * stays valid until it's garbage collected, after the last event
+        * using it was deleted.
         */
         if (event.payload != null)
         {
             int rc;
-            unowned Sqlite.Statement payload_insertion_stmt =
-                database.payload_insertion_stmt;
-            payload_insertion_stmt.reset ();
-            payload_insertion_stmt.bind_blob (1, event.payload.data,
-                event.payload.data.length);
-            if ((rc = payload_insertion_stmt.step ()) != Sqlite.DONE)
-                if (rc != Sqlite.CONSTRAINT)
+            string hash = DatabaseSchema.get_payload_hash (
+                event.payload.data);
+
+            int64? cached_id = payload_cache.lookup (hash);
+            if (cached_id != null)
+                return cached_id;
+
+            unowned Sqlite.Statement payload_retrieval_stmt =
+                database.payload_retrieval_stmt;
+            payload_retrieval_stmt.reset ();
+            payload_retrieval_stmt.bind_text (1, hash);
+            int64 payload_id = 0;
+            if ((rc = payload_retrieval_stmt.step ()) == Sqlite.ROW)
+            {
+                payload_id = payload_retrieval_stmt.column_int64 (0);
+                payload_retrieval_stmt.reset ();
+            }
+            else
+            {
+                unowned Sqlite.Statement payload_insertion_stmt =
+                    database.payload_insertion_stmt;
+                payload_insertion_stmt.reset ();
+                payload_insertion_stmt.bind_blob (1, event.payload.data,
+                    event.payload.data.length);
+                payload_insertion_stmt.bind_text (2, hash);
+                if ((rc = payload_insertion_stmt.step ()) != Sqlite.DONE)
                 {
-                    warning ("SQL error: %d, %s\n", rc, db.errmsg ());
-                    try
+                    if (rc != Sqlite.CONSTRAINT)
                     {
-                        database.assert_not_corrupt (rc);
+                        warning ("SQL error: %d, %s\n", rc, db.errmsg ());
+                        try
+                        {
+                            database.assert_not_corrupt (rc);
+                        }
+                        catch (EngineError err) { }
                     }
-                    catch (EngineError err) { }
+                    return 0;
                 }
+                payload_id = database.database.last_insert_rowid ();
+            }
 
-            return database.database.last_insert_rowid ();
+            if (payload_cache.size () >= PAYLOAD_CACHE_SIZE)
+                payload_cache.remove_all ();
+            payload_cache.insert (hash, payload_id);
+            return payload_id;
         }
         return 0;
     }
@@ -0,0 +1 @@
+../extensions/retention.vala
\ No newline at end of file
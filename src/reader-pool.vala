@@ -0,0 +1,116 @@
+/* reader-pool.vala
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation, either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ */
+
+using Zeitgeist;
+
+namespace Zeitgeist
+{
+    /**
+     * Runs queries on a pool of read-only database connections, each
+     * used by one thread at a time, so that slow queries don't block
+     * the main loop (and with it insertions and notifications).
+     *
+     * The database is in WAL mode, so readers see everything committed
+     * before they start, and never block the writer.
+     *
+     * Without any connections, or with an in-memory database (which
+     * other connections can't see), queries run on the engine instead.
+     */
+    public class ReaderPool : Object
+    {
+        public delegate void ReaderFunc (DbReader reader);
+
+        class DbWorker
+        {
+            private unowned ReaderFunc func;
+            public SourceFunc callback;
+
+            public DbWorker (ReaderFunc func, owned SourceFunc callback)
+            {
+                this.func = func;
+                this.callback = (owned) callback;
+            }
+
+            public void run (DbReader reader)
+            {
+                this.func (reader);
+            }
+        }
+
+        private DbReader engine;
+        private AsyncQueue<DbReader>? readers = null;
+        private ThreadPool<DbWorker>? threads = null;
+
+        public uint size { get; private set; default = 0; }
+
+        public ReaderPool (DbReader engine, uint size)
+        {
+            this.engine = engine;
+            if (size == 0 || Utils.using_in_memory_database ())
+                return;
+
+            try
+            {
+                readers = new AsyncQueue<DbReader> ();
+                for (uint i = 0; i < size; ++i)
+                    readers.push (new DbReader ());
+
+                threads = new ThreadPool<DbWorker>.with_owned_data (
+                    (worker) =>
+                    {
+                        // There are as many readers as threads
+                        DbReader reader = readers.pop ();
+                        worker.run (reader);
+                        readers.push (reader);
+                        Idle.add ((owned) worker.callback);
+                    }, (int) size, true);
+                this.size = size;
+            }
+            catch (Error err)
+            {
+                warning ("Can't create reader pool, queries will block: %s",
+                    err.message);
+                readers = null;
+                threads = null;
+            }
+        }
+
+        /**
+         * Calls func with one of the readers, in another thread, and
+         * returns once it's done.
+         */
+        public async void run (ReaderFunc func)
+        {
+            if (threads != null)
+            {
+                try
+                {
+                    threads.add (new DbWorker (func, run.callback));
+                    yield;
+                    return;
+                }
+                catch (ThreadError err)
+                {
+                    warning ("%s", err.message);
+                }
+            }
+            func (engine);
+        }
+    }
+}
+
+// vim:expandtab:ts=4:sw=4
@@ -41,6 +41,10 @@ namespace Zeitgeist
         private static bool quit_daemon = false;
         private static string log_level = "";
         private static string? log_file = null;
+        private static int num_readers = DEFAULT_READERS;
+
+        // Default number of threads running queries
+        private const int DEFAULT_READERS = 2;
 
         // load the builtin extensions first
         RegisterExtensionFunc[] builtins = {};
@@ -77,6 +81,11 @@ namespace Zeitgeist
                 "log-file", 0, 0, OptionArg.STRING, out log_file,
                 "File to which the log output will be appended", null
             },
+            {
+                "readers", 0, 0, OptionArg.INT, out num_readers,
+                "Number of threads (each with its own database connection) " +
+                "running queries, or 0 to run them in the main loop", "N"
+            },
             {
                 "shell-completion", 0, OptionFlags.HIDDEN, OptionArg.NONE,
                 out show_options, null, null
@@ -91,6 +100,7 @@ namespace Zeitgeist
         private static bool name_acquired = false;
 
         private Engine engine;
+        private ReaderPool readers;
         private MonitorManager notifications;
 
         private uint log_register_id;
@@ -145,18 +155,39 @@ namespace Zeitgeist
                 histogram_init,
                 storage_monitor_init,
                 fts_init,
-                benchmark_init
+                benchmark_init,
+                retention_init
             };
 #endif
             engine = new Engine.with_builtins (builtins);
+            readers = new ReaderPool (engine, (uint) int.max (num_readers, 0));
             notifications = MonitorManager.get_default ();
+            // Only notify about the events which were actually deleted,
+            // including those deleted by extensions (eg. retention)
+            engine.events_deleted.connect (notifications.notify_delete);
         }
 
         public async Variant get_events (uint32[] event_ids, Cancellable? cancellable,
             BusName? sender=null) throws Error
         {
+            // Let callers see the events they've just inserted
+            engine.commit_pending_insertions ();
             var timer = new Timer ();
-            GenericArray<Event> events = engine.get_events (event_ids);
+            GenericArray<Event?> events = null;
+            EngineError? error = null;
+            yield readers.run ((reader) =>
+                {
+                    try
+                    {
+                        events = reader.get_events (event_ids);
+                    }
+                    catch (EngineError err)
+                    {
+                        error = err;
+                    }
+                });
+            if (error != null)
+                throw error;
             debug ("%s executed in %f seconds: got %i events",
                 GLib.Log.METHOD, timer.elapsed (), events.length);
             return Events.to_variant_with_limit (events);
@@ -168,11 +199,29 @@ namespace Zeitgeist
                 uint storage_state, uint num_events, uint result_type,
                 Cancellable? cancellable, BusName? sender=null) throws Error
         {
-            return engine.find_related_uris (
-                new TimeRange.from_variant (time_range),
-                Events.from_variant (event_templates),
-                Events.from_variant (result_event_templates),
-                storage_state, num_events, result_type);
+            engine.commit_pending_insertions ();
+            var range = new TimeRange.from_variant (time_range);
+            var templates = Events.from_variant (event_templates);
+            var result_templates = Events.from_variant (
+                result_event_templates);
+            string[] uris = null;
+            EngineError? error = null;
+            yield readers.run ((reader) =>
+                {
+                    try
+                    {
+                        uris = reader.find_related_uris (range, templates,
+                            result_templates, storage_state, num_events,
+                            result_type);
+                    }
+                    catch (EngineError err)
+                    {
+                        error = err;
+                    }
+                });
+            if (error != null)
+                throw error;
+            return uris;
         }
 
         public async uint32[] find_event_ids (Variant time_range,
@@ -181,11 +230,26 @@ namespace Zeitgeist
                 Cancellable? cancellable=null,
                 BusName? sender=null) throws Error
         {
+            engine.commit_pending_insertions ();
             var timer = new Timer ();
-            var ids = engine.find_event_ids (
-                new TimeRange.from_variant (time_range),
-                Events.from_variant(event_templates),
-                storage_state, num_events, result_type, sender);
+            var range = new TimeRange.from_variant (time_range);
+            var templates = Events.from_variant (event_templates);
+            uint32[] ids = null;
+            EngineError? error = null;
+            yield readers.run ((reader) =>
+                {
+                    try
+                    {
+                        ids = reader.find_event_ids (range, templates,
+                            storage_state, num_events, result_type, sender);
+                    }
+                    catch (EngineError err)
+                    {
+                        error = err;
+                    }
+                });
+            if (error != null)
+                throw error;
             debug ("%s executed in %f seconds: found %i event ids",
                 GLib.Log.METHOD, timer.elapsed (), ids.length);
             return ids;
@@ -197,11 +261,26 @@ namespace Zeitgeist
                 Cancellable? cancellable=null,
                 BusName? sender=null) throws Error
         {
+            engine.commit_pending_insertions ();
             var timer = new Timer ();
-            var events = engine.find_events (
-                new TimeRange.from_variant (time_range),
-                Events.from_variant (event_templates),
-                storage_state, num_events, result_type, sender);
+            var range = new TimeRange.from_variant (time_range);
+            var templates = Events.from_variant (event_templates);
+            GenericArray<Event?> events = null;
+            EngineError? error = null;
+            yield readers.run ((reader) =>
+                {
+                    try
+                    {
+                        events = reader.find_events (range, templates,
+                            storage_state, num_events, result_type, sender);
+                    }
+                    catch (EngineError err)
+                    {
+                        error = err;
+                    }
+                });
+            if (error != null)
+                throw error;
             debug ("%s executed in %f seconds: found %i events",
                 GLib.Log.METHOD, timer.elapsed (), events.length);
             return Events.to_variant_with_limit (events);
@@ -213,7 +292,9 @@ namespace Zeitgeist
                 BusName? sender=null) throws Error
         {
             var events = Events.from_variant (vevents);
-            uint32[] event_ids = engine.insert_events (events, sender);
+            // Committed together with the events of concurrent calls
+            uint32[] event_ids = yield engine.insert_events_async (events,
+                sender);
             var min_timestamp = int64.MAX;
             var max_timestamp = int64.MIN;
             for (int i = 0; i < events.length; i++)
@@ -236,12 +317,10 @@ namespace Zeitgeist
         public async Variant delete_events (uint32[] event_ids,
             Cancellable? cancellable=null, BusName? sender=null) throws Error
         {
-            TimeRange? time_range = engine.delete_events (event_ids, sender);
-            if (time_range != null)
-            {
-                notifications.notify_delete (time_range, event_ids);
-            }
-            else
+            // Monitors are notified through engine.events_deleted
+            TimeRange? time_range = yield engine.delete_events_async (
+                event_ids, sender);
+            if (time_range == null)
             {
                 // All the given event_ids are invalod or the events
                 // have already been deleted before!
@@ -517,6 +596,7 @@ namespace Zeitgeist
     private extern static Type storage_monitor_init (TypeModule mod);
     private extern static Type fts_init (TypeModule mod);
     private extern static Type benchmark_init (TypeModule mod);
+    private extern static Type retention_init (TypeModule mod);
 #endif
 }
 
@@ -0,0 +1,99 @@
+#! /usr/bin/python
+# -.- coding: utf-8 -.-
+
+# asyncclient-test.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from zeitgeist.datamodel import Event, TimeRange
+
+try:
+	from zeitgeist.asyncclient import AsyncZeitgeistClient, \
+		StopAsyncIteration, asyncio
+except ImportError:
+	asyncio = None
+
+import testutils
+from testutils import parse_events
+
+@unittest.skipIf(asyncio is None, "Neither asyncio nor trollius is available")
+class AsyncClientTest(testutils.RemoteTestCase):
+
+	def setUp(self):
+		super(AsyncClientTest, self).setUp()
+		self.loop = asyncio.new_event_loop()
+		self.async_client = AsyncZeitgeistClient(loop=self.loop)
+	
+	def tearDown(self):
+		self.async_client.close()
+		self.loop.close()
+		super(AsyncClientTest, self).tearDown()
+	
+	def wait(self, future):
+		return self.loop.run_until_complete(
+			asyncio.wait_for(future, 5, loop=self.loop))
+	
+	def testConcurrentRequests(self):
+		events = parse_events("test/data/five_events.js")
+		ids = self.wait(self.async_client.insert_events(events))
+		self.assertEquals(5, len(ids))
+		
+		# Send all requests before waiting for any of them
+		template = Event.new_for_values(actor="firefox")
+		results = self.wait(asyncio.gather(
+			self.async_client.find_event_ids([template]),
+			self.async_client.find_events([template]),
+			self.async_client.get_events(ids[:2] + [1000]),
+			loop=self.loop))
+		self.assertEquals(3, len(results[0]))
+		self.assertEquals(results[0], [int(event.id) for event in results[1]])
+		self.assertEquals(ids[:2], [int(event.id) for event in results[2][:2]])
+		self.assertEquals(None, results[2][2])
+		
+		self.wait(self.async_client.delete_events(ids[:1]))
+		self.assertEquals([None], self.wait(
+			self.async_client.get_events(ids[:1])))
+	
+	def testErrors(self):
+		self.assertRaises(TypeError, self.wait,
+			self.async_client.find_events("not a list"))
+	
+	def testMonitor(self):
+		monitor = self.wait(self.async_client.install_monitor(
+			TimeRange.always(), [Event.new_for_values(actor="firefox")]))
+		events = parse_events("test/data/five_events.js")
+		ids = self.wait(self.async_client.insert_events(events))
+		
+		notification = self.wait(monitor.get())
+		self.assertEquals("insert", notification.kind)
+		self.assertEquals(["firefox"] * 3,
+			[event.actor for event in notification.items])
+		
+		self.wait(self.async_client.delete_events(ids))
+		notification = self.wait(monitor.get())
+		self.assertEquals(("delete", sorted(ids)),
+			(notification.kind, sorted(notification.items)))
+		
+		self.assertTrue(self.wait(self.async_client.remove_monitor(monitor)))
+		self.assertRaises(StopAsyncIteration, self.wait, monitor.get())
+
+if __name__ == "__main__":
+	unittest.main()
+
+# vim:noexpandtab:ts=4:sw=4
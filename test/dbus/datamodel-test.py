@@ -0,0 +1,296 @@
+#! /usr/bin/python
+# -.- coding: utf-8 -.-
+
+# datamodel-test.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from zeitgeist.datamodel import (Event, Subject, Interpretation, Manifestation,
+	CompactEvent, CompactSubject, NULL_EVENT, Symbol, compile_template,
+	compile_templates, filter_events, EventBatch, TimeRange)
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def new_test_event(event_id=""):
+	event = Event.new_for_values(
+		timestamp=1234,
+		interpretation=Interpretation.ACCESS_EVENT,
+		manifestation=Manifestation.USER_ACTIVITY,
+		actor="application://gedit.desktop",
+		subject_uri="file:///tmp/foo.txt",
+		subject_interpretation=Interpretation.TEXT_DOCUMENT,
+		subject_manifestation=Manifestation.FILE_DATA_OBJECT,
+		subject_origin="file:///tmp",
+		subject_mimetype="text/plain",
+		subject_text="foo.txt",
+		subject_storage="local")
+	event[0][Event.Id] = event_id
+	return event
+
+class SymbolTest(unittest.TestCase):
+
+	def testIsChildOf(self):
+		self.assertTrue(Interpretation.TEXT_DOCUMENT.is_child_of(
+			Interpretation.DOCUMENT))
+		self.assertTrue(Interpretation.TEXT_DOCUMENT.is_child_of(
+			Interpretation.TEXT_DOCUMENT))
+		self.assertFalse(Interpretation.DOCUMENT.is_child_of(
+			Interpretation.TEXT_DOCUMENT))
+		self.assertTrue(Symbol.uri_is_child_of(
+			str(Interpretation.SOURCE_CODE), str(Interpretation.DOCUMENT)))
+		self.assertFalse(Symbol.uri_is_child_of(
+			str(Interpretation.DOCUMENT), Interpretation.SOURCE_CODE))
+
+	def testUnknownURIs(self):
+		self.assertTrue(Symbol.uri_is_child_of("foo://bar", "foo://bar"))
+		self.assertFalse(Symbol.uri_is_child_of("foo://bar", "foo://baz"))
+		self.assertFalse(Symbol.uri_is_child_of(
+			str(Interpretation.DOCUMENT), "foo://bar"))
+		self.assertEquals(["foo://bar"],
+			Symbol.find_child_uris_extended("foo://bar"))
+		self.assertRaises(ValueError, Symbol.uri_is_child_of, 1, "foo://bar")
+
+	def testFindChildUrisExtended(self):
+		uris = Symbol.find_child_uris_extended(str(Interpretation.DOCUMENT))
+		self.assertTrue(Interpretation.DOCUMENT in uris)
+		self.assertTrue(Interpretation.SOURCE_CODE in uris)
+		self.assertFalse(Interpretation.IMAGE in uris)
+		self.assertEquals(
+			sorted(Interpretation.DOCUMENT.get_all_children() |
+				set([Interpretation.DOCUMENT])), sorted(uris))
+
+	def testNameLookup(self):
+		self.assertEquals(Interpretation.SOURCE_CODE,
+			Interpretation.DOCUMENT.TEXT_DOCUMENT.SOURCE_CODE)
+		self.assertEquals(Interpretation.SOURCE_CODE.uri,
+			"http://www.semanticdesktop.org/ontologies/2007/03/22/nfo#SourceCode")
+		self.assertFalse(hasattr(Interpretation.DOCUMENT, "IMAGE"))
+		self.assertFalse(hasattr(Interpretation, "FILE_DATA_OBJECT"))
+		self.assertTrue("SOURCE_CODE" in dir(Interpretation.DOCUMENT))
+		self.assertFalse("IMAGE" in dir(Interpretation.DOCUMENT))
+
+	def testNameLookupPrefersClosestSymbol(self):
+		# Both nfo:Attachment and its child ncal:Attachment are named
+		# ATTACHMENT
+		attachment = Manifestation.ATTACHMENT
+		self.assertEquals(
+			"http://www.semanticdesktop.org/ontologies/2007/03/22/nfo#Attachment",
+			attachment.uri)
+		self.assertEquals(
+			"http://www.semanticdesktop.org/ontologies/2007/04/02/ncal#Attachment",
+			attachment.ATTACHMENT.uri)
+		self.assertTrue(attachment in Manifestation.get_all_children())
+
+	def testSymbolCreatedAfterResolving(self):
+		Interpretation.DOCUMENT.get_children()
+		symbol = Symbol("LateSymbol", parent=set([Interpretation.DOCUMENT.uri]),
+			uri="test://late-symbol")
+		self.assertTrue(symbol.is_child_of(Interpretation.DOCUMENT))
+		self.assertTrue(Symbol.uri_is_child_of(symbol, Interpretation.DOCUMENT))
+		self.assertFalse(symbol.is_child_of(Interpretation.AUDIO))
+		self.assertEquals(set([Interpretation.DOCUMENT]), symbol.get_parents())
+		self.assertTrue(symbol in Interpretation.DOCUMENT.get_all_children())
+
+class CompactEventTest(unittest.TestCase):
+
+	def testRoundTrip(self):
+		event = new_test_event("5")
+		compact = CompactEvent(event)
+		self.assertEquals(5, compact.id)
+		self.assertEquals(1234, compact.timestamp)
+		self.assertEquals(Interpretation.ACCESS_EVENT, compact.interpretation)
+		self.assertEquals("file:///tmp/foo.txt", compact.subjects[0].uri)
+		self.assertEquals(event, compact.to_event())
+
+	def testNewForStructs(self):
+		structs = [new_test_event("1"), NULL_EVENT, new_test_event("2")]
+		events = CompactEvent.new_for_structs(structs)
+		self.assertEquals(3, len(events))
+		self.assertEquals(None, events[1])
+		self.assertEquals([1, 2], [events[0].id, events[2].id])
+		# Identical subjects share their data
+		self.assertTrue(events[0].subjects[0]._data is
+			events[2].subjects[0]._data)
+
+	def testSetters(self):
+		compact = CompactEvent(new_test_event("1"))
+		compact.timestamp = "42"
+		compact.actor = u"application://eog.desktop"
+		compact.payload = [1, 2, 3]
+		compact.subjects[0].text = "bar.txt"
+		self.assertEquals(42, compact.timestamp)
+		self.assertEquals("application://eog.desktop", compact.actor)
+		self.assertEquals("\x01\x02\x03", compact.payload)
+		self.assertEquals("bar.txt", compact.subjects[0].text)
+		self.assertRaises(AttributeError, setattr, compact, "foo", 1)
+
+	def testNewForValues(self):
+		compact = CompactEvent.new_for_values(actor="application://x.desktop",
+			subject_uri="file:///foo")
+		self.assertTrue(isinstance(compact.subjects[0], CompactSubject))
+		self.assertEquals("file:///foo", compact.subjects[0].uri)
+
+	def testMatchesTemplate(self):
+		event = new_test_event("7")
+		compact = CompactEvent(event)
+		templates = [
+			Event.new_for_values(interpretation=Interpretation.EVENT_INTERPRETATION),
+			Event.new_for_values(subject_interpretation=Interpretation.DOCUMENT),
+			Event.new_for_values(subject_uri="file:///tmp/*"),
+			Event.new_for_values(actor="!application://eog.desktop"),
+			Event.new_for_values(subject_mimetype="image/png"),
+			Event.new_for_values(interpretation=Interpretation.LEAVE_EVENT),
+		]
+		id_template = Event()
+		id_template[0][Event.Id] = "7"
+		templates.append(id_template)
+		for template in templates:
+			self.assertEquals(event.matches_template(template),
+				compact.matches_template(template))
+
+	def testMatchesTemplateStorage(self):
+		compact = CompactEvent(new_test_event())
+		template = Event.new_for_values(subject_storage="local")
+		self.assertRaises(ValueError, compact.matches_template, template)
+
+class CompiledTemplateTest(unittest.TestCase):
+
+	def setUp(self):
+		self.event = new_test_event("3")
+		self.templates = [
+			Event.new_for_values(interpretation=Interpretation.EVENT_INTERPRETATION),
+			Event.new_for_values(interpretation="!" + Interpretation.ACCESS_EVENT),
+			Event.new_for_values(actor="application://ge*"),
+			Event.new_for_values(actor="!application://ge*"),
+			Event.new_for_values(subject_uri="file:///tmp/*",
+				subject_interpretation=Interpretation.DOCUMENT),
+			Event.new_for_values(subject_mimetype="!text/plain"),
+			Event.new_for_values(subjects=[
+				Subject.new_for_values(uri="file:///foo"),
+				Subject.new_for_values(text="foo.txt")]),
+			Event.new_for_values(subject_manifestation="foo://bar"),
+		]
+
+	def testSameResultAsMatchesTemplate(self):
+		compact = CompactEvent(self.event)
+		for template in self.templates:
+			predicate = compile_template(template)
+			expected = self.event.matches_template(template)
+			self.assertEquals(expected, predicate(self.event))
+			self.assertEquals(expected, predicate(compact))
+
+	def testEventId(self):
+		template = Event()
+		template[0][Event.Id] = "3"
+		self.assertTrue(compile_template(template)(self.event))
+		self.assertTrue(compile_template(template)(CompactEvent(self.event)))
+		template[0][Event.Id] = "4"
+		self.assertFalse(compile_template(template)(self.event))
+
+	def testNoExpand(self):
+		# Like FindEventIds, "+" matches the symbol but not its children,
+		# in compiled templates as well as in Event.matches_template
+		template = Event.new_for_values(
+			interpretation="+" + self.event.interpretation)
+		self.assertTrue(compile_template(template)(self.event))
+		self.assertTrue(self.event.matches_template(template))
+		template.interpretation = "+" + Interpretation.EVENT_INTERPRETATION
+		self.assertFalse(compile_template(template)(self.event))
+		self.assertFalse(self.event.matches_template(template))
+		template.interpretation = "!+" + Interpretation.EVENT_INTERPRETATION
+		self.assertTrue(compile_template(template)(self.event))
+		self.assertTrue(self.event.matches_template(template))
+
+	def testStorageNotSupported(self):
+		template = Event.new_for_values(subject_storage="local")
+		self.assertRaises(ValueError, compile_template, template)
+
+	def testCompileTemplates(self):
+		self.assertTrue(compile_templates([])(self.event))
+		self.assertTrue(compile_templates(self.templates)(self.event))
+		self.assertFalse(compile_templates(self.templates[5:6])(self.event))
+
+	def testFilterEvents(self):
+		other = new_test_event("4")
+		other.actor = "application://eog.desktop"
+		events = [self.event, None, other]
+		self.assertEquals([self.event, other], filter_events(events, []))
+		self.assertEquals([other], filter_events(events, self.templates[3:4]))
+		predicate = compile_templates(self.templates[2:3])
+		self.assertEquals([self.event], filter_events(events, predicate))
+
+@unittest.skipIf(numpy is None, "NumPy is not available")
+class EventBatchTest(unittest.TestCase):
+
+	def setUp(self):
+		self.events = []
+		for i, actor in enumerate(("gedit", "eog", "gedit", "totem")):
+			event = new_test_event(str(i + 1))
+			event.timestamp = str(1000 + i)
+			event.actor = "application://%s.desktop" % actor
+			self.events.append(event)
+		self.events[1].subjects[0].interpretation = Interpretation.IMAGE
+		self.events[1].subjects[0].mimetype = "image/png"
+		self.events[2].append_subject(Subject.new_for_values(
+			uri="http://example.com", interpretation=Interpretation.WEBSITE))
+		self.events[3].subjects = []
+		self.events[3].payload = "payload"
+		self.batch = EventBatch(self.events + [None])
+
+	def testRoundTrip(self):
+		self.assertEquals(4, len(self.batch))
+		self.assertEquals(self.events, self.batch.to_events())
+		self.assertEquals(self.events[2], self.batch[2])
+		self.assertEquals(self.events[3], self.batch[-1])
+		self.assertEquals([CompactEvent(event) for event in self.events],
+			list(self.batch.iter_events(CompactEvent)))
+
+	def testTimeRangeMask(self):
+		mask = self.batch.time_range_mask(TimeRange(1001, 1002))
+		self.assertEquals([False, True, True, False], list(mask))
+
+	def testTemplateMask(self):
+		templates = [
+			[Event.new_for_values(actor="application://ge*")],
+			[Event.new_for_values(subject_interpretation=Interpretation.DOCUMENT)],
+			[Event.new_for_values(subject_uri="!file:///tmp/foo.txt")],
+			[Event.new_for_values(actor="application://eog.desktop"),
+				Event.new_for_values(subject_mimetype="text/*")],
+			[],
+		]
+		for template in templates:
+			self.assertEquals(
+				[bool(filter_events([event], template)) for event in self.events],
+				list(self.batch.template_mask(template)))
+
+	def testFilterAndCount(self):
+		mask = self.batch.template_mask([Event.new_for_values(
+			actor="!application://totem.desktop")])
+		filtered = self.batch.filter(mask)
+		self.assertEquals(self.events[:3], filtered.to_events())
+		self.assertEquals({"application://gedit.desktop": 2,
+			"application://eog.desktop": 1}, filtered.count_by("actor"))
+		self.assertEquals({"text/plain": 1, "": 1},
+			self.batch.count_by("subject_mimetype",
+				self.batch.time_range_mask(TimeRange(1002, 1003))))
+
+if __name__ == "__main__":
+	unittest.main()
+
+# vim:noexpandtab:ts=4:sw=4
@@ -0,0 +1,122 @@
+#! /usr/bin/python
+# -.- coding: utf-8 -.-
+
+# dbreader-test.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from zeitgeist.client import ZeitgeistClient
+from zeitgeist.datamodel import (Event, Subject, Interpretation, ResultType,
+	StorageState, TimeRange)
+from zeitgeist.dbreader import DbReader, DirectReadUnavailable
+
+import testutils
+from testutils import parse_events
+
+class DbReaderTest(testutils.RemoteTestCase):
+	"""
+	Compares the results of queries answered by reading the database
+	directly with those of the engine.
+	"""
+	
+	def setUp(self):
+		self.database_dir = tempfile.mkdtemp(prefix="zeitgeist.dbreader.")
+		super(DbReaderTest, self).setUp(
+			database_path=os.path.join(self.database_dir, "activity.sqlite"))
+		self.insertEventsAndWait(parse_events("test/data/five_events.js"))
+		self.direct_client = ZeitgeistClient(direct_read=True)
+		self.engine_client = self.client
+		self.client = self.direct_client
+	
+	def tearDown(self):
+		self.client = self.direct_client
+		super(DbReaderTest, self).tearDown()
+		shutil.rmtree(self.database_dir)
+	
+	def assertSameResults(self, method, *args, **kwargs):
+		self.client = self.engine_client
+		expected = method(*args, **kwargs)
+		self.client = self.direct_client
+		self.assertEquals(expected, method(*args, **kwargs))
+		return expected
+	
+	def testDirectRead(self):
+		self.assertTrue(isinstance(self.client._get_db_reader(), DbReader))
+		self.assertEquals(None, self.engine_client._get_db_reader())
+	
+	def testFindEventIds(self):
+		templates = [
+			[],
+			[Event.new_for_values(actor="firefox")],
+			[Event.new_for_values(actor="!firefox")],
+			[Event.new_for_values(actor="ge*")],
+			[Event.new_for_values(subject_uri="http://*")],
+			[Event.new_for_values(subject_interpretation=Interpretation.DOCUMENT)],
+			[Event.new_for_values(actor="gedit"),
+				Event.new_for_values(subject_mimetype="!text/*")],
+			[Event.new_for_values(subjects=[
+				Subject.new_for_values(uri="!http://*"),
+				Subject.new_for_values(text="!foo")])],
+		]
+		for template in templates:
+			for result_type in (ResultType.MostRecentEvents,
+					ResultType.LeastRecentEvents,
+					ResultType.MostPopularActor,
+					ResultType.LeastRecentSubjects,
+					ResultType.OldestActor):
+				self.assertSameResults(self.findEventIdsAndWait, template,
+					timerange=TimeRange.always(), num_events=0,
+					result_type=result_type)
+		ids = self.assertSameResults(self.findEventIdsAndWait, [],
+			timerange=TimeRange(130, 160), num_events=2,
+			storage_state=StorageState.Available)
+		self.assertTrue(0 < len(ids) <= 2)
+	
+	def testGetEvents(self):
+		ids = self.findEventIdsAndWait([], num_events=0)
+		events = self.assertSameResults(self.getEventsAndWait,
+			ids[:3] + [1000] + ids[:1])
+		self.assertEquals(None, events[3])
+		self.assertSameResults(self.findEventsForTemplatesAndWait,
+			[Event.new_for_values(actor="firefox")], num_events=2)
+	
+	def testFallback(self):
+		reader = self.client._get_db_reader()
+		self.assertRaises(DirectReadUnavailable, reader.find_event_ids,
+			TimeRange.always(), [Event.new_for_values(interpretation="foo*")],
+			StorageState.Any, 0, ResultType.MostRecentEvents)
+		
+		# The engine reports the error
+		mainloop = self.create_mainloop()
+		errors = []
+		def error_handler(error):
+			errors.append(error)
+			mainloop.quit()
+		self.client.find_event_ids_for_templates(
+			[Event.new_for_values(interpretation="foo*")], mainloop.fail,
+			error_handler=error_handler)
+		mainloop.run()
+		self.assertEquals(1, len(errors))
+
+if __name__ == "__main__":
+	unittest.main()
+
+# vim:noexpandtab:ts=4:sw=4
@@ -85,6 +85,38 @@ class ZeitgeistEngineTest(testutils.RemoteTestCase):
 		self.assertEquals(1, len(result))
 		self.assertEquals(1, result[0]) # The single event must have id 1
 
+	def testConcurrentInsertions(self):
+		# Calls made at the same time are committed together, but each
+		# of them gets its own result
+		calls = [[new_event(timestamp=i * 10 + j,
+			subject_uri="file:///tmp/%d/%d" % (i, j)) for j in xrange(3)]
+			for i in xrange(5)]
+		# Events with two subjects with the same URI make the call fail
+		bad_event = new_event(timestamp=100, subject_uri="file:///tmp/bad")
+		bad_event.append_subject(bad_event.subjects[0])
+		calls[2].append(bad_event)
+
+		mainloop = self.create_mainloop()
+		results = {}
+		def make_handlers(n):
+			def reply_handler(ids):
+				results[n] = list(ids)
+				if len(results) == len(calls):
+					mainloop.quit()
+			def error_handler(error):
+				reply_handler(None)
+			return reply_handler, error_handler
+		for n, events in enumerate(calls):
+			reply_handler, error_handler = make_handlers(n)
+			self.client.insert_events(events, reply_handler, error_handler)
+		mainloop.run()
+
+		self.assertEquals(None, results.pop(2))
+		ids = sum(results.values(), [])
+		self.assertEquals(12, len(set(ids)))
+		self.assertTrue(0 not in ids)
+		self.assertEquals(sorted(ids), sorted(self.findEventIdsAndWait([])))
+
 	def testDeleteSingle(self):
 		self.testSingleInsertGet()
 		self.deleteEventsAndWait([1])
@@ -425,6 +457,34 @@ class ZeitgeistEngineTest(testutils.RemoteTestCase):
 		self.assertEquals(event.payload, result.payload)
 		self.assertEventsEqual(event, result)
 
+	def testEventsWithSharedPayload(self):
+		events = [new_event(timestamp=i, subject_uri="file:///tmp/%d" % i)
+			for i in xrange(1, 4)]
+		events[0].payload = events[1].payload = "shared payload"
+		events[2].payload = "other payload"
+
+		ids = self.insertEventsAndWait(events)
+		result = self.getEventsAndWait(ids)
+		payloads = ["".join(chr(x) for x in event.payload)
+			for event in result]
+		self.assertEquals(
+			["shared payload", "shared payload", "other payload"], payloads)
+
+		# The payload must survive as long as some event uses it
+		self.deleteEventsAndWait(ids[:1])
+		result = self.getEventsAndWait(ids[1:])
+		payloads = ["".join(chr(x) for x in event.payload)
+			for event in result]
+		self.assertEquals(["shared payload", "other payload"], payloads)
+
+		# Inserting it again after it was deleted works as well
+		self.deleteEventsAndWait(ids[1:2])
+		event = new_event(timestamp=4, subject_uri="file:///tmp/4")
+		event.payload = "shared payload"
+		result = self.getEventsAndWait(self.insertEventsAndWait([event]))
+		self.assertEquals("shared payload",
+			"".join(chr(x) for x in result[0].payload))
+
 	def testQueryByParent(self):
 		ev = new_event(subject_interpretation=Interpretation.AUDIO)
 		_ids = self.insertEventsAndWait([ev])
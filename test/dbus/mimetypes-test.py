@@ -0,0 +1,84 @@
+#! /usr/bin/python
+# -.- coding: utf-8 -.-
+
+# mimetypes-test.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from zeitgeist.datamodel import Event, Subject, Interpretation, Manifestation
+from zeitgeist.mimetypes import get_interpretation_for_mimetype, \
+	get_manifestation_for_uri, classify_events, MIMES, MIMES_REGEX, SCHEMES
+
+class MimetypesTest(unittest.TestCase):
+	
+	def testInterpretationForMimetype(self):
+		for mimetype, interpretation in MIMES.iteritems():
+			self.assertEquals(interpretation,
+				get_interpretation_for_mimetype(mimetype))
+		# The first matching pattern wins, also when looked up again
+		for i in xrange(2):
+			self.assertEquals(Interpretation.PRESENTATION,
+				get_interpretation_for_mimetype(
+					"application/vnd.oasis.opendocument.presentation-template"))
+			self.assertEquals(Interpretation.DOCUMENT,
+				get_interpretation_for_mimetype("application/vnd.foo"))
+			self.assertEquals(Interpretation.IMAGE,
+				get_interpretation_for_mimetype("image/x-foo"))
+			self.assertEquals(None, get_interpretation_for_mimetype("foo/bar"))
+		
+		# Same result as trying the patterns one by one
+		for mimetype in ("application/vnd.ms-excel.sheet.12",
+				"application/x-applix-foo", "application/x-dvi", "audio/ogg",
+				"video/ogg", "imagefoo"):
+			expected = None
+			for pattern, interpretation in MIMES_REGEX:
+				if pattern.match(mimetype):
+					expected = interpretation
+					break
+			self.assertEquals(expected,
+				get_interpretation_for_mimetype(mimetype))
+	
+	def testManifestationForUri(self):
+		for scheme, manifestation in SCHEMES:
+			self.assertEquals(manifestation,
+				get_manifestation_for_uri(scheme + "foo/bar"))
+		self.assertEquals(None, get_manifestation_for_uri("dav:/"))
+		self.assertEquals(None, get_manifestation_for_uri("application://x"))
+		self.assertEquals(None, get_manifestation_for_uri(""))
+	
+	def testClassifyEvents(self):
+		event = Event.new_for_values(subjects=[
+			Subject.new_for_values(uri="file:///tmp/foo.png",
+				mimetype="image/png"),
+			Subject.new_for_values(uri="https://example.org",
+				mimetype="image/x-foo",
+				interpretation=Interpretation.WEBSITE),
+			Subject.new_for_values(uri="foo://bar", mimetype="foo/bar")])
+		classify_events([event])
+		self.assertEquals(
+			[Interpretation.RASTER_IMAGE, Interpretation.WEBSITE, ""],
+			[subject.interpretation for subject in event.subjects])
+		self.assertEquals(
+			[Manifestation.FILE_DATA_OBJECT, Manifestation.WEB_DATA_OBJECT, ""],
+			[subject.manifestation for subject in event.subjects])
+
+if __name__ == "__main__":
+	unittest.main()
+
+# vim:noexpandtab:ts=4:sw=4
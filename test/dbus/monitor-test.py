@@ -41,6 +41,7 @@ from dbus.mainloop.glib import DBusGMainLoop
 DBusGMainLoop(set_as_default=True)
 from dbus.exceptions import DBusException
 
+from zeitgeist.client import ZeitgeistClient
 from zeitgeist.datamodel import (Event, Subject, Interpretation, Manifestation,
 	TimeRange, StorageState, DataSource, NULL_EVENT, ResultType)
 
@@ -286,6 +287,94 @@ class ZeitgeistMonitorTest(testutils.RemoteTestCase):
 		self.assertEquals(1, len(result))
 		self.assertEquals(1, result.pop())
 
+	def testMonitorCoalescing(self):
+		result = []
+		mainloop = self.create_mainloop()
+		events = parse_events("test/data/five_events.js")
+		
+		@asyncTestMethod(mainloop)
+		def notify_insert_handler(time_range, events):
+			result.append(events)
+			mainloop.quit()
+		
+		@asyncTestMethod(mainloop)
+		def notify_delete_handler(time_range, event_ids):
+			mainloop.quit()
+			self.fail("Unexpected delete notification")
+		
+		self.client.install_monitor(TimeRange.always(), [],
+			notify_insert_handler, notify_delete_handler,
+			coalesce_latency=1000)
+		
+		# The first two events are deleted before the batch is passed on
+		self.client.insert_events(events[:2],
+			ids_reply_handler=self.client.delete_events)
+		for event in events[2:]:
+			self.client.insert_events([event])
+		mainloop.run()
+		
+		self.assertEquals(1, len(result))
+		self.assertEquals([133, 153, 163],
+			sorted(int(event.timestamp) for event in result[0]))
+
+	def testMonitorCoalescingMaxEvents(self):
+		result = []
+		mainloop = self.create_mainloop()
+		events = parse_events("test/data/five_events.js")
+		
+		@asyncTestMethod(mainloop)
+		def notify_insert_handler(time_range, events):
+			result.append(len(events))
+			if sum(result) == 5:
+				mainloop.quit()
+		
+		monitor = self.client.install_monitor(TimeRange.always(), [],
+			notify_insert_handler, lambda *args: None,
+			coalesce_latency=60000, coalesce_max_events=2)
+		for event in events:
+			self.client.insert_events([event])
+		
+		# The last event waits for the latency to pass, or a flush
+		gobject.timeout_add(500, monitor.flush)
+		mainloop.run()
+		
+		self.assertEquals([2, 2, 1], result)
+
+	def testMultiplexedMonitors(self):
+		result = {}
+		mainloop = self.create_mainloop()
+		client = ZeitgeistClient(multiplex_monitors=True)
+		events = parse_events("test/data/five_events.js")
+		
+		def install_monitor(name, time_range, templates):
+			@asyncTestMethod(mainloop)
+			def notify_insert_handler(time_range, events):
+				result.setdefault(name, []).extend(
+					int(event.timestamp) for event in events)
+				if sum(map(len, result.values())) == 7:
+					mainloop.quit()
+			return client.install_monitor(time_range, templates,
+				notify_insert_handler, lambda *args: None)
+		
+		install_monitor("actor", TimeRange.always(),
+			[Event.new_for_values(actor="firefox")])
+		install_monitor("interpretation", TimeRange.always(),
+			[Event.new_for_values(interpretation="stfu:OpenEvent")])
+		install_monitor("time range", TimeRange(125, 145), [])
+		removed = install_monitor("removed", TimeRange.always(), [])
+		client.remove_monitor(removed)
+		
+		# Give the client a chance to install the multiplexed monitor
+		gobject.idle_add(lambda: self.client.insert_events(events) and False)
+		mainloop.run()
+		
+		self.assertEquals({
+			"actor": [123, 153, 163],
+			"interpretation": [123, 163],
+			"time range": [133, 143],
+		}, dict((name, sorted(timestamps))
+			for name, timestamps in result.iteritems()))
+
 	def testMonitorReconnection(self):
 		result = []
 		mainloop = self.create_mainloop()
@@ -24,8 +24,17 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import json
+import shutil
 import signal
+import tempfile
+import dbus
+import gobject
 
+from zeitgeist.client import ZeitgeistClient, ZeitgeistDBusInterface, \
+	PRIORITY_BULK, get_bus, _DBusInterface, _IntrospectionCache, \
+	_introspection_cache
 from zeitgeist.datamodel import (Event, Subject, Interpretation, Manifestation,
 	TimeRange, StorageState, DataSource, NULL_EVENT, ResultType)
 
@@ -59,6 +68,271 @@ class ZeitgeistRemoteAPITest(testutils.RemoteTestCase):
 		self.assertEquals(len(filter(None, result)), len(events))
 		self.assertEquals(len(filter(lambda event: event is None, result)), 2)
 
+	def testIterEvents(self):
+		events = parse_events("test/data/five_events.js")
+		ids = self.insertEventsAndWait(events)
+		expected = self.findEventsForTemplatesAndWait([], num_events=0)
+		self.assertEquals(len(ids), len(expected))
+		
+		# Small chunks, so more than one GetEvents call is in flight
+		result = list(self.client.iter_events([], chunk_size=1,
+			max_chunk_size=2, prefetch=2))
+		self.assertEquals([event.id for event in expected],
+			[event.id for event in result])
+		
+		result = list(self.client.iter_events([], num_events=2))
+		self.assertEquals([event.id for event in expected[:2]],
+			[event.id for event in result])
+
+	def testEventCache(self):
+		self.client = ZeitgeistClient(event_cache_size=3)
+		events = parse_events("test/data/five_events.js")
+		ids = self.insertEventsAndWait(events)
+		
+		# Wait until the monitor used to invalidate the cache is installed
+		context = gobject.main_context_default()
+		while not self.client._cache_active:
+			context.iteration(True)
+		
+		first = self.getEventsAndWait(ids[:2])
+		second = self.getEventsAndWait(ids[:2] + [1000])
+		self.assertEquals(first + [None], second)
+		stats = self.client.event_cache.get_stats()
+		self.assertEquals((2, 3, 2), (stats["hits"], stats["misses"],
+			stats["entries"]))
+		
+		# The least recently used event is evicted
+		self.getEventsAndWait(ids[2:4])
+		self.assertEquals(3, len(self.client.event_cache))
+		self.assertFalse(ids[0] in self.client.event_cache)
+		
+		# Deleted events are removed from the cache
+		self.deleteEventsAndWait([ids[1]])
+		self.assertFalse(ids[1] in self.client.event_cache)
+		self.assertEquals([None], self.getEventsAndWait([ids[1]]))
+
+	def testQueryCache(self):
+		self.client = ZeitgeistClient(query_cache_size=10)
+		events = parse_events("test/data/five_events.js")
+		ids = self.insertEventsAndWait(events[:4])
+		context = gobject.main_context_default()
+		while not self.client._cache_active:
+			context.iteration(True)
+		
+		template = Event.new_for_values(actor=events[4].actor)
+		other_template = Event.new_for_values(
+			actor="!" + events[4].actor)
+		first = self.findEventIdsAndWait([template])
+		self.assertEquals(first, self.findEventIdsAndWait([template]))
+		self.findEventIdsAndWait([other_template])
+		stats = self.client.query_cache.get_stats()
+		self.assertEquals((1, 2), (stats["hits"], stats["misses"]))
+		
+		# Inserting an event matching only one of the queries evicts it
+		new_id = self.insertEventsAndWait(events[4:])[0]
+		while len(self.client.query_cache) == 2:
+			context.iteration(True)
+		self.assertEquals(sorted(first + [new_id]),
+			sorted(self.findEventIdsAndWait([template])))
+		
+		# Deletions evict all queries in the time range
+		self.deleteEventsAndWait([new_id])
+		while len(self.client.query_cache):
+			context.iteration(True)
+		self.assertEquals(sorted(first),
+			sorted(self.findEventIdsAndWait([template])))
+		
+		# Queries using the no-expand operator are evicted as well
+		noexpand_template = Event.new_for_values(
+			interpretation="+" + events[4].interpretation)
+		self.findEventIdsAndWait([noexpand_template])
+		new_id = self.insertEventsAndWait(events[4:])[0]
+		while len(self.client.query_cache):
+			context.iteration(True)
+		self.assertTrue(new_id in
+			self.findEventIdsAndWait([noexpand_template]))
+		
+		# Move events may change any result
+		self.findEventIdsAndWait([template])
+		move_event = Event.new_for_values(
+			interpretation=Interpretation.MOVE_EVENT,
+			manifestation=Manifestation.USER_ACTIVITY,
+			actor="application://nautilus.desktop",
+			subject_uri="file:///tmp/moved-from",
+			subject_current_uri="file:///tmp/moved-to")
+		self.insertEventsAndWait([move_event])
+		while len(self.client.query_cache):
+			context.iteration(True)
+
+	def testInsertQueue(self):
+		self.client = ZeitgeistClient(insert_batch_size=3,
+			insert_latency=10000)
+		events = parse_events("test/data/five_events.js")
+		mainloop = self.create_mainloop()
+		result = {}
+		
+		def ids_reply_handler(index):
+			def handler(ids):
+				result[index] = list(ids)
+				if len(result) == len(events):
+					mainloop.quit()
+			return handler
+		
+		for index, event in enumerate(events):
+			self.client.insert_event(event,
+				ids_reply_handler=ids_reply_handler(index))
+		# The first three events are sent right away, the last two
+		# would wait for the latency to expire
+		self.client.flush_inserts()
+		mainloop.run()
+		
+		ids = [result[index][0] for index in xrange(len(events))]
+		self.assertEquals(len(events), len(set(ids)))
+		self.assertEquals([event.actor for event in events],
+			[event.actor for event in self.getEventsAndWait(ids)])
+
+	def testInsertQueueWithInvalidEvent(self):
+		self.client = ZeitgeistClient(insert_batch_size=3,
+			insert_latency=10000)
+		events = parse_events("test/data/five_events.js")[:3]
+		events[1].actor = ""
+		mainloop = self.create_mainloop()
+		result = {}
+		
+		def handlers(index):
+			def reply_handler(ids):
+				result[index] = list(ids)
+				if len(result) == len(events):
+					mainloop.quit()
+			def error_handler(error):
+				result[index] = error
+				if len(result) == len(events):
+					mainloop.quit()
+			return reply_handler, error_handler
+		
+		for index, event in enumerate(events):
+			reply_handler, error_handler = handlers(index)
+			self.client.insert_event(event, ids_reply_handler=reply_handler,
+				error_handler=error_handler)
+		mainloop.run()
+		
+		# Only the request with the invalid event fails
+		self.assertTrue(isinstance(result[1], dbus.exceptions.DBusException))
+		self.assertEquals([events[0].actor, events[2].actor],
+			[event.actor for event in
+				self.getEventsAndWait([result[0][0], result[2][0]])])
+
+	def testRequestLimit(self):
+		ids = import_events("test/data/five_events.js", self)
+		self.client.set_request_limit(1)
+		mainloop = self.create_mainloop()
+		replies = []
+		
+		def reply_handler(name):
+			def handler(*args):
+				replies.append(name)
+				if len(replies) == 3:
+					mainloop.quit()
+			return handler
+		
+		iface = self.client._iface
+		iface.GetEvents(ids, reply_handler=reply_handler("first"),
+			error_handler=mainloop.fail)
+		iface.GetEvents(ids, reply_handler=reply_handler("bulk"),
+			error_handler=mainloop.fail, priority=PRIORITY_BULK)
+		iface.GetEvents(ids, reply_handler=reply_handler("interactive"),
+			error_handler=mainloop.fail)
+		mainloop.run()
+		
+		self.assertEquals(["first", "interactive", "bulk"], replies)
+		stats = self.client.get_request_stats()
+		self.assertEquals((0, 0, 2, 3, 2), (stats["in_flight"],
+			stats["queue_depth"], stats["max_queue_depth"],
+			stats["dispatched"], stats["delayed"]))
+		
+		# Synchronous calls are never delayed
+		self.assertEquals(len(ids), len(iface.GetEvents(ids)))
+		self.client.set_request_limit(None)
+
+	def testInstrumentation(self):
+		self.assertEquals(None, self.client.get_instrumentation_stats())
+		self.client.set_instrumentation(True)
+		ids = self.insertEventsAndWait(parse_events("test/data/five_events.js"))
+		self.getEventsAndWait(ids)
+		
+		# Errors are counted for synchronous calls too
+		iface = self.client._iface
+		self.assertRaises(dbus.exceptions.DBusException, iface.FindEventIds,
+			TimeRange.always(), [], StorageState.Any, 0, 1000)
+		
+		stats = self.client.get_instrumentation_stats(reset=True)
+		methods = stats["methods"]
+		self.assertEquals(["FindEventIds", "GetEvents", "InsertEvents"],
+			sorted(methods))
+		for name in methods:
+			self.assertEquals(1, methods[name]["calls"])
+			self.assertEquals(0, methods[name]["in_flight"])
+			self.assertEquals(1, sum(count for bound, count in
+				methods[name]["histogram"]))
+		self.assertEquals(1, methods["FindEventIds"]["errors"])
+		self.assertEquals(0, methods["GetEvents"]["errors"])
+		self.assertTrue(methods["GetEvents"]["reply_bytes"] >
+			methods["GetEvents"]["request_bytes"])
+		
+		stats = self.client.get_instrumentation_stats()
+		self.assertEquals(0, stats["methods"]["GetEvents"]["calls"])
+		self.client.set_instrumentation(False)
+		self.assertEquals(None, self.client.get_instrumentation_stats())
+
+	def testIntrospectionCache(self):
+		cache_home = tempfile.mkdtemp(prefix="zeitgeist.cache.")
+		old_cache_home = os.environ.get("XDG_CACHE_HOME")
+		os.environ["XDG_CACHE_HOME"] = cache_home
+		
+		def get_interface():
+			_introspection_cache.invalidate()
+			proxy = get_bus().get_object(ZeitgeistDBusInterface.BUS_NAME,
+				ZeitgeistDBusInterface.OBJECT_PATH)
+			return _DBusInterface(proxy, ZeitgeistDBusInterface.INTERFACE_NAME,
+				ZeitgeistDBusInterface.OBJECT_PATH, reconnect=False)
+		
+		try:
+			iface = get_interface()
+			self.assertFalse(iface._members_cached)
+			path = _IntrospectionCache.get_path()
+			self.assertTrue(os.path.exists(path))
+			
+			iface = get_interface()
+			self.assertTrue(iface._members_cached)
+			self.assertEquals([], iface.FindEventIds(TimeRange.always(), [],
+				StorageState.Any, 0, 0))
+			self.assertRaises(TypeError, getattr, iface, "NoSuchMethod")
+			
+			# Outdated tables are refreshed when an unknown method is used
+			data = json.load(open(path))
+			for methods, signals, signatures in data["tables"].itervalues():
+				methods.remove("FindEventIds")
+			json.dump(data, open(path, "w"))
+			iface = get_interface()
+			self.assertTrue(iface._members_cached)
+			self.assertEquals([], iface.FindEventIds(TimeRange.always(), [],
+				StorageState.Any, 0, 0))
+			self.assertFalse(iface._members_cached)
+			
+			# Tables written for another engine are ignored
+			data["key"][0] = [0, 0, 0]
+			json.dump(data, open(path, "w"))
+			iface = get_interface()
+			self.assertFalse(iface._members_cached)
+			self.assertNotEquals([0, 0, 0], json.load(open(path))["key"][0])
+		finally:
+			if old_cache_home is None:
+				del os.environ["XDG_CACHE_HOME"]
+			else:
+				os.environ["XDG_CACHE_HOME"] = old_cache_home
+			_introspection_cache.invalidate()
+			shutil.rmtree(cache_home)
+
 	def testInsertAndDeleteEvent(self):
 		# Insert an event
 		events = parse_events("test/data/single_event.js")
@@ -0,0 +1,107 @@
+#! /usr/bin/python
+# -.- coding: utf-8 -.-
+
+# retention-test.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Update python path to use local zeitgeist module
+import sys
+import os
+import time
+import unittest
+import gobject
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from zeitgeist.datamodel import *
+from testutils import RemoteTestCase
+
+DAY = 24 * 60 * 60 * 1000
+
+class RetentionTest(RemoteTestCase):
+
+	def __init__(self, methodName):
+		super(RetentionTest, self).__init__(methodName)
+		self.retention = None
+
+	def setUp(self):
+		# lazy import to get a chance to use the private bus
+		import dbus
+
+		# We set up the connection lazily in order to wait for the
+		# engine to come up
+		super(RetentionTest, self).setUp()
+		obj = dbus.SessionBus().get_object("org.gnome.zeitgeist.Engine",
+			"/org/gnome/zeitgeist/retention")
+		self.retention = dbus.Interface(obj, "org.gnome.zeitgeist.Retention")
+
+	def _wait(self, seconds):
+		mainloop = self.create_mainloop(None)
+		gobject.timeout_add(int(seconds * 1000), mainloop.quit)
+		mainloop.run()
+
+	def testAddAndRemovePolicies(self):
+		template = Event.new_for_values(actor="application://gedit.desktop")
+		self.retention.AddPolicy("gedit", template, 30 * DAY)
+		self.retention.AddPolicy("all", Event(), 365 * DAY)
+
+		policies = self.retention.GetPolicies()
+		self.assertEquals(len(policies), 2)
+		self.assertEventsEqual(template, Event(policies["gedit"][0]))
+		self.assertEquals(policies["gedit"][1], 30 * DAY)
+		self.assertEquals(policies["all"][1], 365 * DAY)
+
+		# Adding a policy with an existing ID replaces it
+		self.retention.AddPolicy("gedit", template, 7 * DAY)
+		policies = self.retention.GetPolicies()
+		self.assertEquals(len(policies), 2)
+		self.assertEquals(policies["gedit"][1], 7 * DAY)
+
+		self.retention.RemovePolicy("gedit")
+		self.assertEquals(self.retention.GetPolicies().keys(), ["all"])
+
+	def testInvalidMaxAge(self):
+		import dbus
+		self.assertRaises(dbus.DBusException, self.retention.AddPolicy,
+			"invalid", Event(), 0)
+		self.assertEquals(len(self.retention.GetPolicies()), 0)
+
+	def testExpiry(self):
+		now = int(time.time() * 1000)
+		events = []
+		for timestamp in (100, 200, now - 2 * DAY, now - DAY / 2, now):
+			events.append(Event.new_for_values(timestamp=timestamp,
+				interpretation=Interpretation.ACCESS_EVENT,
+				manifestation=Manifestation.USER_ACTIVITY,
+				actor="application://gedit.desktop",
+				subject_uri="file:///tmp/%d" % timestamp))
+		events.append(Event.new_for_values(timestamp=100,
+			interpretation=Interpretation.ACCESS_EVENT,
+			manifestation=Manifestation.USER_ACTIVITY,
+			actor="application://eog.desktop",
+			subject_uri="file:///tmp/image.png"))
+		ids = map(int, self.insertEventsAndWait(events))
+
+		# Only old events matching the template are deleted
+		self.retention.AddPolicy("gedit",
+			Event.new_for_values(actor="application://gedit.desktop"), DAY)
+		self._wait(2)
+
+		remaining = self.findEventIdsAndWait([])
+		self.assertEquals(sorted(remaining), sorted(ids[3:]))
+
+if __name__ == "__main__":
+	unittest.main()
+
+# vim:noexpandtab:ts=4:sw=4
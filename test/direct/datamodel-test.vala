@@ -28,6 +28,7 @@ int main (string[] argv)
 
     Test.add_func ("/Datamodel/MatchesTemplate/anything", matches_template_anything_test);
     Test.add_func ("/Datamodel/MatchesTemplate/foreach", foreach_test);
+    Test.add_func ("/Datamodel/MatchesTemplate/noexpand", noexpand_test);
 
     return Test.run ();
 }
@@ -70,6 +71,23 @@ void matches_template_anything_test ()
     assert (!event.matches_template (templ));
 }
 
+void noexpand_test ()
+{
+    var event = new Event.full (ZG.ACCESS_EVENT, ZG.USER_ACTIVITY, "actor");
+    var templ = new Event.full (ZG.EVENT_INTERPRETATION);
+
+    // Without the no-expand operator children are matched
+    assert (event.matches_template (templ));
+
+    // With it, only the symbol itself
+    templ.interpretation = "+" + ZG.EVENT_INTERPRETATION;
+    assert (!event.matches_template (templ));
+    templ.interpretation = "+" + ZG.ACCESS_EVENT;
+    assert (event.matches_template (templ));
+    templ.interpretation = "!+" + ZG.EVENT_INTERPRETATION;
+    assert (event.matches_template (templ));
+}
+
 Subject create_subject ()
 {
     var s = new Subject ();
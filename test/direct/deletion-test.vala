@@ -0,0 +1,156 @@
+/* deletion-test.vala
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation, either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ */
+
+using Zeitgeist;
+using Zeitgeist.SQLite;
+using Assertions;
+
+int main (string[] args)
+{
+    Test.init (ref args);
+
+    // Do not abort on warning()s.
+    GLib.Log.set_always_fatal (LogLevelFlags.LEVEL_CRITICAL);
+
+    // This test will use the database, make sure it won't mess up
+    // the system.
+    assert (Environment.set_variable(
+        "ZEITGEIST_DATA_PATH", "/tmp/zeitgeist-tests", true));
+    assert (Environment.set_variable(
+        "ZEITGEIST_DATABASE_PATH", ":memory:", true));
+
+    Test.add_func ("/Deletion/chunks", chunked_deletion_test);
+    Test.add_func ("/Deletion/garbage_collection", garbage_collection_test);
+
+    return Test.run ();
+}
+
+private Event create_event (int64 timestamp, string uri, string text)
+{
+    var event = new Event.full (ZG.ACCESS_EVENT, ZG.USER_ACTIVITY,
+        "application://deletion-test.desktop", null);
+    event.timestamp = timestamp;
+    event.add_subject (new Subject.full (uri, NFO.DOCUMENT,
+        NFO.FILE_DATA_OBJECT, "text/plain", "file:///tmp", text, "local"));
+    return event;
+}
+
+private int count_rows (Database database, string table)
+{
+    int count = -1;
+    int rc = database.database.exec ("SELECT COUNT(*) FROM " + table,
+        (n_columns, values, column_names) =>
+        {
+            count = int.parse (values[0]);
+            return 0;
+        }, null);
+    assert (rc == Sqlite.OK);
+    return count;
+}
+
+public void chunked_deletion_test ()
+{
+    var engine = new Engine ();
+
+    // More events than are deleted by a single transaction
+    var events = new GenericArray<Event> ();
+    for (int i = 1; i <= 12000; ++i)
+        events.add (create_event (i, "file:///tmp/%d".printf (i), "text"));
+    uint32[] event_ids = engine.insert_events (events);
+
+    // Every other event, plus one which doesn't exist
+    uint32[] deleted_ids = {};
+    for (int i = 1; i < event_ids.length; i += 2)
+        deleted_ids += event_ids[i];
+    deleted_ids += 123456;
+
+    // Only the events which existed are reported
+    int notified = 0;
+    engine.events_deleted.connect ((time_range, ids) =>
+        {
+            notified += ids.length;
+        });
+
+    var loop = new MainLoop ();
+    TimeRange? time_range = null;
+    engine.delete_events_async.begin (deleted_ids, null, (obj, res) =>
+        {
+            time_range = engine.delete_events_async.end (res);
+            loop.quit ();
+        });
+    loop.run ();
+
+    assert (time_range != null);
+    assert_cmpint ((int) time_range.start, OperatorType.EQUAL, 2);
+    assert_cmpint ((int) time_range.end, OperatorType.EQUAL, 12000);
+    assert_cmpint (count_rows (engine.database, "event"),
+        OperatorType.EQUAL, 6000);
+    assert_cmpint (notified, OperatorType.EQUAL, 6000);
+
+    engine.close ();
+}
+
+public void garbage_collection_test ()
+{
+    var engine = new Engine ();
+
+    var events = new GenericArray<Event> ();
+    events.add (create_event (1, "file:///tmp/a", "shared"));
+    events.add (create_event (2, "file:///tmp/b", "shared"));
+    events.add (create_event (3, "file:///tmp/c", "unique"));
+    events[0].payload = new ByteArray.take ("shared".data);
+    events[1].payload = new ByteArray.take ("shared".data);
+    events[2].payload = new ByteArray.take ("unique".data);
+    uint32[] event_ids = engine.insert_events (events);
+
+    assert_cmpint (count_rows (engine.database, "payload"),
+        OperatorType.EQUAL, 2);
+
+    engine.delete_events ({ event_ids[1], event_ids[2] }, null);
+
+    // Wait for the collector to go through all tables
+    var loop = new MainLoop ();
+    Timeout.add_seconds (3, () => { loop.quit (); return false; });
+    loop.run ();
+
+    assert_cmpint (count_rows (engine.database,
+        "uri WHERE value IN ('file:///tmp/a', 'file:///tmp/b', " +
+        "'file:///tmp/c')"), OperatorType.EQUAL, 1);
+    assert_cmpint (count_rows (engine.database,
+        "text WHERE value IN ('shared', 'unique')"), OperatorType.EQUAL, 1);
+    assert_cmpint (count_rows (engine.database, "payload"),
+        OperatorType.EQUAL, 1);
+
+    // Values which were collected can be inserted again
+    events = new GenericArray<Event> ();
+    events.add (create_event (4, "file:///tmp/c", "unique"));
+    events[0].payload = new ByteArray.take ("unique".data);
+    event_ids = engine.insert_events (events);
+    assert (event_ids[0] != 0);
+
+    var result = engine.get_events (event_ids);
+    assert_cmpstr (result[0].subjects[0].uri, OperatorType.EQUAL,
+        "file:///tmp/c");
+    assert_cmpstr (result[0].subjects[0].text, OperatorType.EQUAL,
+        "unique");
+    assert_cmpint (count_rows (engine.database, "payload"),
+        OperatorType.EQUAL, 2);
+
+    engine.close ();
+}
+
+// vim:expandtab:ts=4:sw=4
@@ -39,6 +39,8 @@ int main (string[] args)
     Test.add_func ("/WhereClause/basic", basic_test);
     Test.add_func ("/WhereClause/delete_hook", engine_test);
     Test.add_func ("/WhereClause/get_value_query", get_value_with_query_test);
+    Test.add_func ("/WhereClause/try_string_query", try_string_with_query_test);
+    Test.add_func ("/IdCache/lru", id_cache_test);
 
     return Test.run ();
 }
@@ -81,6 +83,45 @@ public void get_value_with_query_test ()
     assert_cmpstr (table_lookup.get_value (100), OperatorType.EQUAL, "new-actor");
 }
 
+public void try_string_with_query_test ()
+{
+    Database database = new Zeitgeist.SQLite.Database ();
+    unowned Sqlite.Database db = database.database;
+    TableLookup table_lookup = new TableLookup (database, "actor");
+
+    assert_cmpint (table_lookup.id_try_string ("new-actor"), OperatorType.EQUAL, -1);
+
+    int rc = db.exec ("INSERT INTO actor (id, value) VALUES (100, 'new-actor')");
+    assert (rc == Sqlite.OK);
+
+    assert_cmpint (table_lookup.id_try_string ("new-actor"), OperatorType.EQUAL, 100);
+    assert_cmpstr (table_lookup.get_value (100), OperatorType.EQUAL, "new-actor");
+}
+
+public void id_cache_test ()
+{
+    IdCache cache = new IdCache (2);
+
+    cache.insert ("a", 1);
+    cache.insert ("b", 2);
+    assert_cmpint (cache.lookup ("a"), OperatorType.EQUAL, 1);
+
+    // "b" is the least recently used value now
+    cache.insert ("c", 3);
+    assert_cmpint (cache.lookup ("b"), OperatorType.EQUAL, 0);
+    assert_cmpint (cache.lookup ("a"), OperatorType.EQUAL, 1);
+    assert_cmpint (cache.lookup ("c"), OperatorType.EQUAL, 3);
+
+    cache.remove (3);
+    assert_cmpint (cache.lookup ("c"), OperatorType.EQUAL, 0);
+    cache.insert ("d", 4);
+    assert_cmpint (cache.lookup ("a"), OperatorType.EQUAL, 1);
+    assert_cmpint (cache.lookup ("d"), OperatorType.EQUAL, 4);
+
+    cache.clear ();
+    assert_cmpint (cache.lookup ("a"), OperatorType.EQUAL, 0);
+}
+
 public void engine_test ()
 {
     PublicEngine engine = new PublicEngine ();
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -.- coding: utf-8 -.-
+
+# Zeitgeist
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares construction time and memory usage of Event and CompactEvent
+# for a set of synthetic event structs, as received over D-Bus.
+#
+# Usage:
+#  tools/development/datamodel_benchmark.py --count 100000
+
+import sys
+import time
+import random
+
+from optparse import OptionParser
+
+from zeitgeist.datamodel import Event, CompactEvent, Interpretation, \
+    Manifestation
+
+ACTORS = ["application://%s.desktop" % name for name in
+    ("firefox", "gedit", "eog", "totem", "nautilus", "evince")]
+EVENT_INTERPRETATIONS = [Interpretation.ACCESS_EVENT,
+    Interpretation.MODIFY_EVENT, Interpretation.LEAVE_EVENT,
+    Interpretation.CREATE_EVENT]
+SUBJECT_INTERPRETATIONS = [Interpretation.DOCUMENT, Interpretation.IMAGE,
+    Interpretation.VIDEO, Interpretation.AUDIO, Interpretation.WEBSITE]
+MIMETYPES = ["text/plain", "image/png", "video/ogg", "audio/ogg",
+    "text/html", "application/pdf"]
+
+def get_cmdline():
+    parser = OptionParser()
+    parser.add_option("--count", dest="count", type="int", default=50000,
+        help="number of events to build")
+    parser.add_option("--uris", dest="uris", type="int", default=2000,
+        help="number of distinct subject URIs")
+    (options, args) = parser.parse_args()
+    assert not args
+    return options
+
+def make_structs(count, num_uris):
+    """
+    Return `count` event structs laid out as returned by GetEvents,
+    with all strings being fresh objects (as dbus-python creates them).
+    """
+    structs = []
+    timestamp = 1300000000000
+    for i in xrange(count):
+        n = random.randint(0, num_uris)
+        timestamp += random.randint(1, 60000)
+        structs.append((
+            [unicode(i + 1), unicode(timestamp),
+                unicode(random.choice(EVENT_INTERPRETATIONS)),
+                unicode(Manifestation.USER_ACTIVITY),
+                unicode(random.choice(ACTORS)), u""],
+            [[u"file:///home/user/file%d" % n,
+                unicode(random.choice(SUBJECT_INTERPRETATIONS)),
+                unicode(Manifestation.FILE_DATA_OBJECT),
+                u"file:///home/user", unicode(random.choice(MIMETYPES)),
+                u"file%d" % n, u"net", u"file:///home/user/file%d" % n,
+                u"file:///home/user"]],
+            []))
+    return structs
+
+def deep_sizeof(obj, seen=None):
+    """Return the size of `obj` and everything it references"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, basestring):
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+        return size
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    return size
+
+def measure(name, build, structs):
+    t1 = time.time()
+    events = build(structs)
+    elapsed = time.time() - t1
+    size = deep_sizeof(events)
+    print "%-14s %8.3fs %10.1f KiB %8.1f bytes/event" % (name, elapsed,
+        size / 1024.0, size / float(len(structs)))
+    return events
+
+if __name__ == "__main__":
+    options = get_cmdline()
+    structs = make_structs(options.count, options.uris)
+    print "%d events, %d distinct subject URIs" % (options.count, options.uris)
+    measure("Event", lambda s: map(Event, s), structs)
+    measure("CompactEvent", CompactEvent.new_for_structs, structs)
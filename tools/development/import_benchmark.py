@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# -.- coding: utf-8 -.-
+
+# Zeitgeist
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures how long it takes to import a module (zeitgeist.datamodel by
+# default) in a fresh interpreter, as paid by every short-lived script.
+# Byte-code caching must be possible (ie. PYTHONDONTWRITEBYTECODE unset)
+# for the results to be representative of an installed system.
+#
+# Usage:
+#  tools/development/import_benchmark.py --count 50
+#  tools/development/import_benchmark.py --statement \
+#      "from zeitgeist.datamodel import Interpretation; Interpretation.AUDIO"
+
+import sys
+import subprocess
+
+from optparse import OptionParser
+
+TIMER = """
+import time
+start = time.time()
+%s
+print "%%f" %% (time.time() - start)
+"""
+
+def get_cmdline():
+    parser = OptionParser()
+    parser.add_option("--count", dest="count", type="int", default=20,
+        help="number of interpreters to start")
+    parser.add_option("--module", dest="module", default="zeitgeist.datamodel",
+        help="module to import")
+    parser.add_option("--statement", dest="statement",
+        help="statement to time instead of the import")
+    (options, args) = parser.parse_args()
+    assert not args
+    return options
+
+def time_statement(statement):
+    """Return the seconds it takes to run `statement` in a new interpreter"""
+    output = subprocess.check_output([sys.executable, "-c", TIMER % statement])
+    return float(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    options = get_cmdline()
+    statement = options.statement or "import %s" % options.module
+    # Run once to make sure byte-code caches are in place
+    time_statement(statement)
+    timings = sorted(time_statement(statement) for i in xrange(options.count))
+    print "%s (%d runs)" % (statement, options.count)
+    print "  min:    %.2fms" % (timings[0] * 1000)
+    print "  median: %.2fms" % (timings[len(timings) / 2] * 1000)
+    print "  max:    %.2fms" % (timings[-1] * 1000)
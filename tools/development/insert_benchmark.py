@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -.- coding: utf-8 -.-
+
+# Zeitgeist
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the throughput of InsertEvents for calls inserting 1k, 10k
+# and 100k events at once. The events are inserted for real, so run it
+# against a daemon using a throwaway database:
+#
+# Usage:
+#  ZEITGEIST_DATABASE_PATH=/tmp/benchmark.sqlite zeitgeist-daemon --replace &
+#  tools/development/insert_benchmark.py --sizes 1000,10000,100000
+
+import time
+import random
+
+from optparse import OptionParser
+
+from zeitgeist.client import ZeitgeistDBusInterface
+from zeitgeist.datamodel import Event, Subject, Interpretation, \
+    Manifestation
+
+ACTORS = ["application://%s.desktop" % name for name in
+    ("firefox", "gedit", "eog", "totem", "nautilus", "evince")]
+EVENT_INTERPRETATIONS = [Interpretation.ACCESS_EVENT,
+    Interpretation.MODIFY_EVENT, Interpretation.LEAVE_EVENT,
+    Interpretation.CREATE_EVENT]
+MIMETYPES = ["text/plain", "image/png", "video/ogg", "audio/ogg",
+    "text/html", "application/pdf"]
+
+def get_cmdline():
+    parser = OptionParser()
+    parser.add_option("--sizes", dest="sizes", default="1000,10000,100000",
+        help="comma separated numbers of events inserted per call")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3,
+        help="number of calls for each size")
+    parser.add_option("--uris", dest="uris", type="int", default=5000,
+        help="number of distinct subject URIs")
+    parser.add_option("--subjects", dest="subjects", type="int", default=1,
+        help="number of subjects per event")
+    (options, args) = parser.parse_args()
+    assert not args
+    options.sizes = [int(size) for size in options.sizes.split(",")]
+    return options
+
+class EventFactory(object):
+
+    def __init__(self, num_uris, num_subjects):
+        self.num_uris = num_uris
+        self.num_subjects = num_subjects
+        # Timestamps are never reused, so that no event is a duplicate
+        self.timestamp = int(time.time() * 1000)
+
+    def make_events(self, count):
+        events = []
+        for i in xrange(count):
+            self.timestamp += 1
+            subjects = []
+            for n in random.sample(xrange(self.num_uris), self.num_subjects):
+                subjects.append(Subject.new_for_values(
+                    uri="file:///home/user/file%d" % n,
+                    interpretation=Interpretation.DOCUMENT,
+                    manifestation=Manifestation.FILE_DATA_OBJECT,
+                    origin="file:///home/user",
+                    mimetype=random.choice(MIMETYPES),
+                    text="file%d" % n))
+            events.append(Event.new_for_values(
+                timestamp=self.timestamp,
+                interpretation=random.choice(EVENT_INTERPRETATIONS),
+                manifestation=Manifestation.USER_ACTIVITY,
+                actor=random.choice(ACTORS),
+                subjects=subjects))
+        return events
+
+if __name__ == "__main__":
+    options = get_cmdline()
+    iface = ZeitgeistDBusInterface()
+    factory = EventFactory(options.uris, options.subjects)
+    for size in options.sizes:
+        timings = []
+        for i in xrange(options.repeat):
+            events = factory.make_events(size)
+            t1 = time.time()
+            ids = iface.InsertEvents(events, timeout=3600)
+            timings.append(time.time() - t1)
+            assert len(ids) == size and 0 not in ids
+        best = min(timings)
+        print "%7d events/call  best %8.3fs  mean %8.3fs  %10.0f events/s" % (
+            size, best, sum(timings) / len(timings), size / best)
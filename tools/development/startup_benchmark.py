@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -.- coding: utf-8 -.-
+
+# Zeitgeist
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures how long creating a ZeitgeistClient takes, which is what a
+# short-lived script pays before its first query, with a cold and with
+# a warm introspection cache. Each client gets its own bus connection,
+# like a freshly started process. Requires a running zeitgeist-daemon.
+#
+# Usage:
+#  tools/development/startup_benchmark.py --runs 50
+
+import os
+import time
+import shutil
+import tempfile
+
+from optparse import OptionParser
+
+import dbus
+
+from zeitgeist import client
+from zeitgeist.client import ZeitgeistClient, ZeitgeistDBusInterface
+
+def get_cmdline():
+    parser = OptionParser()
+    parser.add_option("--runs", dest="runs", type="int", default=20,
+        help="number of clients to create for each measurement")
+    (options, args) = parser.parse_args()
+    assert not args
+    return options
+
+def create_client():
+    """Create a client sharing no state with the previous ones"""
+    ZeitgeistDBusInterface._ZeitgeistDBusInterface__shared_state = {}
+    client._introspection_cache.invalidate()
+    client._set_bus(dbus.SessionBus(private=True))
+    t1 = time.time()
+    ZeitgeistClient()
+    elapsed = time.time() - t1
+    client.get_bus().close()
+    return elapsed
+
+def measure(name, runs, cold):
+    cache_path = client._IntrospectionCache.get_path()
+    timings = []
+    for i in xrange(runs):
+        if cold and os.path.exists(cache_path):
+            os.remove(cache_path)
+        timings.append(create_client())
+    timings.sort()
+    print "%-6s min %8.2fms  median %8.2fms  mean %8.2fms" % (name,
+        timings[0] * 1000, timings[len(timings) // 2] * 1000,
+        sum(timings) * 1000 / len(timings))
+
+if __name__ == "__main__":
+    options = get_cmdline()
+    # Keep the user's cache out of the measurements
+    cache_home = tempfile.mkdtemp(prefix="zeitgeist.benchmark.")
+    os.environ["XDG_CACHE_HOME"] = cache_home
+    try:
+        create_client() # Warm up the engine
+        measure("cold", options.runs, True)
+        create_client()
+        measure("warm", options.runs, False)
+    finally:
+        shutil.rmtree(cache_home)